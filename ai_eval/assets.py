@@ -0,0 +1,137 @@
+"""
+Static JS and CSS bundles served as public assets.
+
+Running `python ai_eval/assets.py` (or `make build_assets`) minifies the sources of
+each bundle into a content-hashed file under `ai_eval/public/bundles/` and records
+it in a manifest. Blocks then load the bundles by URL instead of inlining them, so
+browsers cache them across pages and blocks of the same type share them.
+
+When a bundle was not built, or was built from older sources, blocks inline its
+sources as before.
+
+The Monaco editor is vendored under `ai_eval/public/vendor/monaco/` by
+`make vendor_monaco`. When it is not, it is loaded from a CDN.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLES_DIR = "public/bundles"
+MANIFEST_PATH = f"{BUNDLES_DIR}/manifest.json"
+
+MONACO_VERSION = "0.49.0"
+MONACO_DIR = "public/vendor/monaco"
+MONACO_CDN_URL = f"https://cdn.jsdelivr.net/npm/monaco-editor@{MONACO_VERSION}"
+# Vendored web workers of the Monaco editor, by the language service they run
+MONACO_WORKERS = {
+    "editor": "editor.worker.js",
+    "json": "json.worker.js",
+    "css": "css.worker.js",
+    "html": "html.worker.js",
+    "typescript": "ts.worker.js",
+}
+
+# Bundle name -> source files, relative to the package
+BUNDLES = {
+    "utils.js": ["static/js/src/utils.js"],
+    "coding_ai_eval.js": ["static/js/src/coding_ai_eval.js"],
+    "coding_ai_eval.css": ["static/css/coding_ai_eval.css"],
+    "multi_file_coding_ai_eval.js": ["static/js/src/multi_file_coding_ai_eval.js"],
+    "multi_file_coding_ai_eval.css": ["static/css/multi_file_coding_ai_eval.css"],
+    "shortanswer.js": ["static/js/src/shortanswer.js"],
+    "shortanswer.css": ["static/css/shortanswer.css"],
+}
+
+
+def _read(path: str) -> bytes:
+    """
+    Read a file of the package.
+    """
+    with open(os.path.join(PACKAGE_DIR, path), "rb") as f:
+        return f.read()
+
+
+def get_sources_hash(sources: list[str]) -> str:
+    """
+    Get the hash of the given package source files.
+    """
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(_read(source))
+    return digest.hexdigest()
+
+
+@functools.cache
+def get_built_bundle_path(bundle: str) -> str | None:
+    """
+    Get the path of a built bundle, relative to the package.
+
+    Returns None when the bundle was not built, or when its sources changed since.
+    """
+    try:
+        manifest = json.loads(_read(MANIFEST_PATH))
+    except (FileNotFoundError, ValueError):
+        return None
+
+    entry = manifest.get(bundle)
+    if not entry or entry["sources_hash"] != get_sources_hash(BUNDLES[bundle]):
+        return None
+    return entry["path"]
+
+
+@functools.cache
+def is_monaco_vendored() -> bool:
+    """
+    Whether the Monaco editor was vendored into the package.
+    """
+    return os.path.exists(os.path.join(PACKAGE_DIR, MONACO_DIR, "editor.main.js"))
+
+
+def _minify(bundle: str, content: str) -> str:
+    """
+    Minify a bundle, when the optional minifiers are installed.
+    """
+    try:
+        if bundle.endswith(".js"):
+            import rjsmin  # pylint: disable=import-outside-toplevel
+            return rjsmin.jsmin(content)
+        import rcssmin  # pylint: disable=import-outside-toplevel
+        return rcssmin.cssmin(content)
+    except ImportError:
+        print(f"Minifier not installed, {bundle} is not minified.", file=sys.stderr)
+        return content
+
+
+def build_bundles() -> dict:
+    """
+    Build all bundles into content-hashed files, and write their manifest.
+    """
+    bundles_dir = os.path.join(PACKAGE_DIR, BUNDLES_DIR)
+    os.makedirs(bundles_dir, exist_ok=True)
+    for filename in os.listdir(bundles_dir):
+        os.remove(os.path.join(bundles_dir, filename))
+
+    manifest = {}
+    for bundle, sources in BUNDLES.items():
+        content = "\n".join(_read(source).decode("utf8") for source in sources)
+        content = _minify(bundle, content)
+        content_hash = hashlib.sha256(content.encode("utf8")).hexdigest()[:12]
+        name, extension = os.path.splitext(bundle)
+        path = f"{BUNDLES_DIR}/{name}.{content_hash}.min{extension}"
+        with open(os.path.join(PACKAGE_DIR, path), "w", encoding="utf8") as f:
+            f.write(content)
+        manifest[bundle] = {"path": path, "sources_hash": get_sources_hash(sources)}
+
+    with open(os.path.join(PACKAGE_DIR, MANIFEST_PATH), "w", encoding="utf8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    get_built_bundle_path.cache_clear()
+    return manifest
+
+
+if __name__ == "__main__":  # pragma: no cover
+    for bundle_name, bundle_entry in build_bundles().items():
+        print(f"{bundle_name} -> {bundle_entry['path']}")
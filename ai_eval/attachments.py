@@ -0,0 +1,404 @@
+"""
+Download of the attachments included in evaluation prompts.
+
+Downloaded attachments are kept in the Django cache with their validators
+(ETag and Last-Modified). An attachment is reused without any request while it
+is fresh, then revalidated with a conditional request, so an unchanged
+attachment is not downloaded again.
+
+Downloads run on a thread pool shared by the whole process, so the number of
+concurrent downloads stays bounded under load.
+
+Only the content and the validators of an attachment are kept in the Django
+cache, so an entry stays within the item size limit of memcached. The escaped
+prompt block of an attachment and its chunks are built once per process and
+version, and the blocks of all the attachments of a prompt are joined once per
+set of versions.
+Attachments are also split in chunks, indexed to only include the relevant ones
+in prompts when the attachments are too large.
+"""
+
+import hashlib
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ALL_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from xml.sax import saxutils
+
+from django.core.cache import cache
+
+from . import metrics
+from .llm import count_tokens
+from .retrieval import BM25Index, chunk_text
+from .utils import get_content_hash
+
+# Attachments larger than this are rejected, rather than sent to the model.
+ATTACHMENT_MAX_SIZE = 512 * 1024
+# Seconds an attachment is reused without revalidation, when its response does not
+# set a max-age.
+ATTACHMENT_DEFAULT_MAX_AGE = 5 * 60
+# Seconds an attachment is kept in the cache, to be revalidated.
+ATTACHMENT_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+# Seconds a single download may take, and all the downloads of a prompt together.
+ATTACHMENT_DOWNLOAD_TIMEOUT = 10
+ATTACHMENTS_DOWNLOAD_DEADLINE = 30
+ATTACHMENT_DOWNLOAD_WORKERS = 8
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+# An escaped entity cut by a truncation
+PARTIAL_ENTITY_RE = re.compile(r"&[a-z]*$")
+# The escaped filename and contents of an attachment block
+ATTACHMENT_RE = re.compile(r"<filename>(.*)</filename>\s*<contents>(.*)</contents>", re.DOTALL)
+
+ATTACHMENT_PROMPT_CACHE_SIZE = 256
+ATTACHMENTS_PROMPT_CACHE_SIZE = 256
+
+
+class AttachmentError(Exception):
+    """
+    Raised when an attachment can not be used.
+    """
+
+
+@dataclass(frozen=True)
+class AttachmentPrompt:
+    """
+    The block of an attachment in the evaluation prompt, and the blocks of its chunks.
+    """
+
+    version: str
+    text: str
+    chunks: tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class AttachmentsPrompt:
+    """
+    The blocks of all the attachments of an evaluation prompt.
+    """
+
+    text: str
+    tokens: int
+    chunks: tuple[str, ...] = ()
+    chunk_tokens: tuple[int, ...] = ()
+    index: BM25Index | None = None
+
+    def select(self, query: str, token_budget: int, top_k: int) -> str:
+        """
+        Get the attachments to include in a prompt, within a token budget.
+
+        When the attachments are over the budget, only their `top_k` chunks most
+        relevant to the query are included, in the order of the attachments. When
+        no chunk is relevant, or none fits, the leading chunks are included instead,
+        the first one truncated if it does not fit alone.
+
+        Args:
+            query: The text the chunks must be relevant to.
+            token_budget: The maximum number of tokens, 0 for no limit.
+            top_k: The maximum number of chunks.
+        """
+        if not token_budget or self.tokens <= token_budget or not self.index:
+            return self.text
+
+        selected = []
+        tokens = 0
+        for chunk in self.index.search(query, top_k):
+            if tokens + self.chunk_tokens[chunk] <= token_budget:
+                selected.append(chunk)
+                tokens += self.chunk_tokens[chunk]
+        if selected:
+            return "\n".join(self.chunks[chunk] for chunk in sorted(selected))
+        return self._get_leading_chunks(token_budget)
+
+    def _get_leading_chunks(self, token_budget: int) -> str:
+        """
+        Get the first chunks within a token budget, truncating the first one when it is over it.
+        """
+        selected = []
+        tokens = 0
+        for chunk, chunk_tokens in zip(self.chunks, self.chunk_tokens):
+            if tokens + chunk_tokens > token_budget:
+                break
+            selected.append(chunk)
+            tokens += chunk_tokens
+        if selected:
+            return "\n".join(selected)
+        # Only the contents are truncated, in proportion of the tokens and without leaving
+        # half an entity, then wrapped again so the tags of the block stay whole
+        chunk = self.chunks[0]
+        filename, contents = ATTACHMENT_RE.search(chunk).groups()
+        length = len(chunk) * token_budget // self.chunk_tokens[0] - (len(chunk) - len(contents))
+        truncated = PARTIAL_ENTITY_RE.sub("", contents[:max(length, 0)])
+        return _format_attachment(filename, saxutils.unescape(truncated))
+
+
+def filename_for_url(url: str) -> str:
+    """
+    Get the filename of an attachment from its URL.
+    """
+    return urllib.parse.urlparse(url).path.split("/")[-1]
+
+
+def make_attachment_prompt(url: str, content: str, version: str | None = None) -> AttachmentPrompt:
+    """
+    Build the escaped prompt block of an attachment.
+
+    The version identifies the content, its hash is used when the server sent no ETag.
+    """
+    filename = saxutils.escape(filename_for_url(url))
+    return AttachmentPrompt(
+        version=version or get_content_hash(content),
+        text=_format_attachment(filename, content),
+        chunks=tuple(_format_attachment(filename, chunk) for chunk in chunk_text(content)),
+    )
+
+
+def _format_attachment(filename: str, content: str) -> str:
+    return f"""
+                <attachment>
+                    <filename>{filename}</filename>
+                    <contents>{saxutils.escape(content)}</contents>
+                </attachment>
+            """
+
+
+def _get_cache_key(url: str) -> str:
+    return "ai_eval.attachment." + hashlib.sha256(url.encode("utf8")).hexdigest()
+
+
+def _get_max_age(headers) -> int:
+    """
+    Get the number of seconds a response can be reused for, from its Cache-Control.
+    """
+    cache_control = headers.get("Cache-Control", "")
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0
+    if match := MAX_AGE_RE.search(cache_control):
+        return int(match.group(1))
+    return ATTACHMENT_DEFAULT_MAX_AGE
+
+
+def _read_content(response, url: str) -> str:
+    """
+    Read the content of a response, up to the maximum attachment size.
+    """
+    content_length = response.headers.get("Content-Length")
+    if content_length and int(content_length) > ATTACHMENT_MAX_SIZE:
+        raise AttachmentError(f"Attachment {url} is larger than {ATTACHMENT_MAX_SIZE} bytes.")
+    content = response.read(ATTACHMENT_MAX_SIZE + 1)
+    if len(content) > ATTACHMENT_MAX_SIZE:
+        raise AttachmentError(f"Attachment {url} is larger than {ATTACHMENT_MAX_SIZE} bytes.")
+    return content.decode("utf-8")
+
+
+def _fetch_attachment(url: str, timeout: float) -> dict:
+    """
+    Get the cache entry of an attachment, downloading it again when it changed.
+    """
+    cache_key = _get_cache_key(url)
+    entry = cache.get(cache_key)
+    now = time.time()
+    if entry and entry["fresh_until"] > now:
+        return entry
+
+    request = urllib.request.Request(url)
+    if entry and entry["etag"]:
+        request.add_header("If-None-Match", entry["etag"])
+    if entry and entry["last_modified"]:
+        request.add_header("If-Modified-Since", entry["last_modified"])
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            headers = response.headers
+            content = _read_content(response, url)
+            entry = {
+                "content": content,
+                "version": headers.get("ETag") or get_content_hash(content),
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "max_age": _get_max_age(headers),
+            }
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or not entry:
+            raise
+        # Not modified, the cached content is still valid
+        if "Cache-Control" in e.headers:
+            entry["max_age"] = _get_max_age(e.headers)
+
+    entry["fresh_until"] = now + entry["max_age"]
+    cache.set(cache_key, entry, ATTACHMENT_CACHE_TIMEOUT)
+    return entry
+
+
+def download_attachment(url: str, timeout: float = ATTACHMENT_DOWNLOAD_TIMEOUT) -> str:
+    """
+    Get the content of an attachment, from the cache when it did not change.
+    """
+    return _fetch_attachment(url, timeout)["content"]
+
+
+# (URL, version) -> AttachmentPrompt
+_attachment_prompt_cache: dict[tuple[str, str], AttachmentPrompt] = {}
+
+
+def download_attachment_prompt(url: str, timeout: float = ATTACHMENT_DOWNLOAD_TIMEOUT) -> AttachmentPrompt:
+    """
+    Get the prompt block of an attachment, from the cache when it did not change.
+    """
+    entry = _fetch_attachment(url, timeout)
+    key = (url, entry.get("version") or get_content_hash(entry["content"]))
+    if key not in _attachment_prompt_cache:
+        if len(_attachment_prompt_cache) >= ATTACHMENT_PROMPT_CACHE_SIZE:
+            _attachment_prompt_cache.clear()
+        _attachment_prompt_cache[key] = make_attachment_prompt(url, entry["content"], key[1])
+    return _attachment_prompt_cache[key]
+
+
+class _DownloadExecutor:
+    """
+    Thread pool for attachment downloads, which publishes its queued and running downloads as gauges.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai_eval_attachments")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+
+    def submit(self, func, *args):
+        """
+        Schedule a call of `func` with the given arguments.
+        """
+        with self._lock:
+            self._queued += 1
+            self._publish()
+        future = self._executor.submit(self._run, func, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _run(self, func, *args):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._publish()
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._publish()
+
+    def _on_done(self, future):
+        # cancelled before they started, so never counted as running
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+                self._publish()
+
+    def _publish(self):
+        # Called with the lock held, so the gauges are set in the order of the changes
+        metrics.set_gauge(metrics.DOWNLOADS_QUEUED, (), self._queued)
+        metrics.set_gauge(metrics.DOWNLOADS_RUNNING, (), self._running)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_download_executor() -> _DownloadExecutor:
+    """
+    Get the download thread pool of the process, created on first use.
+    """
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = _DownloadExecutor(ATTACHMENT_DOWNLOAD_WORKERS)
+        return _executor
+
+
+def _download_before(download, url: str, deadline: float) -> str:
+    """
+    Download an attachment, within the time left before the deadline.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise AttachmentError(f"No time left to download attachment {url}.")
+    return download(url, timeout=min(ATTACHMENT_DOWNLOAD_TIMEOUT, remaining))
+
+
+def download_attachments(
+    urls: list[str],
+    download=download_attachment,
+    deadline: float = ATTACHMENTS_DOWNLOAD_DEADLINE,
+    cancel_on_error: bool = True,
+) -> list[str]:
+    """
+    Download attachments in parallel on the shared thread pool.
+
+    Args:
+        urls: The URLs of the attachments.
+        download: The function downloading one attachment, given its URL and a timeout.
+        deadline: Seconds all the downloads may take together.
+        cancel_on_error: Whether to cancel the downloads not started yet, as soon as
+            one of them fails.
+
+    Returns:
+        The contents of the attachments, in the order of their URLs.
+
+    Raises:
+        AttachmentError: When the downloads did not finish before the deadline.
+        The exception of the first failed download, otherwise.
+    """
+    end = time.monotonic() + deadline
+    executor = get_download_executor()
+    futures = [executor.submit(_download_before, download, url, end) for url in urls]
+    done, not_done = wait(
+        futures,
+        timeout=deadline,
+        return_when=FIRST_EXCEPTION if cancel_on_error else ALL_COMPLETED,
+    )
+
+    failed = next((future for future in futures if future in done and future.exception()), None)
+    if failed or not_done:
+        for future in not_done:
+            future.cancel()
+        if failed:
+            raise failed.exception()
+        raise AttachmentError(f"Attachments could not be downloaded within {deadline} seconds.")
+    return [future.result() for future in futures]
+
+
+# (model, attachment URLs and versions) -> AttachmentsPrompt
+_attachments_prompt_cache: dict[tuple, AttachmentsPrompt] = {}
+
+
+def get_attachments_prompt(urls: list[str], model: str, download=download_attachment_prompt) -> AttachmentsPrompt:
+    """
+    Get the prompt blocks of attachments, joined, counted and indexed once per set of versions.
+
+    Args:
+        urls: The URLs of the attachments.
+        model: The model the tokens are counted for.
+        download: The function getting the `AttachmentPrompt` of one attachment,
+            given its URL and a timeout.
+    """
+    attachments = download_attachments(urls, download)
+    key = (model, tuple(urls), tuple(attachment.version for attachment in attachments))
+    if key not in _attachments_prompt_cache:
+        if len(_attachments_prompt_cache) >= ATTACHMENTS_PROMPT_CACHE_SIZE:
+            _attachments_prompt_cache.clear()
+        text = "\n".join(attachment.text for attachment in attachments)
+        chunks = tuple(chunk for attachment in attachments for chunk in attachment.chunks)
+        _attachments_prompt_cache[key] = AttachmentsPrompt(
+            text=text,
+            tokens=count_tokens(model, text) if text else 0,
+            chunks=chunks,
+            chunk_tokens=tuple(count_tokens(model, chunk) for chunk in chunks),
+            index=BM25Index(chunks) if chunks else None,
+        )
+    return _attachments_prompt_cache[key]
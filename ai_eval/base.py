@@ -1,17 +1,34 @@
 """Base Xblock with AI evaluation."""
+import functools
+import json
+import time
+from importlib import metadata
 from typing import Self
 
 import pkg_resources
 
+from webob import Response
 from django.utils.translation import gettext_noop as _
 from xblock.core import XBlock
 from xblock.fields import String, Scope, Dict
 from xblock.utils.resources import ResourceLoader
 from xblock.utils.studio_editable import StudioEditableXBlockMixin
-from xblock.validation import ValidationMessage
+from xblock.validation import Validation, ValidationMessage
 
-from .compat import get_site_configuration_value
+from .assets import BUNDLES, get_built_bundle_path
+from .compat import SITE_CONFIGURATION_CACHE_TTL, get_site_configuration_value
 from .llm import SupportedModels
+from .metrics import render_prometheus, timed
+from .utils import get_content_hash, render_markdown_cached
+
+
+@functools.cache
+def get_package_version() -> str | None:
+    """Get the installed version of this package, if any."""
+    try:
+        return metadata.version("xblock-ai-eval")
+    except metadata.PackageNotFoundError:
+        return None
 
 
 @XBlock.wants("settings")
@@ -89,6 +106,16 @@ class AIEvalXBlock(StudioEditableXBlockMixin, XBlock):
 
     block_settings_key = "ai_eval"
 
+    # Package resources shared by all the blocks of the process.
+    # Keys include the package version, so an upgrade never serves stale content.
+    _resource_cache = {}
+
+    # Validation messages by block type, hash of the author-set fields and hash of the
+    # model configuration. They also expire with the site configuration, which provides
+    # the global API keys.
+    VALIDATION_CACHE_SIZE = 1024
+    _validation_cache = {}
+
     def _get_settings(self) -> dict:  # pragma: nocover
         """Get the XBlock settings bucket via the SettingsService."""
         settings_service = self.runtime.service(self, "settings")
@@ -98,9 +125,98 @@ class AIEvalXBlock(StudioEditableXBlockMixin, XBlock):
         return {}
 
     def resource_string(self, path):
-        """Handy helper for getting resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode("utf8")
+        """Handy helper for getting resources from our kit, read once per process."""
+        key = (get_package_version(), path)
+        if key not in self._resource_cache:
+            data = pkg_resources.resource_string(__name__, path)
+            self._resource_cache[key] = data.decode("utf8")
+        return self._resource_cache[key]
+
+    def add_bundle(self, frag, bundle):
+        """
+        Add a JS or CSS bundle to a fragment.
+
+        Built bundles are loaded from their content-hashed public URL, so browsers
+        can cache them. Otherwise, their sources are inlined in the fragment.
+        """
+        is_js = bundle.endswith(".js")
+        if path := get_built_bundle_path(bundle):
+            url = self.runtime.local_resource_url(self, path)
+            if is_js:
+                frag.add_javascript_url(url)
+            else:
+                frag.add_css_url(url)
+            return
+
+        for source in BUNDLES[bundle]:
+            if is_js:
+                frag.add_javascript(self.resource_string(source))
+            else:
+                frag.add_css(self.resource_string(source))
+
+    def get_settings_hash(self):
+        """
+        Get a hash of the values of the fields set by course authors.
+        """
+        values = {
+            name: field.read_json(self)
+            for name, field in self.fields.items()
+            if field.scope in (Scope.settings, Scope.content)
+        }
+        return get_content_hash(json.dumps(values, sort_keys=True, default=str))
+
+    def get_model_configuration_hash(self):
+        """
+        Get a hash of the model API key and URL, which can come from the site configuration.
+        """
+        try:
+            values = [self.get_model_api_key(), self.get_model_api_url()]
+        except ValueError:
+            # Unsupported model, reported by the validation
+            values = []
+        return get_content_hash(json.dumps(values))
+
+    def get_cached_validation(self):
+        """
+        Validate the block, reusing the result while its fields and configuration do not change.
+
+        The messages are cached rather than the validation, which belongs to a block.
+        """
+        key = (type(self).__name__, self.get_settings_hash(), self.get_model_configuration_hash())
+        now = time.monotonic()
+        cached = self._validation_cache.get(key)
+        if cached and cached[0] > now:
+            messages = cached[1]
+        else:
+            if len(self._validation_cache) >= self.VALIDATION_CACHE_SIZE:
+                self._validation_cache.clear()
+            messages = self.validate().messages
+            self._validation_cache[key] = (now + SITE_CONFIGURATION_CACHE_TTL, messages)
+
+        validation = Validation(self.scope_ids.usage_id)
+        for message in messages:
+            validation.add(message)
+        return validation
+
+    @timed("state", "save")
+    def save(self):
+        """Save the fields of the block, observing how long writing the learner state takes."""
+        super().save()
+
+    @XBlock.handler
+    def metrics(self, request, suffix=""):  # pylint: disable=unused-argument
+        """
+        Get the latency metrics of the process in the Prometheus text format, for staff.
+        """
+        if not getattr(self.runtime, "user_is_staff", False):
+            return Response(status=403)
+        return Response(render_prometheus(), content_type="text/plain; version=0.0.4", charset="utf-8")
+
+    def get_question_html(self):
+        """
+        Get the question rendered to sanitized HTML, once per process and question text.
+        """
+        return render_markdown_cached(self.question)
 
     def _get_model_config_value(self, config_parameter: str, obj: Self = None) -> str | None:
         """
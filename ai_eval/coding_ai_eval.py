@@ -1,20 +1,36 @@
 """Coding Xblock with AI evaluation."""
 
+import json
 import logging
+import math
 import traceback
-import pkg_resources
-
+from datetime import datetime, timezone
 
+from django.core.cache import cache
 from django.utils.translation import gettext_noop as _
 from web_fragments.fragment import Fragment
 from xblock.core import XBlock
 from xblock.exceptions import JsonHandlerError
-from xblock.fields import Dict, Scope, String
+from xblock.fields import Boolean, Dict, List, Scope, String
 from xblock.validation import ValidationMessage
 
+from .assets import MONACO_CDN_URL, MONACO_DIR, MONACO_WORKERS, is_monaco_vendored
 from .llm import get_llm_response
+from .metrics import instrument_handler
 from .base import AIEvalXBlock
+from .similarity import (
+    SUBMISSION_CLUSTERS_TIMEOUT,
+    SubmissionClusters,
+    cluster_submission,
+    get_clustering_executor,
+    get_normalized_hash,
+    normalize_code,
+)
 from .utils import (
+    apply_text_diff,
+    get_content_hash,
+    make_text_diff,
+    render_markdown,
     submit_code,
     get_submission_result,
     SUPPORTED_LANGUAGE_MAP,
@@ -25,6 +41,7 @@ logger = logging.getLogger(__name__)
 
 USER_RESPONSE = "USER_RESPONSE"
 AI_EVALUATION = "AI_EVALUATION"
+AI_EVALUATION_HTML = "AI_EVALUATION_HTML"
 CODE_EXEC_RESULT = "CODE_EXEC_RESULT"
 
 
@@ -35,6 +52,14 @@ class CodingAIEvalXBlock(AIEvalXBlock):
 
     has_author_view = True
 
+    # Attempts kept in the history, the oldest ones are dropped first
+    MAX_ATTEMPT_HISTORY = 100
+    # Every Nth attempt stores the full code, the others a diff with the previous one
+    ATTEMPT_SNAPSHOT_INTERVAL = 10
+    # Characters of the AI evaluation and of each output kept per attempt
+    MAX_ATTEMPT_TEXT_LENGTH = 4000
+    MAX_ATTEMPT_HISTORY_PAGE_SIZE = 50
+
     display_name = String(
         display_name=_("Display Name"),
         help=_("Name of the component in the studio"),
@@ -67,13 +92,27 @@ class CodingAIEvalXBlock(AIEvalXBlock):
         scope=Scope.user_state,
         default={USER_RESPONSE: "", AI_EVALUATION: "", CODE_EXEC_RESULT: {}},
     )
+    attempt_history = List(
+        help=_(
+            "Evaluated attempts, oldest first. Each one stores either the full code"
+            " or a diff with the code of the previous attempt, and its evaluation and"
+            " output unless they are the same as the previous attempt."
+        ),
+        scope=Scope.user_state,
+        default=[],
+    )
 
-    editable_fields = AIEvalXBlock.editable_fields + ("judge0_api_key", "language")
+    reuse_similar_evaluations = Boolean(
+        display_name=_("Reuse evaluations of identical code"),
+        help=_(
+            "Give the AI evaluation of an earlier submission to code which only differs from it"
+            " by its whitespace or comments, and has the same output."
+        ),
+        default=False,
+        scope=Scope.settings,
+    )
 
-    def resource_string(self, path):
-        """Handy helper for getting resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode("utf8")
+    editable_fields = AIEvalXBlock.editable_fields + ("judge0_api_key", "language", "reuse_similar_evaluations")
 
     def student_view(self, context=None):
         """
@@ -88,35 +127,50 @@ class CodingAIEvalXBlock(AIEvalXBlock):
         )
 
         frag = Fragment(html)
-        frag.add_css(self.resource_string("static/css/coding_ai_eval.css"))
-        frag.add_javascript(self.resource_string("static/js/src/utils.js"))
-
-        frag.add_javascript(self.resource_string("static/js/src/coding_ai_eval.js"))
+        self.add_bundle(frag, "coding_ai_eval.css")
+        self.add_bundle(frag, "utils.js")
+        self.add_bundle(frag, "coding_ai_eval.js")
 
-        monaco_html = self.loader.render_django_template(
-            "/templates/monaco.html",
-            {
-                "monaco_language": SUPPORTED_LANGUAGE_MAP[self.language].monaco_id,
-            },
-        )
-        marked_html = self.resource_string("static/html/marked-iframe.html")
         js_data = {
-            "monaco_html": monaco_html,
-            "question": self.question,
+            "monaco": self.get_monaco_config(),
+            "question_html": self.get_question_html(),
             "code": self.messages[USER_RESPONSE],
-            "ai_evaluation": self.messages[AI_EVALUATION],
+            "ai_evaluation_html": self.get_ai_evaluation_html(),
             "code_exec_result": self.messages[CODE_EXEC_RESULT],
-            "marked_html": marked_html,
             "language": self.language,
         }
         frag.initialize_js("CodingAIEvalXBlock", js_data)
         return frag
 
+    def get_monaco_config(self):
+        """
+        Get the URLs the Monaco editor is loaded from, and the language of the editor.
+
+        The vendored editor is preferred. Otherwise the editor is loaded from a CDN,
+        and runs its language services without web workers.
+        """
+        if is_monaco_vendored():
+            return {
+                "js_url": self.runtime.local_resource_url(self, f"{MONACO_DIR}/editor.main.js"),
+                "css_url": self.runtime.local_resource_url(self, f"{MONACO_DIR}/editor.main.css"),
+                "worker_urls": {
+                    service: self.runtime.local_resource_url(self, f"{MONACO_DIR}/{filename}")
+                    for service, filename in MONACO_WORKERS.items()
+                },
+                "language": SUPPORTED_LANGUAGE_MAP[self.language].monaco_id,
+            }
+        return {
+            "js_url": f"{MONACO_CDN_URL}/+esm",
+            "css_url": f"{MONACO_CDN_URL}/min/vs/editor/editor.main.css",
+            "worker_urls": None,
+            "language": SUPPORTED_LANGUAGE_MAP[self.language].monaco_id,
+        }
+
     def author_view(self, context=None):
         """
         Create preview to be show to course authors in Studio.
         """
-        if not self.validate():
+        if not self.get_cached_validation():
             fragment = Fragment()
             fragment.add_content(
                 _(
@@ -141,9 +195,45 @@ class CodingAIEvalXBlock(AIEvalXBlock):
                 )
             )
 
+    def get_ai_evaluation_html(self):
+        """
+        Get the last AI evaluation rendered to HTML.
+
+        Evaluations stored before their HTML was kept are rendered on the fly.
+        """
+        if AI_EVALUATION_HTML in self.messages:
+            return self.messages[AI_EVALUATION_HTML]
+        return render_markdown(self.messages.get(AI_EVALUATION, ""))
+
     @XBlock.json_handler
+    @instrument_handler
     def get_response(self, data, suffix=""):  # pylint: disable=unused-argument
         """Get LLM feedback."""
+        code_exec_result = {"stdout": data["stdout"], "stderr": data["stderr"]}
+        response = None
+        if self.reuse_similar_evaluations:
+            evaluation_key = self._get_evaluation_cache_key(data["code"], code_exec_result)
+            response = cache.get(evaluation_key)
+        if not response:
+            response = self._get_llm_evaluation(data)
+            if response and self.reuse_similar_evaluations:
+                cache.set(evaluation_key, response, SUBMISSION_CLUSTERS_TIMEOUT)
+
+        if response:
+            self.messages[USER_RESPONSE] = data["code"]
+            self.messages[AI_EVALUATION] = response
+            self.messages[AI_EVALUATION_HTML] = render_markdown(response)
+            self.messages[CODE_EXEC_RESULT] = code_exec_result
+            self._record_attempt(data["code"], response, self.messages[CODE_EXEC_RESULT])
+            self._add_to_submission_clusters(data["code"])
+            return {"response": response, "response_html": self.messages[AI_EVALUATION_HTML]}
+
+        raise JsonHandlerError(500, "No AI Evaluation available. Please retry.")
+
+    def _get_llm_evaluation(self, data):
+        """
+        Get the AI evaluation of a submission from the model.
+        """
 
         answer = f"""
         student code :
@@ -198,19 +288,48 @@ class CodingAIEvalXBlock(AIEvalXBlock):
                 f"Failed while making LLM request using model {self.model}. Eaised error type: {type(e)}, Error: {e}"
             )
             raise JsonHandlerError(500, "A probem occured. Please retry.") from e
+        return response
 
-        if response:
-            self.messages[USER_RESPONSE] = data["code"]
-            self.messages[AI_EVALUATION] = response
-            self.messages[CODE_EXEC_RESULT] = {
-                "stdout": data["stdout"],
-                "stderr": data["stderr"],
-            }
-            return {"response": response}
+    def _get_submission_clusters(self):
+        """
+        Get the clusters of the submissions of all the students to this block.
+        """
+        return SubmissionClusters(str(self.scope_ids.usage_id))
 
-        raise JsonHandlerError(500, "No AI Evaluation available. Please retry.")
+    def _get_evaluation_cache_key(self, code, code_exec_result):
+        """
+        Get the cache key of the AI evaluation of some code and its output.
+
+        The code is normalized keeping its names, so only code differing by its
+        whitespace or comments shares an evaluation.
+        """
+        code_hash = get_normalized_hash(normalize_code(code, self.language, keep_names=True))
+        values = [str(self.scope_ids.usage_id), self.get_settings_hash(), code_hash, code_exec_result]
+        return "ai_eval.evaluation." + get_content_hash(json.dumps(values, sort_keys=True))
+
+    def _add_to_submission_clusters(self, code):
+        """
+        Count an evaluated submission in its cluster, or make it a new cluster, in the background.
+        """
+        get_clustering_executor().submit(
+            cluster_submission, str(self.scope_ids.usage_id), code, self.language, str(self.scope_ids.user_id)
+        )
 
     @XBlock.json_handler
+    @instrument_handler
+    def get_submission_clusters(self, data, suffix=""):  # pylint: disable=unused-argument
+        """
+        Get the clusters of similar submissions, largest first, for instructors to review.
+
+        Each cluster has its size, the code of its first submission and the user ids of
+        its first members.
+        """
+        if not getattr(self.runtime, "user_is_staff", False):
+            raise JsonHandlerError(403, "Only course staff can review submissions.")
+        return {"clusters": self._get_submission_clusters().get_clusters()}
+
+    @XBlock.json_handler
+    @instrument_handler
     def submit_code_handler(self, data, suffix=""):  # pylint: disable=unused-argument
         """
         Submit code to Judge0.
@@ -221,14 +340,120 @@ class CodingAIEvalXBlock(AIEvalXBlock):
         return {"submission_id": submission_id}
 
     @XBlock.json_handler
+    @instrument_handler
+    def get_attempt_history(self, data, suffix=""):  # pylint: disable=unused-argument
+        """
+        Get a page of the attempt history, newest attempts first.
+        """
+        try:
+            page = max(int(data.get("page", 1)), 1)
+            page_size = min(max(int(data.get("page_size", 10)), 1), self.MAX_ATTEMPT_HISTORY_PAGE_SIZE)
+        except (TypeError, ValueError) as e:
+            raise JsonHandlerError(400, "Invalid page parameters") from e
+
+        history = self.attempt_history
+        total = len(history)
+        # Pages count from the newest attempt
+        end = max(total - (page - 1) * page_size, 0)
+        start = max(end - page_size, 0)
+        attempts = list(self._iter_attempts(history, start, end))
+        attempts.reverse()
+        return {
+            "attempts": attempts,
+            "page": page,
+            "num_pages": math.ceil(total / page_size),
+            "total": total,
+        }
+
+    def _truncate_attempt_text(self, text):
+        """Truncate a text stored in the attempt history."""
+        if not isinstance(text, str) or len(text) <= self.MAX_ATTEMPT_TEXT_LENGTH:
+            return text
+        return text[:self.MAX_ATTEMPT_TEXT_LENGTH] + "\n[truncated]"
+
+    def _record_attempt(self, code, ai_evaluation, code_exec_result):
+        """
+        Add an evaluated attempt to the history.
+
+        The code is stored as a diff with the previous attempt, unless a snapshot is
+        due or the diff would not be smaller than the code itself. The evaluation and
+        the output are truncated, and left out when they are the same as the ones of
+        the previous attempt. The history thus grows with the size of the edits rather
+        than the size of the code and of its output.
+        """
+        history = self.attempt_history
+        attempt = {
+            "number": history[-1]["number"] + 1 if history else 1,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        ai_evaluation = self._truncate_attempt_text(ai_evaluation)
+        code_exec_result = {
+            key: self._truncate_attempt_text(value) for key, value in (code_exec_result or {}).items()
+        }
+
+        snapshot_due = True
+        if history:
+            last_snapshot = next(i for i in reversed(range(len(history))) if "code" in history[i])
+            snapshot_due = len(history) - last_snapshot >= self.ATTEMPT_SNAPSHOT_INTERVAL
+        if not snapshot_due:
+            previous = next(self._iter_attempts(history, len(history) - 1, len(history)))
+            diff = make_text_diff(previous["code"], code)
+            if len(json.dumps(diff)) < len(code):
+                attempt["diff"] = diff
+                if ai_evaluation != previous["ai_evaluation"]:
+                    attempt["ai_evaluation"] = ai_evaluation
+                if code_exec_result != previous["code_exec_result"]:
+                    attempt["code_exec_result"] = code_exec_result
+        if "diff" not in attempt:
+            # Attempts with their full code are snapshots, they store everything
+            attempt.update(code=code, ai_evaluation=ai_evaluation, code_exec_result=code_exec_result)
+
+        history.append(attempt)
+
+        # Drop the oldest attempts, the first one kept must hold its full code and results
+        excess = len(history) - self.MAX_ATTEMPT_HISTORY
+        if excess > 0:
+            first = next(self._iter_attempts(history, excess, excess + 1))
+            self.attempt_history = [first] + history[excess + 1:]
+
+    @staticmethod
+    def _iter_attempts(history, start, end):
+        """
+        Yield the attempts `history[start:end]` with their full code, evaluation and output.
+
+        They are rebuilt from the last snapshot at or before `start`, which stores them all.
+        """
+        index = start
+        while index > 0 and "code" not in history[index]:
+            index -= 1
+        code, ai_evaluation, code_exec_result = "", "", {}
+        for position in range(index, end):
+            attempt = history[position]
+            code = attempt["code"] if "code" in attempt else apply_text_diff(code, attempt["diff"])
+            ai_evaluation = attempt.get("ai_evaluation", ai_evaluation)
+            code_exec_result = attempt.get("code_exec_result", code_exec_result)
+            if position >= start:
+                yield {
+                    "number": attempt["number"],
+                    "timestamp": attempt["timestamp"],
+                    "code": code,
+                    "ai_evaluation": ai_evaluation,
+                    "code_exec_result": code_exec_result,
+                }
+
+    @XBlock.json_handler
+    @instrument_handler
     def reset_handler(self, data, suffix=""):  # pylint: disable=unused-argument
         """
         Reset the Xblock.
+
+        The attempt history is kept.
         """
         self.messages = {USER_RESPONSE: "", AI_EVALUATION: "", CODE_EXEC_RESULT: {}}
         return {"message": "reset successful."}
 
     @XBlock.json_handler
+    @instrument_handler
     def get_submission_result_handler(
         self, data, suffix=""
     ):  # pylint: disable=unused-argument
@@ -1,9 +1,23 @@
 """Compatibility layer for Open edX."""
 
-from typing import Any
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterator
 
 from django.conf import settings
 
+# Seconds a site configuration is cached for. Saving a site configuration clears the
+# cache of the process it was saved in, other processes see the change on expiry.
+SITE_CONFIGURATION_CACHE_TTL = 300
+
+# Learner states read per query, when iterating over the states of a course
+STUDENT_STATES_BATCH_SIZE = 1000
+
+# (domain, key) -> (expiry time, value)
+_site_configuration_cache: dict[tuple[str, str], tuple[float, Any]] = {}
+
 
 def _get_current_site_configuration_value(key: str, default: Any = None) -> Any:  # pragma: no cover
     """
@@ -36,6 +50,7 @@ def _get_site_configuration_value(domain: str, key: str, default: Any = None) ->
     # pylint: disable=import-error,import-outside-toplevel
     from openedx.core.djangoapps.site_configuration.models import SiteConfiguration
 
+    _connect_site_configuration_cache_invalidation()
     try:
         config = SiteConfiguration.objects.get(site__domain=domain).site_values
         return config.get(key, default)
@@ -43,6 +58,52 @@ def _get_site_configuration_value(domain: str, key: str, default: Any = None) ->
         return default
 
 
+def _connect_site_configuration_cache_invalidation():  # pragma: no cover
+    """
+    Clear the site configuration cache when a site configuration is saved.
+
+    Connected on the first lookup, as the model is only available in Open edX.
+    """
+    # pylint: disable=import-error,import-outside-toplevel
+    from django.db.models.signals import post_save
+    from openedx.core.djangoapps.site_configuration.models import SiteConfiguration
+
+    post_save.connect(
+        clear_site_configuration_cache,
+        sender=SiteConfiguration,
+        dispatch_uid="ai_eval.compat.clear_site_configuration_cache",
+    )
+
+
+def clear_site_configuration_cache(**kwargs):  # pylint: disable=unused-argument
+    """
+    Clear the cached site configuration values.
+    """
+    _site_configuration_cache.clear()
+
+
+def _get_cached_site_configuration_value(domain: str, key: str, default: Any = None) -> Any:
+    """
+    Get value from the site configuration for a given domain, cached for a while.
+
+    Args:
+        domain: The domain to retrieve site configuration for.
+        key: The key to retrieve from the site configuration.
+        default: The default value to return if the key is not found.
+
+    Returns:
+        The value associated with the key, or the default value.
+    """
+    now = time.monotonic()
+    cached = _site_configuration_cache.get((domain, key))
+    if cached and cached[0] > now:
+        return cached[1]
+
+    value = _get_site_configuration_value(domain, key, default)
+    _site_configuration_cache[(domain, key)] = (now + SITE_CONFIGURATION_CACHE_TTL, value)
+    return value
+
+
 def get_site_configuration_value(block_settings_key: str, config_key: str) -> str | None:
     """
     Retrieve configuration value from site configuration based on execution context.
@@ -57,7 +118,8 @@ def get_site_configuration_value(block_settings_key: str, config_key: str) -> st
 
     This special handling is necessary because when an XBlock is being edited in Studio,
     it needs to access API keys that are stored in the corresponding LMS site configuration,
-    not in the Studio site configuration.
+    not in the Studio site configuration. As Studio looks them up for every block it
+    renders, they are cached for `SITE_CONFIGURATION_CACHE_TTL` seconds.
 
     Args:
         block_settings_key: The key under which block settings are stored.
@@ -71,5 +133,71 @@ def get_site_configuration_value(block_settings_key: str, config_key: str) -> st
         return block_config.get(config_key)
 
     lms_base = _get_current_site_configuration_value("LMS_BASE", getattr(settings, "LMS_BASE", None))
-    block_config = _get_site_configuration_value(lms_base, block_settings_key, {})
+    block_config = _get_cached_site_configuration_value(lms_base, block_settings_key, {})
     return block_config.get(config_key)
+
+
+@dataclass(frozen=True)
+class StudentState:
+    """
+    The state of a block for a learner.
+    """
+
+    block_id: str
+    username: str
+    modified: datetime | None
+    state: dict
+
+
+def iter_student_states(
+    course_id: str,
+    block_type: str,
+    block_ids: list[str] | None = None,
+) -> Iterator[StudentState]:  # pragma: no cover
+    """
+    Iterate over the states of the blocks of a type in a course, for all the learners.
+
+    The states are sorted by block. They are read in batches of consecutive IDs,
+    each one a separate query, so memory does not grow with the size of the course:
+    the MySQL driver buffers whole results, even with `QuerySet.iterator()`.
+
+    Args:
+        course_id: The course to get the states of.
+        block_type: The type of the blocks, as in the course XML.
+        block_ids: The usage keys of the blocks, all the blocks of the type by default.
+    """
+    # pylint: disable=import-error,import-outside-toplevel
+    from lms.djangoapps.courseware.models import StudentModule
+    from opaque_keys.edx.keys import CourseKey, UsageKey
+
+    modules = StudentModule.objects.filter(course_id=CourseKey.from_string(course_id), module_type=block_type)
+    if block_ids is None:
+        block_keys = list(modules.values_list("module_state_key", flat=True).distinct().order_by("module_state_key"))
+    else:
+        block_keys = [UsageKey.from_string(block_id) for block_id in block_ids]
+
+    for block_key in block_keys:
+        last_id = 0
+        while True:
+            batch = list(
+                modules.filter(module_state_key=block_key, id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "student__username", "modified", "state")[:STUDENT_STATES_BATCH_SIZE]
+            )
+            for _, username, modified, state in batch:
+                yield StudentState(str(block_key), username, modified, json.loads(state or "{}"))
+            if len(batch) < STUDENT_STATES_BATCH_SIZE:
+                break
+            last_id = batch[-1][0]
+
+
+def get_course_blocks(course_id: str, block_type: str) -> dict[str, Any]:  # pragma: no cover
+    """
+    Get the blocks of a type in a course, by usage key.
+    """
+    # pylint: disable=import-error,import-outside-toplevel
+    from opaque_keys.edx.keys import CourseKey
+    from xmodule.modulestore.django import modulestore
+
+    blocks = modulestore().get_items(CourseKey.from_string(course_id), qualifiers={"category": block_type})
+    return {str(block.location): block for block in blocks}
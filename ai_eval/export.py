@@ -0,0 +1,100 @@
+"""
+Export of the code submitted by learners, with its output and AI evaluation.
+
+Rows are produced by generators from the learner states streamed from the
+database, and written as they come, so memory does not grow with the size of
+the exported course.
+"""
+
+import csv
+import gzip
+import json
+from typing import Iterable, Iterator, TextIO
+
+from .coding_ai_eval import AI_EVALUATION, CODE_EXEC_RESULT, USER_RESPONSE
+from .compat import StudentState
+
+EXPORT_FORMATS = ("jsonl", "csv")
+EXPORT_FIELDS = [
+    "block_id",
+    "block_type",
+    "learner",
+    "modified",
+    "code",
+    "stdout",
+    "stderr",
+    "ai_evaluation",
+    "project_files",
+]
+
+
+def iter_submission_rows(block_type: str, states: Iterable[StudentState]) -> Iterator[dict]:
+    """
+    Get the export rows of learner states, skipping the learners who submitted nothing.
+
+    The files of multi-file projects are exported by filename.
+    """
+    for student in states:
+        messages = student.state.get("messages", {})
+        code_exec_result = messages.get(CODE_EXEC_RESULT) or {}
+        project_files = {
+            filename: file_data.get("content", "")
+            for filename, file_data in student.state.get("project_files", {}).items()
+        }
+        if not messages.get(USER_RESPONSE) and not project_files:
+            continue
+        yield {
+            "block_id": student.block_id,
+            "block_type": block_type,
+            "learner": student.username,
+            "modified": student.modified.isoformat() if student.modified else None,
+            "code": messages.get(USER_RESPONSE, ""),
+            "stdout": code_exec_result.get("stdout", ""),
+            "stderr": code_exec_result.get("stderr", ""),
+            "ai_evaluation": messages.get(AI_EVALUATION, ""),
+            "project_files": project_files,
+        }
+
+
+def write_jsonl(rows: Iterable[dict], output: TextIO) -> int:
+    """
+    Write rows as JSON lines, and return their number.
+    """
+    count = 0
+    for row in rows:
+        output.write(json.dumps(row, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(rows: Iterable[dict], output: TextIO) -> int:
+    """
+    Write rows as CSV, and return their number.
+
+    The project files are written as a JSON object.
+    """
+    writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow({**row, "project_files": json.dumps(row["project_files"], ensure_ascii=False)})
+        count += 1
+    return count
+
+
+def write_export(rows: Iterable[dict], output: TextIO, export_format: str) -> int:
+    """
+    Write rows in the given format, and return their number.
+    """
+    if export_format == "csv":
+        return write_csv(rows, output)
+    return write_jsonl(rows, output)
+
+
+def open_export_file(path: str, compress: bool = False) -> TextIO:
+    """
+    Open the file an export is written to, gzip-compressed or not.
+    """
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")  # pylint: disable=consider-using-with
@@ -3,7 +3,9 @@ Integration with LLMs.
 """
 
 from enum import Enum
-from litellm import completion
+from litellm import completion, token_counter
+
+from .metrics import timed
 
 
 class SupportedModels(Enum):
@@ -22,6 +24,7 @@ class SupportedModels(Enum):
         return [str(m.value) for m in SupportedModels]
 
 
+@timed("llm", "completion")
 def get_llm_response(
     model: SupportedModels, api_key: str, messages: list, api_base: str
 ) -> str:
@@ -64,3 +67,10 @@ def get_llm_response(
         .choices[0]
         .message.content
     )
+
+
+def count_tokens(model: str, text: str) -> int:
+    """
+    Count the tokens of a text, with the tokenizer of the given model.
+    """
+    return token_counter(model=model, text=text)
@@ -0,0 +1,54 @@
+"""
+Export the code, output and AI evaluation of the learners of the coding blocks of a course.
+
+    ./manage.py lms ai_eval_export_submissions course-v1:Org+Course+Run --format csv --output export.csv.gz --gzip
+"""
+
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_eval.compat import iter_student_states
+from ai_eval.export import EXPORT_FORMATS, iter_submission_rows, open_export_file, write_export
+
+BLOCK_TYPES = ("coding_ai_eval", "multi_file_coding_ai_eval")
+
+
+class Command(BaseCommand):
+    """
+    Export the submissions of the coding blocks of a course, as JSON lines or CSV.
+    """
+
+    help = "Export the submissions of the coding blocks of a course, as JSON lines or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_id")
+        parser.add_argument(
+            "--block", dest="block_ids", action="append",
+            help="Usage key of a block to export, all the coding blocks of the course by default.",
+        )
+        parser.add_argument("--block-type", choices=BLOCK_TYPES, help="Type of the blocks given with --block.")
+        parser.add_argument("--format", dest="export_format", choices=EXPORT_FORMATS, default="jsonl")
+        parser.add_argument("--output", help="File to write the export to, instead of the standard output.")
+        parser.add_argument("--gzip", action="store_true", help="Compress the output file with gzip.")
+
+    def handle(self, *args, **options):
+        if options["block_ids"] and not options["block_type"]:
+            raise CommandError("--block-type is required with --block.")
+        if options["gzip"] and not options["output"]:
+            raise CommandError("--gzip requires --output.")
+
+        block_types = [options["block_type"]] if options["block_type"] else BLOCK_TYPES
+        rows = itertools.chain.from_iterable(
+            iter_submission_rows(
+                block_type, iter_student_states(options["course_id"], block_type, options["block_ids"])
+            )
+            for block_type in block_types
+        )
+
+        if options["output"]:
+            with open_export_file(options["output"], options["gzip"]) as output:
+                count = write_export(rows, output, options["export_format"])
+        else:
+            count = write_export(rows, self.stdout, options["export_format"])
+        self.stderr.write(f"{count} submissions exported.")
@@ -0,0 +1,45 @@
+"""
+Write the similarity report of the code submitted to the coding blocks of a course.
+
+    ./manage.py lms ai_eval_similarity_report course-v1:Org+Course+Run --output report.csv --workers 4
+"""
+
+from django.core.management.base import BaseCommand
+
+from ai_eval.coding_ai_eval import USER_RESPONSE
+from ai_eval.compat import get_course_blocks, iter_student_states
+from ai_eval.plagiarism import REPORT_MIN_SIMILARITY, Submission, write_similarity_report
+
+BLOCK_TYPE = "coding_ai_eval"
+
+
+class Command(BaseCommand):
+    """
+    Write the pairs of similar submissions of each coding block of a course, as CSV.
+    """
+
+    help = "Write the pairs of similar submissions of each coding block of a course, as CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_id")
+        parser.add_argument("--output", help="File to write the report to, instead of the standard output.")
+        parser.add_argument("--min-similarity", type=float, default=REPORT_MIN_SIMILARITY)
+        parser.add_argument("--workers", type=int, default=1, help="Processes fingerprinting the submissions.")
+
+    def handle(self, *args, **options):
+        blocks = get_course_blocks(options["course_id"], BLOCK_TYPE)
+        submissions = (
+            Submission(
+                student.block_id, student.username, student.state["messages"][USER_RESPONSE],
+                blocks[student.block_id].language,
+            )
+            for student in iter_student_states(options["course_id"], BLOCK_TYPE)
+            if student.block_id in blocks and student.state.get("messages", {}).get(USER_RESPONSE)
+        )
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8", newline="") as output:
+                rows = write_similarity_report(submissions, output, options["min_similarity"], options["workers"])
+        else:
+            rows = write_similarity_report(submissions, self.stdout, options["min_similarity"], options["workers"])
+        self.stderr.write(f"{rows} similar pairs reported.")
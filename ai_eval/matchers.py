@@ -0,0 +1,452 @@
+"""
+Matchers comparing the output of test cases with their expected output.
+
+Test cases are validated when the block is saved in Studio, so invalid or
+catastrophically backtracking regular expressions are reported to the author
+rather than failing silently for learners. Regular expressions only match
+outputs up to `MAX_REGEX_OUTPUT_LENGTH` characters, which bounds the time of the
+polynomial backtracking the validation lets through. Matchers are compiled once
+per process and kept in bounded LRU caches, so a comparison is a single call.
+
+Matchers describe the first difference between the output and the expected
+output. Line and token based matchers read the output lazily, so they stop at
+the first difference of large outputs.
+"""
+
+import functools
+import json
+import math
+import operator
+import re
+from collections import Counter
+from re import _compiler as sre_compile  # pylint: disable=no-name-in-module
+from re import _parser as sre_parse  # pylint: disable=no-name-in-module
+from typing import Callable, Iterable, Iterator
+
+DEFAULT_TEST_TYPE = "output_comparison"
+TEST_TYPES = (
+    "exact_match",
+    "output_comparison",
+    "contains",
+    "regex",
+    "normalized_whitespace",
+    "tokens",
+    "float_tolerance",
+    "unordered_lines",
+    "json",
+)
+# Relative and absolute tolerance of float_tolerance tests, by default
+DEFAULT_TOLERANCE = 1e-6
+# Characters of the values shown in mismatch descriptions
+MISMATCH_VALUE_LENGTH = 80
+
+MATCHER_CACHE_SIZE = 1024
+REGEX_CACHE_SIZE = 256
+MAX_REGEX_LENGTH = 1000
+# Characters of the outputs matched by regular expressions, longer outputs do not match
+MAX_REGEX_OUTPUT_LENGTH = 100_000
+# Unbounded repeats in a row which can match the same character, like in `x*x*x*y`
+MAX_OVERLAPPING_REPEATS = 2
+
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+_CHARACTERS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+# Characters the first characters of the parts of an expression are computed on
+_PROBES = frozenset(chr(code) for code in range(128)) | frozenset("\u00a0\u00e9\u0394\u0661\u4e00")
+# Marks the parts of an expression which can match an empty text
+_EMPTY = ""
+
+
+class InvalidTestCase(ValueError):
+    """
+    Raised when a test case is not valid.
+    """
+
+
+def _match_characters(pattern, item) -> set[str]:
+    """
+    Get the characters matched by an item of a parsed pattern matching one character.
+    """
+    fullmatch = sre_compile.compile(sre_parse.SubPattern(pattern.state, [item])).fullmatch
+    return {character for character in _PROBES if fullmatch(character)}
+
+
+def _first_characters(pattern) -> set[str]:
+    """
+    Get the characters a parsed pattern can start with, with `_EMPTY` when it can match an empty text.
+
+    Backreferences and conditionals can start with any character.
+    """
+    characters = set()
+    for op, av in pattern:
+        if op in _CHARACTERS:
+            return characters | _match_characters(pattern, (op, av))
+        if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            continue
+        if op in _REPEATS:
+            first, required = _first_characters(av[2]), av[0] > 0
+        elif op in (sre_parse.SUBPATTERN, sre_parse.ATOMIC_GROUP):
+            first, required = _first_characters(av[-1]), True
+        elif op is sre_parse.BRANCH:
+            first, required = set().union(*(_first_characters(branch) for branch in av[1])), True
+        else:
+            return characters | _PROBES
+        characters |= first - {_EMPTY}
+        if required and _EMPTY not in first:
+            return characters
+    return characters | {_EMPTY}
+
+
+def _branches_overlap(branches, follow: set[str]) -> bool:
+    """
+    Whether two branches of an alternation can start with the same character.
+
+    Branches which can match an empty text start with the characters following them.
+    """
+    seen = set()
+    for branch in branches:
+        first = _first_characters(branch)
+        if _EMPTY in first:
+            first = (first - {_EMPTY}) | follow
+        if seen & first:
+            return True
+        seen |= first
+    return False
+
+
+def _has_ambiguous_repeat(pattern, follow: set[str] | None) -> bool:
+    """
+    Whether a parsed pattern repeated in an enclosing repeat can match the same text in many ways.
+
+    Args:
+        pattern: The parsed pattern.
+        follow: The characters which can follow the pattern in the enclosing repeats,
+            including the first ones of their next iteration. None outside of repeats.
+    """
+    for index, (op, av) in enumerate(pattern):
+        rest_follow = None
+        if follow is not None:
+            rest = _first_characters(pattern[index + 1:])
+            rest_follow = (rest - {_EMPTY}) | follow if _EMPTY in rest else rest
+        if op in _REPEATS:
+            body = av[2]
+            if av[1] > 1:
+                first = _first_characters(body) - {_EMPTY}
+                # Like `(a+)+` or `(.*a){25}`: the text of the repeat can also be matched by what follows it
+                if rest_follow is not None and first & rest_follow:
+                    return True
+                if _has_ambiguous_repeat(body, first | (rest_follow or set())):
+                    return True
+            elif _has_ambiguous_repeat(body, rest_follow):
+                return True
+        elif op in (sre_parse.SUBPATTERN, sre_parse.ATOMIC_GROUP):
+            if _has_ambiguous_repeat(av[-1], rest_follow):
+                return True
+        elif op is sre_parse.BRANCH:
+            # Like `(a|aa)+`: each iteration can be matched by several branches
+            if rest_follow is not None and _branches_overlap(av[1], rest_follow):
+                return True
+            if any(_has_ambiguous_repeat(branch, rest_follow) for branch in av[1]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if _has_ambiguous_repeat(av[1], None):
+                return True
+    return False
+
+
+def _iter_items(pattern):
+    """
+    Iterate over the items of a parsed pattern, looking into its groups.
+    """
+    for op, av in pattern:
+        if op in (sre_parse.SUBPATTERN, sre_parse.ATOMIC_GROUP):
+            yield from _iter_items(av[-1])
+        else:
+            yield op, av
+
+
+def _has_overlapping_repeats(pattern) -> bool:
+    """
+    Whether a parsed pattern has more than `MAX_OVERLAPPING_REPEATS` unbounded repeats in a row
+    which can match the same character, looking into its groups, branches and repeats.
+
+    Repeats are in a row when the items between them can match an empty text, or the
+    character they share.
+    """
+    # Repeats in a row which can match each character
+    counts = Counter()
+    for op, av in _iter_items(pattern):
+        if op in _REPEATS and _has_overlapping_repeats(av[2]):
+            return True
+        if op is sre_parse.BRANCH and any(_has_overlapping_repeats(branch) for branch in av[1]):
+            return True
+        if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT) and _has_overlapping_repeats(av[1]):
+            return True
+        characters = _first_characters(sre_parse.SubPattern(pattern.state, [(op, av)]))
+        if op in _REPEATS and av[1] == sre_parse.MAXREPEAT:
+            counts.update(characters - {_EMPTY})
+            if any(count > MAX_OVERLAPPING_REPEATS for count in counts.values()):
+                return True
+        if _EMPTY not in characters:
+            counts = Counter({character: count for character, count in counts.items() if character in characters})
+    return False
+
+
+def has_catastrophic_backtracking(pattern) -> bool:
+    """
+    Whether a parsed regular expression can backtrack exponentially, or polynomially with a high degree.
+
+    It can when the text matched by a repeat inside another repeat can also be
+    matched by what follows it, like in `(a+)+`, `(\w+\s?)*` or `(.*a){25}`, or by
+    another branch of an alternation, like in `(a|aa)+`, and when three unbounded
+    repeats in a row can match the same character, like in `x*x*x*y`. The characters are
+    compared on the ASCII ones and a few others, so the detection is conservative.
+    """
+    return _has_ambiguous_repeat(pattern, None) or _has_overlapping_repeats(pattern)
+
+
+@functools.lru_cache(maxsize=REGEX_CACHE_SIZE)
+def compile_regex(pattern: str) -> re.Pattern:
+    """
+    Compile the regular expression of a test case.
+
+    Raises:
+        InvalidTestCase: When the expression is invalid, too long, or can backtrack
+            catastrophically.
+    """
+    if len(pattern) > MAX_REGEX_LENGTH:
+        raise InvalidTestCase(f"regular expression longer than {MAX_REGEX_LENGTH} characters")
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        raise InvalidTestCase(f"invalid regular expression: {e}") from e
+    if has_catastrophic_backtracking(parsed):
+        raise InvalidTestCase(
+            "regular expression which can match the same text in many ways, like (a+)+, (a|aa)+, (.*a){25}"
+            " or x*x*x*y, and take exponential or high polynomial time"
+        )
+    return re.compile(pattern)
+
+
+def validate_test_case(test_case) -> None:
+    """
+    Validate a test case definition.
+
+    Raises:
+        InvalidTestCase: When the test case is not valid.
+    """
+    if not isinstance(test_case, dict):
+        raise InvalidTestCase("test case must be an object")
+    for key in ("name", "description", "input", "expected_output"):
+        if not isinstance(test_case.get(key, ""), str):
+            raise InvalidTestCase(f"{key} must be a string")
+    for key, default in (("weight", 1), ("timeout", 10), ("tolerance", DEFAULT_TOLERANCE)):
+        value = test_case.get(key, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise InvalidTestCase(f"{key} must be a positive number")
+    if not isinstance(test_case.get("hidden", False), bool):
+        raise InvalidTestCase("hidden must be true or false")
+    test_type = test_case.get("type", DEFAULT_TEST_TYPE)
+    if test_type not in TEST_TYPES:
+        raise InvalidTestCase(f"type must be one of {', '.join(TEST_TYPES)}")
+    get_test_case_matcher(test_case)
+
+
+def get_test_case_matcher(test_case: dict) -> Callable[[str], str | None]:
+    """
+    Get the matcher of a test case, see `get_matcher`.
+    """
+    return get_matcher(
+        test_case.get("type", DEFAULT_TEST_TYPE),
+        test_case.get("expected_output", ""),
+        test_case.get("tolerance", DEFAULT_TOLERANCE),
+    )
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """
+    Iterate over the lines of a text, without copying it whole.
+    """
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def _shorten(value) -> str:
+    text = repr(value)
+    return text if len(text) <= MISMATCH_VALUE_LENGTH else text[:MISMATCH_VALUE_LENGTH - 3] + "..."
+
+
+def _compare_sequences(expected: list, actual: Iterable[tuple[str, str]], equal=operator.eq) -> str | None:
+    """
+    Compare expected values with the values of an output, stopping at the first mismatch.
+
+    Args:
+        expected: The expected values.
+        actual: The `(location, value)` of the values of the output, produced lazily.
+        equal: The function telling whether an expected value and an output value match.
+
+    Returns:
+        The description of the first mismatch, None when all the values match.
+    """
+    index = -1
+    for index, (location, value) in enumerate(actual):
+        if index >= len(expected):
+            return f"{location}: unexpected {_shorten(value)}"
+        if not equal(expected[index], value):
+            return f"{location}: expected {_shorten(expected[index])}, got {_shorten(value)}"
+    if index + 1 < len(expected):
+        return f"end of output: missing {_shorten(expected[index + 1])}"
+    return None
+
+
+def _iter_numbered_lines(text: str, normalize=None) -> Iterator[tuple[str, str]]:
+    """
+    Iterate over the numbered lines of a text, normalized and without the blank ones.
+    """
+    for number, line in enumerate(iter_lines(text), 1):
+        if normalize:
+            line = normalize(line)
+        if line:
+            yield f"line {number}", line
+
+
+def _iter_tokens(text: str) -> Iterator[tuple[str, str]]:
+    """
+    Iterate over the whitespace separated tokens of a text, with their location.
+    """
+    for number, line in enumerate(iter_lines(text), 1):
+        for position, token in enumerate(line.split(), 1):
+            yield f"line {number}, token {position}", token
+
+
+def _normalize_whitespace(line: str) -> str:
+    return " ".join(line.split())
+
+
+def _parse_number(token: str) -> float | str:
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+def _compare_lines(expected: str, actual: str) -> str | None:
+    """
+    Compare two outputs line by line, and describe where they differ.
+    """
+    return _compare_sequences(
+        list(iter_lines(expected)),
+        ((f"line {number}", line) for number, line in enumerate(iter_lines(actual), 1)),
+    )
+
+
+def _compare_unordered_lines(expected: Counter, actual: str) -> str | None:
+    """
+    Compare the lines of an output with expected lines, in any order.
+    """
+    remaining = expected.copy()
+    for location, line in _iter_numbered_lines(actual, str.strip):
+        if not remaining[line]:
+            return f"{location}: unexpected {_shorten(line)}"
+        remaining[line] -= 1
+    missing = next((line for line, count in remaining.items() if count), None)
+    if missing is not None:
+        return f"end of output: missing {_shorten(missing)}"
+    return None
+
+
+def _compare_json(expected, actual, path: str = "$") -> str | None:
+    """
+    Compare JSON values, ignoring the order of object keys, and describe where they differ.
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key, value in expected.items():
+            if key not in actual:
+                return f"{path}: missing key {_shorten(key)}"
+            if mismatch := _compare_json(value, actual[key], f"{path}.{key}"):
+                return mismatch
+        extra = next((key for key in actual if key not in expected), None)
+        return f"{path}: unexpected key {_shorten(extra)}" if extra is not None else None
+    if isinstance(expected, list) and isinstance(actual, list):
+        for index, (expected_item, actual_item) in enumerate(zip(expected, actual)):
+            if mismatch := _compare_json(expected_item, actual_item, f"{path}[{index}]"):
+                return mismatch
+        if len(expected) != len(actual):
+            return f"{path}: expected {len(expected)} items, got {len(actual)}"
+        return None
+    # bool is an int for Python, but not for JSON
+    if expected == actual and isinstance(expected, bool) == isinstance(actual, bool):
+        return None
+    return f"{path}: expected {_shorten(expected)}, got {_shorten(actual)}"
+
+
+def _compare_json_output(expected, actual: str) -> str | None:
+    try:
+        actual = json.loads(actual)
+    except ValueError as e:
+        return f"output is not valid JSON: {e}"
+    return _compare_json(expected, actual)
+
+
+@functools.lru_cache(maxsize=MATCHER_CACHE_SIZE)
+def get_matcher(test_type: str, expected: str, tolerance: float = DEFAULT_TOLERANCE) -> Callable[[str], str | None]:
+    """
+    Get the function comparing an output with the expected output of a test.
+
+    The function returns None when the output matches, or a description of the first
+    difference. Line and token based comparisons go through the output lazily, and
+    stop at the first difference. Unknown test types compare trimmed outputs.
+
+    Raises:
+        InvalidTestCase: When the expected output is invalid for the test type.
+    """
+    # pylint: disable=too-many-return-statements
+    if test_type == "exact_match":
+        return lambda actual: None if actual == expected else (
+            _compare_lines(expected, actual) or "output differs by its trailing newline"
+        )
+    if test_type == "contains":
+        return lambda actual: None if expected in actual else f"output does not contain {_shorten(expected)}"
+    if test_type == "regex":
+        search = compile_regex(expected).search
+
+        def match(actual):
+            if len(actual) > MAX_REGEX_OUTPUT_LENGTH:
+                return f"output longer than {MAX_REGEX_OUTPUT_LENGTH} characters, too long to match a regex"
+            return None if search(actual) else f"output does not match {_shorten(expected)}"
+
+        return match
+    if test_type == "normalized_whitespace":
+        lines = [line for _, line in _iter_numbered_lines(expected, _normalize_whitespace)]
+        return lambda actual: _compare_sequences(lines, _iter_numbered_lines(actual, _normalize_whitespace))
+    if test_type == "tokens":
+        tokens = [token for _, token in _iter_tokens(expected)]
+        return lambda actual: _compare_sequences(tokens, _iter_tokens(actual))
+    if test_type == "float_tolerance":
+        values = [_parse_number(token) for _, token in _iter_tokens(expected)]
+
+        def equal(expected_value, token):
+            if isinstance(expected_value, str):
+                return expected_value == token
+            value = _parse_number(token)
+            return not isinstance(value, str) and math.isclose(
+                expected_value, value, rel_tol=tolerance, abs_tol=tolerance
+            )
+
+        return lambda actual: _compare_sequences(values, _iter_tokens(actual), equal)
+    if test_type == "unordered_lines":
+        lines = Counter(line for _, line in _iter_numbered_lines(expected, str.strip))
+        return functools.partial(_compare_unordered_lines, lines)
+    if test_type == "json":
+        try:
+            value = json.loads(expected)
+        except ValueError as e:
+            raise InvalidTestCase(f"expected output is not valid JSON: {e}") from e
+        return functools.partial(_compare_json_output, value)
+    stripped = expected.strip()
+    return lambda actual: None if actual.strip() == stripped else _compare_lines(stripped, actual.strip())
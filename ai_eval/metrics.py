@@ -0,0 +1,259 @@
+"""
+Latency metrics of the handlers of the blocks, and of the calls to Judge0, LLMs and the learner state.
+
+Durations are aggregated in histograms kept in the memory of the process, and
+exported as Prometheus text by `render_prometheus`, with the gauges of the
+process, like the depth of the attachment download queue. When a StatsD server
+is configured, each duration is also sent to it as a timing, which aggregates
+the durations of all the processes, and each change of a gauge as a gauge.
+Observing a duration is a dictionary lookup, a bisection and, with StatsD, a
+non-blocking UDP datagram, a few microseconds.
+
+The same decorators time the operations as tracing spans, see `tracing`.
+"""
+
+import bisect
+import functools
+import itertools
+import socket
+import threading
+import time
+from typing import Callable
+
+from . import tracing
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = "ai_eval"
+HANDLER_DURATION = "handler_duration_seconds"
+UPSTREAM_DURATION = "upstream_duration_seconds"
+DOWNLOADS_QUEUED = "attachment_downloads_queued"
+DOWNLOADS_RUNNING = "attachment_downloads_running"
+
+DEFAULT_STATSD_PORT = 8125
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Counts of durations by bucket, with their sum.
+    """
+
+    __slots__ = ("counts", "total", "lock")
+
+    def __init__(self):
+        # The last count is for durations above all the buckets
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """
+        Count a duration, in seconds.
+        """
+        index = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+
+
+class StatsdClient:
+    """
+    Sends timings to a StatsD server over UDP, dropping them when it cannot.
+    """
+
+    def __init__(self, host: str, port: int = DEFAULT_STATSD_PORT, prefix: str = METRIC_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def timing(self, name: str, labels: Labels, seconds: float) -> None:
+        """
+        Send a timing, in milliseconds, named after the metric and its label values.
+        """
+        self._send(name, labels, f"{seconds * 1000:.3f}|ms")
+
+    def gauge(self, name: str, labels: Labels, value: float) -> None:
+        """
+        Send the value of a gauge, named after the metric and its label values.
+        """
+        self._send(name, labels, f"{value}|g")
+
+    def _send(self, name: str, labels: Labels, value: str) -> None:
+        path = ".".join([self.prefix, name, *(label_value for _, label_value in labels)])
+        try:
+            self.socket.sendto(f"{path}:{value}".encode("utf-8"), self.address)
+        except OSError:
+            pass
+
+
+# (metric name, labels) -> histogram
+_histograms: dict[tuple[str, Labels], Histogram] = {}
+_histograms_lock = threading.Lock()
+# (metric name, labels) -> value
+_gauges: dict[tuple[str, Labels], float] = {}
+_statsd: StatsdClient | None = None
+_configured = False
+
+
+def configure(settings: dict) -> None:
+    """
+    Set up StatsD and tracing from the XBlock settings, once per process.
+    """
+    global _configured  # pylint: disable=global-statement
+    _configured = True
+    configure_statsd(settings)
+    tracing.configure_tracing(settings)
+
+
+def configure_statsd(settings: dict) -> None:
+    """
+    Send the observed durations to the StatsD server of the XBlock settings, if any.
+
+    The settings are `STATSD_HOST`, `STATSD_PORT` and `STATSD_PREFIX`.
+    """
+    global _statsd  # pylint: disable=global-statement
+    if host := settings.get("STATSD_HOST"):
+        _statsd = StatsdClient(
+            host, int(settings.get("STATSD_PORT", DEFAULT_STATSD_PORT)), settings.get("STATSD_PREFIX", METRIC_PREFIX)
+        )
+    else:
+        _statsd = None
+
+
+def observe(name: str, labels: Labels, seconds: float) -> None:
+    """
+    Observe a duration of a metric, in seconds.
+
+    Args:
+        name: The name of the metric.
+        labels: The `(name, value)` pairs of the labels of the duration, in a fixed order.
+        seconds: The duration.
+    """
+    histogram = _histograms.get((name, labels))
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault((name, labels), Histogram())
+    histogram.observe(seconds)
+    if _statsd:
+        _statsd.timing(name, labels, seconds)
+
+
+def set_gauge(name: str, labels: Labels, value: float) -> None:
+    """
+    Set the current value of a gauge of the process.
+
+    Args:
+        name: The name of the metric.
+        labels: The `(name, value)` pairs of the labels of the gauge, in a fixed order.
+        value: The value.
+    """
+    _gauges[(name, labels)] = value
+    if _statsd:
+        _statsd.gauge(name, labels, value)
+
+
+def timed(service: str, call: str) -> Callable:
+    """
+    Decorator observing the duration of the calls to an upstream service.
+    """
+    labels = (("service", service), ("call", call))
+    span_name = f"{service}.{call}"
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with tracing.span(span_name):
+                    return func(*args, **kwargs)
+            finally:
+                observe(UPSTREAM_DURATION, labels, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def instrument_handler(handler: Callable) -> Callable:
+    """
+    Decorator observing the duration of the calls to a handler of a block, by status.
+
+    The status is the one of the raised `JsonHandlerError`, 500 for other errors. The
+    call is also a tracing span, for the `trace_id` and `parent_span_id` of the JSON data.
+    """
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    def wrapper(block, data, *args, **kwargs):
+        if not _configured:
+            configure(block._get_settings())  # pylint: disable=protected-access
+        start = time.perf_counter()
+        status = "500"
+        try:
+            trace_id = parent_span_id = None
+            if isinstance(data, dict):
+                trace_id, parent_span_id = data.get("trace_id"), data.get("parent_span_id")
+            with tracing.span(f"{type(block).__name__}.{name}", trace_id, parent_span_id, handler=name):
+                result = handler(block, data, *args, **kwargs)
+            status = "200"
+            return result
+        except Exception as e:
+            status = str(getattr(e, "status_code", 500))
+            raise
+        finally:
+            observe(
+                HANDLER_DURATION,
+                (("block", type(block).__name__), ("handler", name), ("status", status)),
+                time.perf_counter() - start,
+            )
+    return wrapper
+
+
+def _format_labels(labels: Labels) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+def _format_sample(metric: str, labels: Labels, value) -> str:
+    return f"{metric}{{{_format_labels(labels)}}} {value}" if labels else f"{metric} {value}"
+
+
+def render_prometheus() -> str:
+    """
+    Render the histograms and the gauges of the process in the Prometheus text format.
+    """
+    lines = []
+    with _histograms_lock:
+        histograms = sorted(_histograms.items())
+    for name, group in itertools.groupby(histograms, key=lambda item: item[0][0]):
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        for (_, labels), histogram in group:
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total = histogram.total
+            cumulative = 0
+            for bound, count in zip([*BUCKETS, "+Inf"], counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{_format_labels((*labels, ("le", str(bound))))}}} {cumulative}')
+            lines.append(f"{metric}_sum{{{_format_labels(labels)}}} {total}")
+            lines.append(f"{metric}_count{{{_format_labels(labels)}}} {cumulative}")
+    for name, group in itertools.groupby(sorted(_gauges.copy().items()), key=lambda item: item[0][0]):
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        for (_, labels), value in group:
+            lines.append(_format_sample(metric, labels, value))
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """
+    Drop all the histograms and gauges, and the StatsD and tracing configuration.
+    """
+    global _statsd, _configured  # pylint: disable=global-statement
+    with _histograms_lock:
+        _histograms.clear()
+    _gauges.clear()
+    _statsd = None
+    _configured = False
+    tracing.reset()
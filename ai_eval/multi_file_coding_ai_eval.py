@@ -2,23 +2,28 @@
 
 import json
 import logging
+import math
+import time
 import traceback
 from typing import Dict, List, Optional
-import pkg_resources
 
 from django.utils.translation import gettext_noop as _
 from web_fragments.fragment import Fragment
+from webob import Response
 from xblock.core import XBlock
 from xblock.exceptions import JsonHandlerError
-from xblock.fields import Dict, List, Scope, String, Boolean
+from xblock.fields import Dict, Float, Integer, List, Scope, String, Boolean
+from xblock.scorable import ScorableXBlockMixin, Score
 from xblock.validation import ValidationMessage
 
 from .coding_ai_eval import CodingAIEvalXBlock
 from .llm import get_llm_response
+from .matchers import InvalidTestCase, get_test_case_matcher, validate_test_case
+from .metrics import instrument_handler
 from .utils import (
     submit_code,
     get_submission_result,
-    SUPPORTED_LANGUAGE_MAP,
+    get_content_hash,
     LanguageLabels,
 )
 
@@ -28,8 +33,40 @@ USER_RESPONSE = "USER_RESPONSE"
 AI_EVALUATION = "AI_EVALUATION"
 CODE_EXEC_RESULT = "CODE_EXEC_RESULT"
 
+# Files fetched with a matching content hash never change, so browsers may keep them.
+FILE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
 
-class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
+MAX_BATCH_FILE_OPS = 100
+
+
+class FileVersionConflict(JsonHandlerError):
+    """
+    Raised when a file is written from an outdated version of it.
+
+    The response includes the current version of the file, so the client can
+    decide to reload it or to overwrite it.
+    """
+
+    def __init__(self, filename, file_data):
+        super().__init__(409, "File was modified since it was loaded")
+        self.filename = filename
+        self.current_version = file_data.get("version", 1)
+        self.current_hash = file_data.get("hash")
+
+    def get_response(self, **kwargs):
+        return Response(
+            json_body={
+                "error": self.message,
+                "filename": self.filename,
+                "current_version": self.current_version,
+                "hash": self.current_hash,
+            },
+            status=self.status_code,
+            **kwargs
+        )
+
+
+class MultiFileCodingAIEvalXBlock(ScorableXBlockMixin, CodingAIEvalXBlock):
     """
     Enhanced Coding XBlock with multi-file support.
     
@@ -39,9 +76,11 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
     - Test case evaluation
     - Enhanced Monaco Editor integration
     - Project structure validation
+    - Scores from the weighted test cases, published to the gradebook
     """
 
     has_author_view = True
+    has_score = True
 
     display_name = String(
         display_name=_("Display Name"),
@@ -71,11 +110,27 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
     )
 
     test_cases = List(
-        help=_("List of test cases for evaluation"),
+        help=_(
+            "List of test cases for evaluation. The score of the problem is the sum of"
+            " the weights of the passed tests, 1 by default. Tests with \"hidden\": true only"
+            " run when students submit the full test suite. The type of a test is one of"
+            " exact_match, output_comparison (default), contains, regex, normalized_whitespace,"
+            " tokens, float_tolerance (with an optional tolerance), unordered_lines and json."
+        ),
         scope=Scope.settings,
         default=[]
     )
 
+    full_test_run_interval = Integer(
+        display_name=_("Minimum interval between full test runs"),
+        help=_(
+            "Seconds a student must wait between two runs of the full test suite, hidden tests"
+            " included. Set to 0 for no limit."
+        ),
+        default=300,
+        scope=Scope.settings,
+    )
+
     build_config = Dict(
         help=_("Build configuration for compiled languages"),
         scope=Scope.settings,
@@ -89,17 +144,44 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
         default={}
     )
 
+    test_results = Dict(
+        help=_(
+            "Whether each test case passed, and why the failed ones did, by test case hash,"
+            " and the hash of the project files the tests ran on"
+        ),
+        scope=Scope.user_state,
+        default={}
+    )
+
+    raw_score = Dict(
+        help=_("Last published raw score, with raw_earned and raw_possible keys"),
+        scope=Scope.user_state,
+        default={}
+    )
+
+    last_full_test_run = Float(
+        help=_("Time of the last run of the full test suite, as a POSIX timestamp"),
+        scope=Scope.user_state,
+        default=0,
+    )
+
     editable_fields = CodingAIEvalXBlock.editable_fields + (
         "enable_multi_file",
         "file_templates",
         "test_cases",
+        "full_test_run_interval",
         "build_config"
     )
 
-    def resource_string(self, path):
-        """Handy helper for getting resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode("utf8")
+    # File operations, mapped to the methods applying them.
+    FILE_OPERATIONS = {
+        "create": "_create_file",
+        "delete": "_delete_file",
+        "rename": "_rename_file",
+        "save": "_save_file",
+    }
+    # Characters of the error of a failed test kept in the memoized results
+    MAX_STORED_ERROR_LENGTH = 200
 
     def student_view(self, context=None):
         """
@@ -114,31 +196,18 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
         )
 
         frag = Fragment(html)
-        frag.add_css(self.resource_string("static/css/multi_file_coding_ai_eval.css"))
-        frag.add_javascript(self.resource_string("static/js/src/utils.js"))
-        frag.add_javascript(self.resource_string("static/js/src/multi_file_coding_ai_eval.js"))
+        self.add_bundle(frag, "multi_file_coding_ai_eval.css")
+        self.add_bundle(frag, "utils.js")
+        self.add_bundle(frag, "multi_file_coding_ai_eval.js")
 
-        monaco_html = self.loader.render_django_template(
-            "/templates/multi_file_monaco.html",
-            {
-                "monaco_language": SUPPORTED_LANGUAGE_MAP[self.language].monaco_id,
-                "enable_multi_file": self.enable_multi_file,
-            },
-        )
-        marked_html = self.resource_string("static/html/marked-iframe.html")
-        
+        # File contents, templates and previous results are fetched on demand,
+        # so the page weight does not depend on the size of the project.
         js_data = {
-            "monaco_html": monaco_html,
-            "question": self.question,
-            "project_files": self.project_files,
-            "file_templates": self.file_templates,
-            "test_cases": self.test_cases,
-            "build_config": self.build_config,
+            "monaco": self.get_monaco_config(),
+            "question_html": self.get_question_html(),
+            "project_manifest": self._get_project_manifest(),
             "project_structure": self.project_structure,
             "enable_multi_file": self.enable_multi_file,
-            "ai_evaluation": self.messages.get(AI_EVALUATION, ""),
-            "code_exec_result": self.messages.get(CODE_EXEC_RESULT, {}),
-            "marked_html": marked_html,
             "language": self.language,
         }
         frag.initialize_js("MultiFileCodingAIEvalXBlock", js_data)
@@ -148,7 +217,7 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
         """
         Create preview to be shown to course authors in Studio.
         """
-        if not self.validate():
+        if not self.get_cached_validation():
             fragment = Fragment()
             fragment.add_content(
                 _(
@@ -172,6 +241,25 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
                 )
             )
 
+        if data.full_test_run_interval is None or data.full_test_run_interval < 0:
+            validation.add(
+                ValidationMessage(
+                    ValidationMessage.ERROR,
+                    _("The minimum interval between full test runs must be a positive number of seconds, or 0.")
+                )
+            )
+
+        for i, test_case in enumerate(data.test_cases):
+            try:
+                validate_test_case(test_case)
+            except InvalidTestCase as e:
+                validation.add(
+                    ValidationMessage(
+                        ValidationMessage.ERROR,
+                        _("Test case {number} is invalid: {error}").format(number=i + 1, error=e)
+                    )
+                )
+
         # Validate multi-file specific settings
         if data.enable_multi_file:
             if not data.file_templates:
@@ -185,37 +273,17 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
     # File Management API Handlers
 
     @XBlock.json_handler
+    @instrument_handler
     def create_file(self, data, suffix=""):
         """Create a new file in the project."""
         try:
-            filename = data.get("filename", "")
-            content = data.get("content", "")
-            file_type = data.get("file_type", "text")
-            
-            if not filename:
-                raise JsonHandlerError(400, "Filename is required")
-            
-            # Validate filename
-            if not self._is_valid_filename(filename):
-                raise JsonHandlerError(400, "Invalid filename")
-            
-            # Check if file already exists
-            if filename in self.project_files:
-                raise JsonHandlerError(409, "File already exists")
-            
-            # Create file entry
-            self.project_files[filename] = {
-                "content": content,
-                "type": file_type,
-                "created_at": self._get_timestamp(),
-                "modified_at": self._get_timestamp(),
-                "language": self.language
-            }
+            added, removed = [], []
+            result = self._apply_file_operation(self.project_files, "create", data, added, removed)
             
             # Update project structure
-            self._update_project_structure()
+            self._update_project_structure(added, removed)
             
-            return {"success": True, "filename": filename}
+            return result
             
         except JsonHandlerError:
             raise
@@ -224,25 +292,15 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
             raise JsonHandlerError(500, "Failed to create file")
 
     @XBlock.json_handler
+    @instrument_handler
     def delete_file(self, data, suffix=""):
         """Delete a file from the project."""
         try:
-            filename = data.get("filename", "")
-            
-            if not filename:
-                raise JsonHandlerError(400, "Filename is required")
-            
-            if filename not in self.project_files:
-                raise JsonHandlerError(404, "File not found")
-            
-            # Check if it's a protected file (e.g., main entry point)
-            if self._is_protected_file(filename):
-                raise JsonHandlerError(403, "Cannot delete protected file")
+            added, removed = [], []
+            result = self._apply_file_operation(self.project_files, "delete", data, added, removed)
+            self._update_project_structure(added, removed)
             
-            del self.project_files[filename]
-            self._update_project_structure()
-            
-            return {"success": True, "filename": filename}
+            return result
             
         except JsonHandlerError:
             raise
@@ -251,32 +309,15 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
             raise JsonHandlerError(500, "Failed to delete file")
 
     @XBlock.json_handler
+    @instrument_handler
     def rename_file(self, data, suffix=""):
         """Rename a file in the project."""
         try:
-            old_filename = data.get("old_filename", "")
-            new_filename = data.get("new_filename", "")
-            
-            if not old_filename or not new_filename:
-                raise JsonHandlerError(400, "Both old and new filenames are required")
-            
-            if old_filename not in self.project_files:
-                raise JsonHandlerError(404, "File not found")
+            added, removed = [], []
+            result = self._apply_file_operation(self.project_files, "rename", data, added, removed)
+            self._update_project_structure(added, removed)
             
-            if not self._is_valid_filename(new_filename):
-                raise JsonHandlerError(400, "Invalid filename")
-            
-            if new_filename in self.project_files:
-                raise JsonHandlerError(409, "File already exists")
-            
-            # Move file content
-            self.project_files[new_filename] = self.project_files[old_filename]
-            self.project_files[new_filename]["modified_at"] = self._get_timestamp()
-            del self.project_files[old_filename]
-            
-            self._update_project_structure()
-            
-            return {"success": True, "old_filename": old_filename, "new_filename": new_filename}
+            return result
             
         except JsonHandlerError:
             raise
@@ -285,41 +326,119 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
             raise JsonHandlerError(500, "Failed to rename file")
 
     @XBlock.json_handler
+    @instrument_handler
     def save_file(self, data, suffix=""):
         """Save file content."""
         try:
-            filename = data.get("filename", "")
-            content = data.get("content", "")
+            return self._save_file(self.project_files, data)
             
-            if not filename:
-                raise JsonHandlerError(400, "Filename is required")
+        except JsonHandlerError:
+            raise
+        except Exception as e:
+            logger.error(f"Error saving file: {e}")
+            raise JsonHandlerError(500, "Failed to save file")
+
+    @XBlock.json_handler
+    @instrument_handler
+    def batch_file_ops(self, data, suffix=""):
+        """
+        Apply an ordered list of file operations in a single request.
+
+        Each operation is a dict with an ``op`` key (create, delete, rename or save)
+        and the same parameters as the matching handler. The operations are applied
+        on a copy of the project, which replaces the stored one only when all of them
+        succeed, so a failing operation leaves the project untouched. Nothing is written
+        when no operation changed a file.
+        """
+        try:
+            operations = data.get("operations", [])
             
-            if filename not in self.project_files:
-                raise JsonHandlerError(404, "File not found")
+            if not operations or not isinstance(operations, list):
+                raise JsonHandlerError(400, "Operations are required")
             
-            # Update file content
-            self.project_files[filename]["content"] = content
-            self.project_files[filename]["modified_at"] = self._get_timestamp()
+            if len(operations) > MAX_BATCH_FILE_OPS:
+                raise JsonHandlerError(400, f"At most {MAX_BATCH_FILE_OPS} operations are allowed")
             
-            return {"success": True, "filename": filename}
+            stored_files = self.project_files
+            files = dict(stored_files)
+            added, removed = [], []
+            results = []
+            for index, operation in enumerate(operations):
+                try:
+                    results.append(self._apply_file_operation(files, operation.get("op"), operation, added, removed))
+                except JsonHandlerError as e:
+                    e.message = f"Operation {index}: {e.message}"
+                    raise
+            
+            # Changed entries are replaced, so the unchanged ones are still the stored objects
+            if files.keys() != stored_files.keys() or any(files[name] is not stored_files[name] for name in files):
+                self.project_files = files
+                self._update_project_structure(added, removed)
+            
+            return {"success": True, "results": results}
             
         except JsonHandlerError:
             raise
         except Exception as e:
-            logger.error(f"Error saving file: {e}")
-            raise JsonHandlerError(500, "Failed to save file")
+            logger.error(f"Error applying file operations: {e}")
+            raise JsonHandlerError(500, "Failed to apply file operations")
+
+    @XBlock.handler
+    @instrument_handler
+    def get_file(self, request, suffix=""):
+        """
+        Get the content of a single project file.
+
+        The response carries the content hash as its ETag. When the client asks
+        for the hash it already knows from the manifest, the response can be
+        cached by the browser for good, since a new content yields a new URL.
+        The version of the file is left out, as the same content can come back
+        with a newer version; clients get it from the manifest.
+        """
+        filename = request.GET.get("filename", "")
+        if filename not in self.project_files:
+            return Response(status=404, json_body={"error": "File not found"})
+
+        file_data = self.project_files[filename]
+        file_hash = self._get_file_manifest_entry(file_data)["hash"]
+
+        if file_hash in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(json_body={
+                "filename": filename,
+                "content": file_data.get("content", ""),
+                "hash": file_hash,
+            })
+
+        response.etag = file_hash
+        if request.GET.get("hash") == file_hash:
+            response.cache_control = f"private, max-age={FILE_CACHE_MAX_AGE}, immutable"
+        else:
+            response.cache_control = "private, no-cache"
+        return response
 
     @XBlock.json_handler
+    @instrument_handler
+    def get_file_templates(self, data, suffix=""):
+        """Get the starter file templates for the current language."""
+        return {"templates": self.file_templates.get(self.language, {})}
+
+    @XBlock.json_handler
+    @instrument_handler
     def get_project_structure(self, data, suffix=""):
-        """Get current project structure."""
+        """Get current project structure, without the file contents."""
         return {
-            "project_files": self.project_files,
+            "project_manifest": self._get_project_manifest(),
             "project_structure": self.project_structure,
             "language": self.language,
-            "enable_multi_file": self.enable_multi_file
+            "enable_multi_file": self.enable_multi_file,
+            "ai_evaluation_html": self.get_ai_evaluation_html(),
+            "code_exec_result": self.messages.get(CODE_EXEC_RESULT, {}),
         }
 
     @XBlock.json_handler
+    @instrument_handler
     def initialize_project(self, data, suffix=""):
         """Initialize project with templates."""
         try:
@@ -333,15 +452,12 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
             templates = self.file_templates.get(self.language, {})
             
             for filename, template_data in templates.items():
-                self.project_files[filename] = {
-                    "content": template_data.get("content", ""),
-                    "type": template_data.get("type", "text"),
-                    "created_at": self._get_timestamp(),
-                    "modified_at": self._get_timestamp(),
-                    "language": self.language
-                }
+                self.project_files[filename] = self._new_file_entry(
+                    template_data.get("content", ""),
+                    template_data.get("type", "text"),
+                )
             
-            self._update_project_structure()
+            self._update_project_structure(rebuild=True)
             
             return {"success": True, "files_created": len(templates)}
             
@@ -352,6 +468,7 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
             raise JsonHandlerError(500, "Failed to initialize project")
 
     @XBlock.json_handler
+    @instrument_handler
     def submit_project(self, data, suffix=""):
         """Submit entire project for execution."""
         try:
@@ -374,8 +491,25 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
             raise JsonHandlerError(500, "Failed to submit project")
 
     @XBlock.json_handler
+    @instrument_handler
     def run_test_cases(self, data, suffix=""):
-        """Enhanced test case runner with better error handling and reporting."""
+        """
+        Run the test cases on the project.
+
+        Quick runs only run the sample tests, the ones which are not hidden. Full runs,
+        with `"full": true`, also run the hidden tests, at most once per
+        `full_test_run_interval` for each student. The grade is published once all the
+        tests ran on the current project. Full runs which executed no test, because
+        their results were memoized or the execution service failed, are not throttled.
+        """
+        full = bool(data.get("full"))
+        if full:
+            wait = self.last_full_test_run + self.full_test_run_interval - time.time()
+            if wait > 0:
+                raise JsonHandlerError(
+                    429, f"The full test suite can be run again in {math.ceil(wait)} seconds."
+                )
+
         try:
             if not self.test_cases:
                 return {
@@ -384,27 +518,26 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
                     "results": []
                 }
             
-            results = []
-            total_tests = len(self.test_cases)
-            
-            for i, test_case in enumerate(self.test_cases):
-                try:
-                    # Enhanced test case execution with timeout
-                    result = self._execute_test_case_enhanced(test_case, i + 1)
-                    results.append(result)
-                    
-                except Exception as e:
-                    logger.error(f"Error executing test case {i + 1}: {e}")
-                    results.append({
-                        "test_case": test_case,
-                        "test_number": i + 1,
-                        "test_name": test_case.get("name", f"Test {i + 1}"),
-                        "passed": False,
-                        "error": str(e),
-                        "execution_time": 0,
-                        "memory_used": 0
-                    })
-            
+            tests = [
+                (i + 1, test_case)
+                for i, test_case in enumerate(self.test_cases)
+                if full or not test_case.get("hidden")
+            ]
+            total_tests = len(tests)
+            results = self._run_test_cases(tests)
+            # Runs which only reused results or failed transiently do not count
+            if full and any(not result.get("cached") and not result.get("transient") for result in results):
+                self.last_full_test_run = time.time()
+
+            score = None
+            if self._has_all_test_results():
+                score = self.calculate_score()
+                self._publish_grade(score)
+            results = [
+                self._get_public_test_result(test_case, result)
+                for (_, test_case), result in zip(tests, results)
+            ]
+
             # Calculate summary statistics
             passed_count = sum(1 for r in results if r.get("passed", False))
             failed_count = total_tests - passed_count
@@ -416,14 +549,329 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
                     "total": total_tests,
                     "passed": passed_count,
                     "failed": failed_count,
-                    "pass_rate": (passed_count / total_tests * 100) if total_tests > 0 else 0
-                }
+                    "pass_rate": (passed_count / total_tests * 100) if total_tests > 0 else 0,
+                    "cached": sum(1 for r in results if r.get("cached")),
+                },
+                "full": full,
+                "hidden_tests": sum(1 for test_case in self.test_cases if test_case.get("hidden")),
+                "score": {"earned": score.raw_earned, "possible": score.raw_possible} if score else None,
             }
             
         except Exception as e:
             logger.error(f"Error running test cases: {e}")
             raise JsonHandlerError(500, f"Failed to run test cases: {str(e)}")
 
+    def _run_test_case(self, test_case, test_number):
+        """Run a test case, reporting its errors as a failed result."""
+        try:
+            # Enhanced test case execution with timeout
+            return self._execute_test_case_enhanced(test_case, test_number)
+        except Exception as e:
+            logger.error(f"Error executing test case {test_number}: {e}")
+            return {
+                "test_case": test_case,
+                "test_number": test_number,
+                "test_name": test_case.get("name", f"Test {test_number}"),
+                "passed": False,
+                "error": str(e),
+                "execution_time": 0,
+                "memory_used": 0,
+                "transient": True
+            }
+
+    def _run_test_cases(self, tests):
+        """
+        Run test cases on the project, reusing the results memoized for the same project.
+
+        Results are memoized by the hash of the project files and of each test case
+        definition, so running the tests again on unchanged files does not execute
+        anything, and editing the test suite only executes the changed test cases.
+
+        Args:
+            tests: The `(test number, test case)` pairs to run.
+
+        Returns:
+            The results of the test cases, in order.
+        """
+        passed, failures = self._get_memoized_test_results()
+        results = []
+        ran = []
+        for test_number, test_case in tests:
+            test_case_hash = self._get_test_case_hash(test_case)
+            if test_case_hash not in passed:
+                result = self._run_test_case(test_case, test_number)
+                ran.append((test_case, result))
+            else:
+                result = {
+                    "test_case": test_case,
+                    "test_number": test_number,
+                    "test_name": test_case.get("name", f"Test {test_number}"),
+                    "description": test_case.get("description", ""),
+                    "passed": passed[test_case_hash],
+                    "expected_output": test_case.get("expected_output", ""),
+                    **failures.get(test_case_hash, {}),
+                    "cached": True,
+                }
+            results.append(result)
+        if ran:
+            self._store_test_results([test_case for test_case, _ in ran], [result for _, result in ran])
+        return results
+
+    @staticmethod
+    def _get_public_test_result(test_case, result):
+        """Get the result of a test as shown to students, only passed or failed for hidden tests."""
+        if not test_case.get("hidden"):
+            return result
+        return {
+            "test_case": {"hidden": True},
+            "test_number": result.get("test_number"),
+            "test_name": "Hidden test",
+            "hidden": True,
+            "passed": result.get("passed", False),
+        }
+
+    def has_hidden_test_cases(self):
+        """Whether some test cases only run with the full test suite."""
+        return any(test_case.get("hidden") for test_case in self.test_cases)
+
+    # Scoring
+
+    @staticmethod
+    def _get_test_case_hash(test_case):
+        """Get the hash of a test case, which does not depend on its weight."""
+        definition = {key: value for key, value in test_case.items() if key != "weight"}
+        return get_content_hash(json.dumps(definition, sort_keys=True))
+
+    @staticmethod
+    def _get_test_case_weight(test_case):
+        """Get the weight of a test case in the score."""
+        return float(test_case.get("weight", 1))
+
+    def _get_project_hash(self):
+        """Get the hash of the contents of all the project files."""
+        file_hashes = {
+            filename: file_data.get("hash") or get_content_hash(file_data.get("content", ""))
+            for filename, file_data in self.project_files.items()
+        }
+        return get_content_hash(json.dumps(file_hashes, sort_keys=True))
+
+    def _store_test_results(self, test_cases, results):
+        """
+        Store whether the given test cases passed on the current project files.
+
+        Only the mismatch or the shortened error of the failed tests is kept, not their
+        output, so the state stays small. Results stored for other project files are
+        dropped. Transient failures, like timeouts or errors of the execution service,
+        are not stored, so the test cases run again.
+        """
+        project_hash = self._get_project_hash()
+        passed = {}
+        failures = {}
+        if self.test_results.get("project_hash") == project_hash:
+            passed = dict(self.test_results.get("passed", {}))
+            failures = dict(self.test_results.get("failures", {}))
+        for test_case, result in zip(test_cases, results):
+            if result.get("transient"):
+                continue
+            test_case_hash = self._get_test_case_hash(test_case)
+            passed[test_case_hash] = bool(result.get("passed", False))
+            failures.pop(test_case_hash, None)
+            if result.get("mismatch"):
+                failures[test_case_hash] = {"mismatch": result["mismatch"]}
+            elif result.get("error"):
+                failures[test_case_hash] = {"error": result["error"][:self.MAX_STORED_ERROR_LENGTH]}
+        self.test_results = {"project_hash": project_hash, "passed": passed, "failures": failures}
+
+    def _get_memoized_test_results(self):
+        """
+        Get whether the test cases passed on the current project files, and why the failed ones did.
+
+        Returns:
+            The `passed` booleans and the `failures` details, by test case hash.
+        """
+        if self.test_results.get("project_hash") != self._get_project_hash():
+            return {}, {}
+        return self.test_results.get("passed", {}), self.test_results.get("failures", {})
+
+    def _has_all_test_results(self):
+        """Whether all the test cases ran on the current project."""
+        if self.test_results.get("project_hash") != self._get_project_hash():
+            return False
+        passed = self.test_results.get("passed", {})
+        return all(self._get_test_case_hash(test_case) in passed for test_case in self.test_cases)
+
+    def max_score(self):
+        """The maximum raw score of the problem, the sum of the weights of the test cases."""
+        return sum(self._get_test_case_weight(test_case) for test_case in self.test_cases)
+
+    def has_submitted_answer(self):
+        """Whether the tests ran on the project of the learner."""
+        return bool(self.test_results)
+
+    def get_score(self):
+        """Get the last published score."""
+        return Score(
+            raw_earned=self.raw_score.get("raw_earned", 0),
+            raw_possible=self.raw_score.get("raw_possible", self.max_score()),
+        )
+
+    def set_score(self, score):
+        """Persist a score."""
+        self.raw_score = {"raw_earned": score.raw_earned, "raw_possible": score.raw_possible}
+
+    def calculate_score(self):
+        """
+        Score the project of the learner with the current test cases and weights.
+
+        Tests only run again for projects changed since they last ran, and for new
+        test cases, so rescoring a course only executes the projects which changed.
+        """
+        passed = self.test_results.get("passed", {})
+        if self.test_results.get("project_hash") != self._get_project_hash():
+            passed = {}
+        missing = [
+            (i + 1, test_case)
+            for i, test_case in enumerate(self.test_cases)
+            if self._get_test_case_hash(test_case) not in passed
+        ]
+        if missing:
+            self._run_test_cases(missing)
+            passed = self.test_results.get("passed", {})
+
+        earned = sum(
+            self._get_test_case_weight(test_case)
+            for test_case in self.test_cases
+            if passed.get(self._get_test_case_hash(test_case))
+        )
+        return Score(raw_earned=earned, raw_possible=self.max_score())
+
+    def _publish_grade(self, score, only_if_higher=None):
+        """Publish a grade, and keep it as the score of the learner."""
+        if not only_if_higher or score.raw_earned > self.get_score().raw_earned:
+            self.set_score(score)
+        super()._publish_grade(score, only_if_higher)
+
+    # File operations, applied on the given files dict
+
+    def _apply_file_operation(self, files, op, data, added, removed):
+        """
+        Apply a file operation on `files`.
+
+        The entries of the files it creates and deletes are appended to `added`
+        and `removed`, for `_update_project_structure`. A rename counts as both.
+        """
+        method_name = self.FILE_OPERATIONS.get(op)
+        if not method_name:
+            raise JsonHandlerError(400, "Unknown operation")
+
+        filenames = {data.get(key) for key in ("filename", "old_filename", "new_filename")} - {None}
+        before = {filename: files.get(filename) for filename in filenames}
+
+        result = getattr(self, method_name)(files, data)
+
+        for filename, old_file_data in before.items():
+            new_file_data = files.get(filename)
+            if old_file_data is None and new_file_data is not None:
+                added.append(new_file_data)
+            elif old_file_data is not None and new_file_data is None:
+                removed.append(old_file_data)
+        return result
+
+    def _create_file(self, files, data):
+        """Create a new file."""
+        filename = data.get("filename", "")
+        content = data.get("content", "")
+        file_type = data.get("file_type", "text")
+        
+        if not filename:
+            raise JsonHandlerError(400, "Filename is required")
+        
+        # Validate filename
+        if not self._is_valid_filename(filename):
+            raise JsonHandlerError(400, "Invalid filename")
+        
+        # Check if file already exists
+        if filename in files:
+            raise JsonHandlerError(409, "File already exists")
+        
+        files[filename] = self._new_file_entry(content, file_type)
+        return {"success": True, "filename": filename, **self._get_file_manifest_entry(files[filename])}
+
+    def _delete_file(self, files, data):
+        """Delete a file."""
+        filename = data.get("filename", "")
+        
+        if not filename:
+            raise JsonHandlerError(400, "Filename is required")
+        
+        if filename not in files:
+            raise JsonHandlerError(404, "File not found")
+        
+        # Check if it's a protected file (e.g., main entry point)
+        if self._is_protected_file(filename):
+            raise JsonHandlerError(403, "Cannot delete protected file")
+        
+        del files[filename]
+        return {"success": True, "filename": filename}
+
+    def _rename_file(self, files, data):
+        """Rename a file."""
+        old_filename = data.get("old_filename", "")
+        new_filename = data.get("new_filename", "")
+        
+        if not old_filename or not new_filename:
+            raise JsonHandlerError(400, "Both old and new filenames are required")
+        
+        if old_filename not in files:
+            raise JsonHandlerError(404, "File not found")
+        
+        if not self._is_valid_filename(new_filename):
+            raise JsonHandlerError(400, "Invalid filename")
+        
+        if new_filename in files:
+            raise JsonHandlerError(409, "File already exists")
+        
+        # Move file content
+        files[new_filename] = {**files.pop(old_filename), "modified_at": self._get_timestamp()}
+        return {"success": True, "old_filename": old_filename, "new_filename": new_filename}
+
+    def _save_file(self, files, data):
+        """
+        Save the content of a file.
+
+        Each save increments the version of the file. When `base_version` is given,
+        the save is rejected if the file was saved again since that version.
+        """
+        filename = data.get("filename", "")
+        content = data.get("content", "")
+        base_version = data.get("base_version")
+        
+        if not filename:
+            raise JsonHandlerError(400, "Filename is required")
+        
+        if filename not in files:
+            raise JsonHandlerError(404, "File not found")
+        
+        file_data = files[filename]
+        if base_version is not None and base_version != file_data.get("version", 1):
+            raise FileVersionConflict(filename, file_data)
+        
+        # Nothing to write when the content did not change
+        if file_data.get("content") == content:
+            return {"success": True, "filename": filename, **self._get_file_manifest_entry(file_data)}
+        
+        # Entries are replaced rather than updated, so that the copy made by
+        # `batch_file_ops` never shares a modified entry with the stored project.
+        file_data = {
+            **file_data,
+            "content": content,
+            "modified_at": self._get_timestamp(),
+            "version": file_data.get("version", 1) + 1,
+        }
+        self._set_file_hash(file_data)
+        files[filename] = file_data
+        return {"success": True, "filename": filename, **self._get_file_manifest_entry(file_data)}
+
     # Helper methods
 
     def _is_valid_filename(self, filename):
@@ -443,15 +891,91 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
         from datetime import datetime
         return datetime.now().isoformat()
 
-    def _update_project_structure(self):
-        """Update project structure metadata."""
+    def _new_file_entry(self, content, file_type="text"):
+        """Build the stored entry of a new project file."""
+        timestamp = self._get_timestamp()
+        file_data = {
+            "content": content,
+            "type": file_type,
+            "created_at": timestamp,
+            "modified_at": timestamp,
+            "language": self.language,
+            "version": 1,
+        }
+        self._set_file_hash(file_data)
+        return file_data
+
+    def _set_file_hash(self, file_data):
+        """Store the content hash and size of a file entry, and return the hash."""
+        content = file_data.get("content", "")
+        file_hash = get_content_hash(content)
+        if file_data.get("hash") != file_hash:
+            file_data["hash"] = file_hash
+            file_data["size"] = len(content.encode("utf-8"))
+        return file_hash
+
+    def _get_file_manifest_entry(self, file_data):
+        """Get the metadata of a project file, without its content."""
+        content = file_data.get("content", "")
+        return {
+            "size": file_data.get("size", len(content.encode("utf-8"))),
+            "hash": file_data.get("hash") or get_content_hash(content),
+            "version": file_data.get("version", 1),
+            "type": file_data.get("type", "text"),
+            "language": file_data.get("language", self.language),
+            "modified_at": file_data.get("modified_at"),
+        }
+
+    def _get_project_manifest(self):
+        """Get the metadata of all project files, without their contents."""
+        return {
+            filename: self._get_file_manifest_entry(file_data)
+            for filename, file_data in self.project_files.items()
+        }
+
+    def _update_project_structure(self, added=(), removed=(), rebuild=False):
+        """
+        Update project structure metadata.
+
+        The file counts per language and type are updated with the `added` and
+        `removed` file entries only, so the cost does not depend on the project
+        size. They are recomputed from all files with `rebuild`, or when the stored
+        structure predates the counters. Nothing is written when the counters did not
+        change, like when no file was added or removed, or a file was renamed.
+        """
+        structure = self.project_structure
+        if "language_counts" not in structure or "type_counts" not in structure:
+            rebuild = True
+
+        if not (added or removed or rebuild):
+            return
+
+        if rebuild:
+            added, removed = self.project_files.values(), ()
+            language_counts, type_counts = {}, {}
+        else:
+            language_counts = dict(structure["language_counts"])
+            type_counts = dict(structure["type_counts"])
+
+        for files, delta in ((added, 1), (removed, -1)):
+            for file_data in files:
+                for counts, key in (
+                    (language_counts, file_data.get("language", self.language)),
+                    (type_counts, file_data.get("type", "text")),
+                ):
+                    counts[key] = counts.get(key, 0) + delta
+                    if counts[key] <= 0:
+                        del counts[key]
+
+        if language_counts == structure.get("language_counts") and type_counts == structure.get("type_counts"):
+            return
         self.project_structure = {
-            "total_files": len(self.project_files),
-            "languages": list(set(file_data.get("language", self.language) 
-                                for file_data in self.project_files.values())),
+            "total_files": sum(type_counts.values()),
+            "languages": list(language_counts),
             "last_modified": self._get_timestamp(),
-            "file_types": list(set(file_data.get("type", "text") 
-                                 for file_data in self.project_files.values()))
+            "file_types": list(type_counts),
+            "language_counts": language_counts,
+            "type_counts": type_counts,
         }
 
     def _submit_multi_file_project(self, files_content):
@@ -489,7 +1013,6 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
             input_data = test_case.get("input", "")
             expected_output = test_case.get("expected_output", "")
             timeout = test_case.get("timeout", 10)
-            test_type = test_case.get("type", "output_comparison")
             
             # Get the main file content
             main_file_content = self._get_main_file_content()
@@ -539,7 +1062,8 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
                     "passed": False,
                     "error": "Test execution timeout",
                     "execution_time": execution_time,
-                    "memory_used": 0
+                    "memory_used": 0,
+                    "transient": True
                 }
             
             # Extract execution results
@@ -577,16 +1101,15 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
                 }
             
             # Perform test comparison based on test type
-            passed = self._compare_test_output(
-                stdout, expected_output, test_type
-            )
+            mismatch = self._compare_test_output(stdout, test_case)
             
             return {
                 "test_case": test_case,
                 "test_number": test_number,
                 "test_name": test_name,
                 "description": test_description,
-                "passed": passed,
+                "passed": mismatch is None,
+                "mismatch": mismatch,
                 "actual_output": stdout,
                 "expected_output": expected_output,
                 "execution_time": execution_time,
@@ -603,7 +1126,8 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
                 "passed": False,
                 "error": str(e),
                 "execution_time": 0,
-                "memory_used": 0
+                "memory_used": 0,
+                "transient": True
             }
 
     def _get_submission_result_with_timeout(self, submission_id, timeout_seconds=10):
@@ -631,28 +1155,17 @@ class MultiFileCodingAIEvalXBlock(CodingAIEvalXBlock):
         
         return None
 
-    def _compare_test_output(self, actual, expected, test_type="output_comparison"):
-        """Compare test output using different comparison methods."""
-        if test_type == "exact_match":
-            return actual == expected
-        
-        elif test_type == "output_comparison":
-            # Default: trim whitespace and compare
-            return actual.strip() == expected.strip()
-        
-        elif test_type == "contains":
-            return expected in actual
-        
-        elif test_type == "regex":
-            import re
-            try:
-                return bool(re.search(expected, actual))
-            except re.error:
-                return False
-        
-        else:
-            # Default to output comparison
-            return actual.strip() == expected.strip()
+    def _compare_test_output(self, actual, test_case):
+        """
+        Compare test output with the matcher of the test case, compiled once per process.
+
+        Returns the description of the first difference, None when the output matches.
+        """
+        try:
+            return get_test_case_matcher(test_case)(actual)
+        except InvalidTestCase as e:
+            logger.error(f"Invalid test case: {e}")
+            return f"Invalid test case: {e}"
     
     def _execute_test_case(self, test_case):
         """Execute a single test case."""
@@ -0,0 +1,226 @@
+"""
+Similarity report of the code submitted to the coding blocks of a course.
+
+Each submission is normalized (see `similarity.normalize_code`) and reduced to
+its winnowing fingerprints: the minimum hash of every window of consecutive
+k-gram hashes. Submissions are then compared through an inverted index of the
+fingerprints, so only the pairs sharing rare fingerprints are scored, instead of
+all the pairs of submissions. Pairs sharing common fingerprints only, like the
+variants of a solution copied by many learners, are found by LSH on the MinHash
+signatures of the fingerprints. Fingerprints shared by most submissions, like
+the ones of starter code, are ignored, and the ones shared by many submissions
+count less towards the similarity than the rare ones, which show code written
+together. Submissions with the same fingerprints, like copied code, are scored
+once.
+"""
+
+import csv
+import hashlib
+import itertools
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, TextIO
+
+from .similarity import get_band_keys, get_set_signature, normalize_code
+
+# Tokens per k-gram, and k-gram hashes per winnowing window. Any match of at least
+# KGRAM_SIZE + WINNOWING_WINDOW - 1 tokens shares a fingerprint.
+KGRAM_SIZE = 5
+WINNOWING_WINDOW = 4
+# Pairs less similar than this are left out of the report
+REPORT_MIN_SIMILARITY = 0.5
+# Fingerprints of more than this share of the submissions of a block weigh less
+COMMON_FINGERPRINT_SHARE = 0.02
+# Fingerprints of more than this share of the submissions of a block, like starter code, are ignored
+TEMPLATE_FINGERPRINT_SHARE = 0.5
+# Fingerprints shared by this many submissions always weigh fully, in small blocks
+MIN_FINGERPRINT_LIMIT = 10
+# Distinct submissions of an LSH bucket larger than this are not paired through it
+MAX_LSH_BUCKET_SIZE = 1000
+
+REPORT_FIELDS = ["block_id", "learner", "other_learner", "similarity", "shared_fingerprints"]
+
+
+@dataclass(frozen=True)
+class Submission:
+    """
+    The code submitted by a learner to a block.
+    """
+
+    block_id: str
+    learner: str
+    code: str
+    language: str
+
+
+def _hash_kgram(tokens: list[str]) -> int:
+    return int.from_bytes(hashlib.blake2b(" ".join(tokens).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def get_fingerprints(code: str, language: str) -> frozenset[int]:
+    """
+    Get the winnowing fingerprints of some code.
+    """
+    tokens = normalize_code(code, language)
+    hashes = [_hash_kgram(tokens[i:i + KGRAM_SIZE]) for i in range(len(tokens) - KGRAM_SIZE + 1)]
+    if len(hashes) <= WINNOWING_WINDOW:
+        return frozenset([min(hashes)] if hashes else [])
+    return frozenset(
+        min(hashes[i:i + WINNOWING_WINDOW])
+        for i in range(len(hashes) - WINNOWING_WINDOW + 1)
+    )
+
+
+def _get_fingerprints(submission: Submission) -> frozenset[int]:
+    return get_fingerprints(submission.code, submission.language)
+
+
+def _iter_candidates(distinct: list[frozenset[int]], counts: Counter, weights: dict, limit: int) -> Iterator:
+    """
+    Iterate over the pairs of distinct fingerprint sets which may be similar, set by set.
+
+    They are the pairs sharing a fingerprint of at most `limit` submissions, and the
+    pairs sharing an LSH bucket of the MinHash signatures of their fingerprints, so
+    common fingerprints are never expanded into all the pairs of their submissions.
+    Only the candidates of one set are kept at a time.
+    """
+    postings = defaultdict(list)
+    buckets = defaultdict(list)
+    band_keys = []
+    for group, prints in enumerate(distinct):
+        for fingerprint in prints:
+            if counts[fingerprint] <= limit:
+                postings[fingerprint].append(group)
+        signature = get_set_signature(fingerprint for fingerprint in prints if fingerprint in weights)
+        band_keys.append(get_band_keys(signature) if signature else [])
+        for band_key in band_keys[-1]:
+            buckets[band_key].append(group)
+
+    for group, prints in enumerate(distinct):
+        others = set()
+        for fingerprint in prints:
+            if counts[fingerprint] <= limit:
+                others.update(postings[fingerprint])
+        for band_key in band_keys[group]:
+            if len(buckets[band_key]) <= MAX_LSH_BUCKET_SIZE:
+                others.update(buckets[band_key])
+        for other_group in others:
+            if other_group > group:
+                yield group, other_group
+
+
+def score_pairs(
+    fingerprints: list[frozenset[int]],
+    min_similarity: float = REPORT_MIN_SIMILARITY,
+) -> list[tuple[int, int, float, int]]:
+    """
+    Score the pairs of similar fingerprint sets by their weighted Jaccard similarity.
+
+    A fingerprint of more submissions than the common limit weighs the limit divided
+    by its number of submissions, so code many learners share counts less than the
+    code only a few of them share, without hiding a solution copied by many learners.
+
+    Returns:
+        `(index, other index, similarity, shared fingerprints)` tuples, most similar first.
+    """
+    groups = defaultdict(list)
+    for index, prints in enumerate(fingerprints):
+        groups[prints].append(index)
+    distinct = list(groups)
+
+    counts = Counter()
+    postings = defaultdict(list)
+    for group, prints in enumerate(distinct):
+        for fingerprint in prints:
+            counts[fingerprint] += len(groups[prints])
+            postings[fingerprint].append(group)
+
+    limit = max(MIN_FINGERPRINT_LIMIT, int(len(fingerprints) * COMMON_FINGERPRINT_SHARE))
+    template_limit = max(MIN_FINGERPRINT_LIMIT, int(len(fingerprints) * TEMPLATE_FINGERPRINT_SHARE))
+    weights = {
+        fingerprint: min(1.0, limit / count)
+        for fingerprint, count in counts.items()
+        if count <= template_limit
+    }
+    totals = [sum(weights.get(fingerprint, 0.0) for fingerprint in prints) for prints in distinct]
+
+    pairs = []
+    for group, prints in enumerate(distinct):
+        if totals[group]:
+            count = sum(1 for fingerprint in prints if fingerprint in weights)
+            for index, other in itertools.combinations(groups[prints], 2):
+                pairs.append((index, other, 1.0, count))
+    for group, other_group in _iter_candidates(distinct, counts, weights, limit):
+        smaller, larger = sorted((totals[group], totals[other_group]))
+        # The similarity is at most the ratio of the weights of the two sets
+        if not smaller or smaller < min_similarity * larger:
+            continue
+        shared = [fingerprint for fingerprint in distinct[group] & distinct[other_group] if fingerprint in weights]
+        weight = sum(weights[fingerprint] for fingerprint in shared)
+        if not weight:
+            continue
+        similarity = weight / (totals[group] + totals[other_group] - weight)
+        if similarity >= min_similarity:
+            for index, other in itertools.product(groups[distinct[group]], groups[distinct[other_group]]):
+                pairs.append((*sorted((index, other)), similarity, len(shared)))
+    pairs.sort(key=lambda pair: (-pair[2], pair[0], pair[1]))
+    return pairs
+
+
+def _group_by_block(submissions: Iterable[Submission]) -> Iterator[list[Submission]]:
+    """
+    Group submissions sorted by block.
+    """
+    group = []
+    for submission in submissions:
+        if group and submission.block_id != group[0].block_id:
+            yield group
+            group = []
+        group.append(submission)
+    if group:
+        yield group
+
+
+def write_similarity_report(
+    submissions: Iterable[Submission],
+    output: TextIO,
+    min_similarity: float = REPORT_MIN_SIMILARITY,
+    workers: int = 1,
+) -> int:
+    """
+    Write the CSV report of the similar submissions of each block, most similar first.
+
+    Args:
+        submissions: The submissions, sorted by block so each block can be written
+            as soon as it is scored.
+        output: The file the CSV is written to.
+        min_similarity: The minimum similarity of the reported pairs.
+        workers: The number of processes fingerprinting the submissions.
+
+    Returns:
+        The number of reported pairs.
+    """
+    writer = csv.writer(output)
+    writer.writerow(REPORT_FIELDS)
+    rows = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for block_submissions in _group_by_block(submissions):
+            if executor:
+                fingerprints = list(executor.map(_get_fingerprints, block_submissions, chunksize=64))
+            else:
+                fingerprints = [_get_fingerprints(submission) for submission in block_submissions]
+            for index, other, similarity, count in score_pairs(fingerprints, min_similarity):
+                writer.writerow([
+                    block_submissions[index].block_id,
+                    block_submissions[index].learner,
+                    block_submissions[other].learner,
+                    f"{similarity:.3f}",
+                    count,
+                ])
+                rows += 1
+    finally:
+        if executor:
+            executor.shutdown()
+    return rows
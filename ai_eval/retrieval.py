@@ -0,0 +1,87 @@
+"""
+Local retrieval of the passages of attachments relevant to a query.
+
+Attachments are split in chunks of consecutive lines, which are ranked with
+BM25. Everything runs in process, without any network call.
+"""
+
+import math
+import re
+from collections import Counter
+
+CHUNK_WORDS = 200
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TERM_RE = re.compile(r"\w+")
+
+
+def get_terms(text: str) -> list[str]:
+    """
+    Split a text in lowercase terms.
+    """
+    return TERM_RE.findall(text.lower())
+
+
+def chunk_text(text: str, chunk_words: int = CHUNK_WORDS) -> list[str]:
+    """
+    Split a text in chunks of consecutive lines, of about `chunk_words` words each.
+
+    Lines are never split, so code and paragraphs stay readable.
+    """
+    chunks = []
+    lines = []
+    words = 0
+    for line in text.splitlines(keepends=True):
+        lines.append(line)
+        words += len(line.split())
+        if words >= chunk_words:
+            chunks.append("".join(lines))
+            lines = []
+            words = 0
+    if "".join(lines).strip():
+        chunks.append("".join(lines))
+    return chunks
+
+
+class BM25Index:
+    """
+    BM25 index over a list of documents.
+    """
+
+    def __init__(self, documents: list[str]):
+        self.term_frequencies = [Counter(get_terms(document)) for document in documents]
+        self.lengths = [sum(frequencies.values()) for frequencies in self.term_frequencies]
+        self.average_length = sum(self.lengths) / len(documents) if documents else 0
+        document_frequencies = Counter()
+        for frequencies in self.term_frequencies:
+            document_frequencies.update(frequencies.keys())
+        count = len(documents)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequencies.items()
+        }
+
+    def score(self, query_terms: list[str], document: int) -> float:
+        """
+        Get the BM25 score of a document for the terms of a query.
+        """
+        frequencies = self.term_frequencies[document]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[document] / (self.average_length or 1))
+        score = 0.0
+        for term in query_terms:
+            if frequency := frequencies.get(term):
+                score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return score
+
+    def search(self, query: str, top_k: int) -> list[int]:
+        """
+        Get the indexes of the `top_k` documents most relevant to a query, best first.
+
+        Documents sharing no term with the query are left out.
+        """
+        query_terms = [term for term in set(get_terms(query)) if term in self.idf]
+        scores = [(self.score(query_terms, document), document) for document in range(len(self.lengths))]
+        scores = [(score, document) for score, document in scores if score > 0]
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return [document for _, document in scores[:top_k]]
@@ -2,20 +2,25 @@
 
 import logging
 import traceback
-import urllib.parse
-import urllib.request
-from multiprocessing.dummy import Pool
-from xml.sax import saxutils
+import urllib.error
 
 from django.utils.translation import gettext_noop as _
 from web_fragments.fragment import Fragment
 from xblock.core import XBlock
 from xblock.exceptions import JsonHandlerError
-from xblock.fields import Boolean, Integer, List, String, Scope
+from xblock.fields import Boolean, Dict, Integer, List, String, Scope
 from xblock.validation import ValidationMessage
 
+from .attachments import (
+    ATTACHMENT_DOWNLOAD_TIMEOUT,
+    AttachmentError,
+    download_attachment_prompt,
+    get_attachments_prompt,
+)
 from .llm import get_llm_response
 from .base import AIEvalXBlock
+from .metrics import instrument_handler
+from .utils import render_markdown
 
 
 logger = logging.getLogger(__name__)
@@ -26,7 +31,8 @@ class ShortAnswerAIEvalXBlock(AIEvalXBlock):
     Short Answer Xblock.
     """
 
-    ATTACHMENT_PARALLEL_DOWNLOADS = 5
+    # Maximum number of attachment chunks included in a prompt, when over the token budget
+    ATTACHMENT_TOP_CHUNKS = 8
 
     display_name = String(
         display_name=_("Display Name"),
@@ -65,11 +71,29 @@ class ShortAnswerAIEvalXBlock(AIEvalXBlock):
         resettable_editor=False,
     )
 
+    attachment_token_budget = Integer(
+        display_name=_("Attachments token budget"),
+        help=_(
+            "Maximum number of tokens of the attachments included with the evaluation prompt. "
+            "Larger attachments are reduced to their passages most relevant to the question "
+            "and the student's answer. Set to 0 to always include the whole attachments."
+        ),
+        scope=Scope.settings,
+        default=4000,
+    )
+
+    messages_html = Dict(
+        help=_("Chat messages rendered to HTML, parallel to the messages"),
+        scope=Scope.user_state,
+        default={AIEvalXBlock.USER_KEY: [], AIEvalXBlock.LLM_KEY: []},
+    )
+
     editable_fields = AIEvalXBlock.editable_fields + (
         "max_responses",
         "allow_reset",
         "character_image",
         "attachment_urls",
+        "attachment_token_budget",
     )
 
     def validate_field_data(self, validation, data):
@@ -87,6 +111,14 @@ class ShortAnswerAIEvalXBlock(AIEvalXBlock):
                 )
             )
 
+        if data.attachment_token_budget is None or data.attachment_token_budget < 0:
+            validation.add(
+                ValidationMessage(
+                    ValidationMessage.ERROR,
+                    _("attachments token budget must be a positive integer, or 0"),
+                )
+            )
+
     def student_view(self, context=None):
         """
         The primary view of the ShortAnswerAIEvalXBlock, shown to students
@@ -103,54 +135,72 @@ class ShortAnswerAIEvalXBlock(AIEvalXBlock):
             )
         )
 
-        frag.add_css(self.resource_string("static/css/shortanswer.css"))
-        frag.add_javascript(self.resource_string("static/js/src/utils.js"))
-        frag.add_javascript(self.resource_string("static/js/src/shortanswer.js"))
-
-        marked_html = self.resource_string("static/html/marked-iframe.html")
+        self.add_bundle(frag, "shortanswer.css")
+        self.add_bundle(frag, "utils.js")
+        self.add_bundle(frag, "shortanswer.js")
 
         js_data = {
-            "question": self.question,
-            "messages": self.messages,
+            "question_html": self.get_question_html(),
+            "messages_html": self._get_messages_html(),
             "max_responses": self.max_responses,
-            "marked_html": marked_html,
         }
         frag.initialize_js("ShortAnswerAIEvalXBlock", js_data)
         return frag
 
-    def _download_attachment(self, url):
-        with urllib.request.urlopen(url) as f:
-            return f.read().decode('utf-8')
+    def _get_messages_html(self):
+        """
+        Get the chat messages rendered to HTML.
 
-    def _filename_for_url(self, url):
-        return urllib.parse.urlparse(url).path.split('/')[-1]
+        Messages stored before their HTML was kept are rendered on the fly.
+        """
+        messages_html = {}
+        for key in (self.USER_KEY, self.LLM_KEY):
+            rendered = self.messages_html.get(key, [])
+            if len(rendered) != len(self.messages[key]):
+                rendered = [render_markdown(message) for message in self.messages[key]]
+            messages_html[key] = rendered
+        return messages_html
+
+    def _download_attachment_prompt(self, url, timeout=ATTACHMENT_DOWNLOAD_TIMEOUT):
+        return download_attachment_prompt(url, timeout=timeout)
+
+    def _get_attachments_prompt(self):
+        """
+        Get the prompt block of the attachments, built once per attachment version.
+        """
+        return get_attachments_prompt(self.attachment_urls, self.model, self._download_attachment_prompt)
 
-    def _get_attachments(self):
-        pool = Pool(self.ATTACHMENT_PARALLEL_DOWNLOADS)
-        attachments = pool.map(self._download_attachment, self.attachment_urls)
-        filenames = map(self._filename_for_url, self.attachment_urls)
-        return zip(filenames, attachments)
+    def editor_saved(self, user, old_metadata, old_content):  # pylint: disable=unused-argument
+        """
+        Prepare the prompt block of the attachments when the block is saved in Studio.
+        """
+        if not self.attachment_urls:
+            return
+        try:
+            self._get_attachments_prompt()
+        except (AttachmentError, urllib.error.URLError, TimeoutError, UnicodeDecodeError) as e:
+            logger.warning(f"Failed while preparing the attachments: {e}")
 
     @XBlock.json_handler
+    @instrument_handler
     def get_response(self, data, suffix=""):  # pylint: disable=unused-argument
         """Get LLM feedback"""
         user_submission = str(data["user_input"])
 
-        attachments = []
-        for filename, contents in self._get_attachments():
-            attachments.append(f"""
-                <attachment>
-                    <filename>{saxutils.escape(filename)}</filename>
-                    <contents>{saxutils.escape(contents)}</contents>
-                </attachment>
-            """)
-        attachments = '\n'.join(attachments)
+        try:
+            attachments = self._get_attachments_prompt()
+        except (AttachmentError, urllib.error.URLError, TimeoutError, UnicodeDecodeError) as e:
+            logger.error(f"Failed while downloading the attachments: {e}")
+            raise JsonHandlerError(500, "A probem occured while loading the attachments. Please retry.") from e
+        attachments_text = attachments.select(
+            f"{self.question}\n{user_submission}", self.attachment_token_budget, self.ATTACHMENT_TOP_CHUNKS
+        )
 
         system_msg = {
             "role": "system",
             "content": f"""
                 {self.evaluation_prompt}
-                {attachments}
+                {attachments_text}
                 {self.question}.
                 Evaluation must be in Markdown format.
             """,
@@ -182,13 +232,24 @@ class ShortAnswerAIEvalXBlock(AIEvalXBlock):
             raise JsonHandlerError(500, "A probem occured. Please retry.") from e
 
         if response:
+            messages_html = self._get_messages_html()
+            user_submission_html = render_markdown(user_submission)
+            response_html = render_markdown(response)
+            messages_html[self.USER_KEY].append(user_submission_html)
+            messages_html[self.LLM_KEY].append(response_html)
             self.messages[self.USER_KEY].append(user_submission)
             self.messages[self.LLM_KEY].append(response)
-            return {"response": response}
+            self.messages_html = messages_html
+            return {
+                "response": response,
+                "response_html": response_html,
+                "user_input_html": user_submission_html,
+            }
 
         raise JsonHandlerError(500, "A probem occured. The LLM sent an empty response.")
 
     @XBlock.json_handler
+    @instrument_handler
     def reset(self, data, suffix=""):
         """
         Reset the Xblock.
@@ -196,6 +257,7 @@ class ShortAnswerAIEvalXBlock(AIEvalXBlock):
         if not self.allow_reset:
             raise JsonHandlerError(403, "Reset is disabled.")
         self.messages = {self.USER_KEY: [], self.LLM_KEY: []}
+        self.messages_html = {self.USER_KEY: [], self.LLM_KEY: []}
         return {}
 
     @staticmethod
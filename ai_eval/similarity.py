@@ -0,0 +1,365 @@
+"""
+Detection of near-duplicate code submissions.
+
+Code is normalized into a stream of tokens without comments, whitespace or
+identifier names, so submissions differing only by those are identical. The
+k-token shingles of a submission are summarized by a one permutation MinHash
+signature, which hashes each shingle once, and a locality sensitive hashing
+(LSH) index over the signature bands finds the similar submissions without
+comparing them all.
+
+The clusters of the submissions of a block are kept in the Django cache, in
+small entries which are each updated with a single atomic cache operation, so
+concurrent submissions never overwrite each other's updates. Submissions are
+clustered in a background thread, off the path of the requests.
+"""
+
+import hashlib
+import io
+import keyword
+import logging
+import re
+import threading
+import tokenize
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from django.core.cache import cache
+
+from .utils import LanguageLabels, get_content_hash
+
+logger = logging.getLogger(__name__)
+
+# Tokens per shingle
+SHINGLE_SIZE = 5
+# Values of a signature, each the minimum of the hashes of one bin of the shingles
+MINHASH_SIZE = 64
+# The signature is split in bands of rows, submissions sharing a band are candidates.
+# 16 bands of 4 rows make candidates of most pairs over a similarity of about 0.5.
+LSH_BANDS = 16
+# Minimum estimated similarity of two submissions of the same cluster
+SIMILARITY_THRESHOLD = 0.8
+# Clusters kept per block, new submissions are not clustered past it
+MAX_SUBMISSION_CLUSTERS = 1000
+# Seconds the entries of the clusters are kept in the cache after they are set
+SUBMISSION_CLUSTERS_TIMEOUT = 30 * 24 * 60 * 60
+# Members of a cluster whose ids are kept, for instructors to review
+MAX_CLUSTER_SAMPLE = 10
+# Characters of the representative code kept for a cluster
+MAX_REPRESENTATIVE_LENGTH = 10_000
+
+# Added to the values copied to the empty bins of a signature, by bin of distance
+DENSIFICATION_OFFSET = 1 << 58
+
+IDENTIFIER = "ID"
+
+C_LIKE_KEYWORDS = {
+    "break", "case", "catch", "class", "const", "continue", "default", "delete", "do", "else",
+    "enum", "extends", "false", "finally", "for", "if", "new", "null", "private", "protected",
+    "public", "return", "static", "switch", "this", "throw", "true", "try", "void", "while",
+}
+# Keywords kept by the lexer of each language, the other identifiers are all made equal.
+# None keeps every identifier, for markup where names are the content.
+LANGUAGE_KEYWORDS = {
+    LanguageLabels.JavaScript: C_LIKE_KEYWORDS | {
+        "async", "await", "function", "in", "instanceof", "let", "of", "typeof", "undefined", "var", "yield",
+    },
+    LanguageLabels.Java: C_LIKE_KEYWORDS | {
+        "abstract", "boolean", "byte", "char", "double", "final", "float", "implements", "import",
+        "instanceof", "int", "interface", "long", "package", "short", "super", "synchronized", "throws",
+    },
+    LanguageLabels.CPP: C_LIKE_KEYWORDS | {
+        "auto", "bool", "char", "double", "float", "include", "int", "long", "namespace", "nullptr",
+        "short", "signed", "sizeof", "std", "struct", "template", "typename", "unsigned", "using", "virtual",
+    },
+    LanguageLabels.HTML_CSS: None,
+}
+
+C_LIKE_COMMENT_RE = r"//[^\n]*|/\*.*?\*/"
+COMMENT_RES = {
+    LanguageLabels.JavaScript: re.compile(C_LIKE_COMMENT_RE, re.DOTALL),
+    LanguageLabels.Java: re.compile(C_LIKE_COMMENT_RE, re.DOTALL),
+    LanguageLabels.CPP: re.compile(C_LIKE_COMMENT_RE, re.DOTALL),
+    LanguageLabels.HTML_CSS: re.compile(r"<!--.*?-->|/\*.*?\*/", re.DOTALL),
+}
+TOKEN_RE = re.compile(
+    r"""
+    "(?:\\.|[^"\\\n])*"         # double quoted string
+    | '(?:\\.|[^'\\\n])*'       # single quoted string
+    | `(?:\\.|[^`\\])*`         # template literal
+    | [A-Za-z_$][\w$]*          # identifier or keyword
+    | \d[\w.]*                  # number
+    | \S                        # operator or punctuation
+    """,
+    re.VERBOSE,
+)
+
+
+def _normalize_python(code: str, keep_names: bool = False) -> list[str]:
+    """
+    Tokenize Python code with the standard tokenizer.
+    """
+    tokens = []
+    skipped = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type in skipped:
+            continue
+        if token.type == tokenize.NAME and not keep_names and not keyword.iskeyword(token.string):
+            tokens.append(IDENTIFIER)
+        elif token.type in (tokenize.INDENT, tokenize.DEDENT, tokenize.NEWLINE):
+            tokens.append(tokenize.tok_name[token.type])
+        else:
+            tokens.append(token.string)
+    return tokens
+
+
+def _normalize_with_lexer(code: str, language: str, keep_names: bool = False) -> list[str]:
+    """
+    Tokenize code with a simple lexer, which knows the comments and keywords of the language.
+    """
+    if comment_re := COMMENT_RES.get(language):
+        code = comment_re.sub(" ", code)
+    keywords = LANGUAGE_KEYWORDS.get(language)
+    tokens = TOKEN_RE.findall(code)
+    if keywords is None or keep_names:
+        return tokens
+    return [
+        IDENTIFIER if (token[0].isalpha() or token[0] in "_$") and token not in keywords else token
+        for token in tokens
+    ]
+
+
+def normalize_code(code: str, language: str, keep_names: bool = False) -> list[str]:
+    """
+    Get the tokens of some code, without comments, whitespace or identifier names.
+
+    With `keep_names`, identifiers are kept, so only code which behaves the same
+    has the same tokens.
+    """
+    if language == LanguageLabels.Python:
+        try:
+            return _normalize_python(code, keep_names)
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            # Code which does not tokenize is still compared, as generic code
+            pass
+    return _normalize_with_lexer(code, language, keep_names)
+
+
+def get_normalized_hash(tokens: list[str]) -> str:
+    """
+    Get a hash of normalized code, equal for exact duplicates.
+    """
+    return get_content_hash(" ".join(tokens))
+
+
+def get_minhash_signature(tokens: list[str]) -> list[int] | None:
+    """
+    Get the MinHash signature of the shingles of normalized code.
+
+    Returns None for code without any token.
+    """
+    if not tokens:
+        return None
+    shingles = {
+        " ".join(tokens[i:i + SHINGLE_SIZE])
+        for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))
+    }
+    return get_set_signature(
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in shingles
+    )
+
+
+def get_set_signature(values: Iterable[int]) -> list[int] | None:
+    """
+    Get the one permutation MinHash signature of a set of uniform 64-bit hashes.
+
+    The hashes are split in bins by their lowest bits, and each value of the signature
+    is the minimum of a bin. Empty bins take the value of the next non-empty one, offset
+    by their distance, so they still agree as often as the bins of similar sets do.
+
+    Returns None for an empty set.
+    """
+    bins = [None] * MINHASH_SIZE
+    for value in values:
+        index, rest = value % MINHASH_SIZE, value // MINHASH_SIZE
+        if bins[index] is None or rest < bins[index]:
+            bins[index] = rest
+    filled = [index for index, value in enumerate(bins) if value is not None]
+    if not filled:
+        return None
+    signature = []
+    for index, value in enumerate(bins):
+        if value is None:
+            # The next filled bin, wrapping around
+            distance = next((other - index for other in filled if other > index), filled[0] + MINHASH_SIZE - index)
+            value = bins[(index + distance) % MINHASH_SIZE] + distance * DENSIFICATION_OFFSET
+        signature.append(value)
+    return signature
+
+
+def estimate_similarity(signature: list[int], other: list[int]) -> float:
+    """
+    Estimate the Jaccard similarity of the shingles of two signatures.
+    """
+    return sum(1 for a, b in zip(signature, other) if a == b) / len(signature)
+
+
+def get_band_keys(signature: list[int]) -> list[str]:
+    """
+    Get the LSH bucket keys of the bands of a signature.
+    """
+    rows = len(signature) // LSH_BANDS
+    return [
+        f"{band}:{get_content_hash(repr(signature[band * rows:(band + 1) * rows]))}"
+        for band in range(LSH_BANDS)
+    ]
+
+
+class SubmissionClusters:
+    """
+    Clusters of the similar submissions of a block, kept in the Django cache.
+
+    Signatures, cluster keys and counts are stored, with the first submission of each
+    cluster, shortened, and the ids of its first members. Each is in its own entry,
+    set with `add` or `incr`, which are atomic. An LSH bucket only holds the first
+    cluster added to it, which makes it a candidate for all the later submissions
+    sharing that band.
+    """
+
+    def __init__(self, namespace: str):
+        self.prefix = "ai_eval.clusters." + hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:32]
+
+    def _key(self, *parts: str) -> str:
+        return ".".join((self.prefix, *parts))
+
+    def _increment(self, key: str) -> int:
+        cache.add(key, 0, SUBMISSION_CLUSTERS_TIMEOUT)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Evicted since it was added
+            cache.add(key, 1, SUBMISSION_CLUSTERS_TIMEOUT)
+            return 1
+
+    def _find(self, key: str, signature: list[int], threshold: float) -> tuple[str, float] | None:
+        signature_key = self._key("signature", key)
+        entries = cache.get_many([signature_key, *(self._key("bucket", band) for band in get_band_keys(signature))])
+        if signature_key in entries:
+            return key, 1.0
+        candidates = sorted(set(entries.values()))
+        signatures = cache.get_many([self._key("signature", candidate) for candidate in candidates])
+        matches = [
+            (estimate_similarity(signature, signatures[self._key("signature", candidate)]), candidate)
+            for candidate in candidates
+            if self._key("signature", candidate) in signatures
+        ]
+        matches = [(similarity, candidate) for similarity, candidate in matches if similarity >= threshold]
+        if not matches:
+            return None
+        similarity, key = max(matches)
+        return key, similarity
+
+    def find(self, tokens: list[str], threshold: float = SIMILARITY_THRESHOLD) -> tuple[str, float] | None:
+        """
+        Find the cluster of normalized code.
+
+        Returns:
+            The key of the most similar cluster and the estimated similarity, or None.
+        """
+        signature = get_minhash_signature(tokens)
+        if not signature:
+            return None
+        return self._find(get_normalized_hash(tokens), signature, threshold)
+
+    def add(self, tokens: list[str], code: str, member: str) -> str | None:
+        """
+        Count a submission in the cluster of the most similar code, or make it a new cluster.
+
+        Args:
+            tokens: The normalized code of the submission.
+            code: The code of the submission, kept when it makes a new cluster.
+            member: The id of the learner who submitted it.
+
+        Returns:
+            The key of the cluster, None when the code has no token or there are too many clusters.
+        """
+        signature = get_minhash_signature(tokens)
+        if not signature:
+            return None
+        key = get_normalized_hash(tokens)
+        if match := self._find(key, signature, SIMILARITY_THRESHOLD):
+            key = match[0]
+        else:
+            number = self._increment(self._key("count"))
+            if number > MAX_SUBMISSION_CLUSTERS:
+                return None
+            # False when the same cluster was just added by another submission
+            if cache.add(self._key("signature", key), signature, SUBMISSION_CLUSTERS_TIMEOUT):
+                cache.add(self._key("cluster", str(number)), key, SUBMISSION_CLUSTERS_TIMEOUT)
+                cache.add(self._key("code", key), code[:MAX_REPRESENTATIVE_LENGTH], SUBMISSION_CLUSTERS_TIMEOUT)
+                for band_key in get_band_keys(signature):
+                    cache.add(self._key("bucket", band_key), key, SUBMISSION_CLUSTERS_TIMEOUT)
+        size = self._increment(self._key("size", key))
+        if size <= MAX_CLUSTER_SAMPLE:
+            cache.add(self._key("member", key, str(size)), member, SUBMISSION_CLUSTERS_TIMEOUT)
+        return key
+
+    def get_clusters(self) -> list[dict]:
+        """
+        Get the clusters, largest first, with their size, representative code and sample of members.
+        """
+        count = min(cache.get(self._key("count"), 0), MAX_SUBMISSION_CLUSTERS)
+        numbers = cache.get_many([self._key("cluster", str(number)) for number in range(1, count + 1)])
+        keys = sorted(set(numbers.values()))
+        entries = cache.get_many([
+            entry_key
+            for key in keys
+            for entry_key in (
+                self._key("size", key),
+                self._key("code", key),
+                *(self._key("member", key, str(number)) for number in range(1, MAX_CLUSTER_SAMPLE + 1)),
+            )
+        ])
+        clusters = [
+            {
+                "key": key,
+                "size": entries.get(self._key("size", key), 0),
+                "code": entries.get(self._key("code", key), ""),
+                "members": [
+                    entries[member_key]
+                    for number in range(1, MAX_CLUSTER_SAMPLE + 1)
+                    if (member_key := self._key("member", key, str(number))) in entries
+                ],
+            }
+            for key in keys
+        ]
+        clusters.sort(key=lambda cluster: (-cluster["size"], cluster["key"]))
+        return clusters
+
+
+def cluster_submission(namespace: str, code: str, language: str, member: str) -> str | None:
+    """
+    Count a submission in the clusters of its block, see `SubmissionClusters.add`.
+    """
+    try:
+        return SubmissionClusters(namespace).add(normalize_code(code, language), code, member)
+    except Exception:  # pylint: disable=broad-except
+        # Clustering runs in the background, its errors must not be lost
+        logger.exception(f"Could not cluster a submission of {namespace}")
+        return None
+
+
+_clustering_executor: ThreadPoolExecutor | None = None
+_clustering_executor_lock = threading.Lock()
+
+
+def get_clustering_executor() -> ThreadPoolExecutor:
+    """
+    Get the thread clustering the submissions of the process, in the order they are submitted.
+    """
+    global _clustering_executor  # pylint: disable=global-statement
+    with _clustering_executor_lock:
+        if _clustering_executor is None:
+            _clustering_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai_eval_clusters")
+    return _clustering_executor
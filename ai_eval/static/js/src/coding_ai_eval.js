@@ -8,13 +8,12 @@ function CodingAIEvalXBlock(runtime, element, data) {
     element,
     "get_submission_result_handler",
   );
-  loadMarkedInIframe(data.marked_html);
   const llmResponseHandlerURL = runtime.handlerUrl(element, "get_response");
   const HTML_CSS = "HTML/CSS";
   const HTML_PLACEHOLER =
     "<!DOCTYPE html>\n<html>\n<head>\n<style>\nbody {background: linear-gradient(90deg, #ffecd2, #fcb69f);}\nh1   {font-style: italic;}\np    {border: 2px solid powderblue;}\n</style>\n</head>\n<body>\n<h1>This is a heading</h1>\n<p>This is a paragraph.</p>\n</body>\n</html>";
 
-  const iframe = $("#monaco", element)[0];
+  const editorContainer = $("#monaco", element)[0];
   const submitButton = $("#submit-button", element);
   const resetButton = $("#reset-button", element);
   const AIFeeback = $("#ai-feedback", element);
@@ -26,32 +25,17 @@ function CodingAIEvalXBlock(runtime, element, data) {
   const WAIT_TIME_MS = 1000;
 
   $(function () {
-    // The newer runtime uses the 'data-usage' attribute, while the LMS uses 'data-usage-id'
-    // A Jquery object can sometimes be returned e.g. after a studio field edit, we handle it with ?.[0]
-    const xblockUsageId =
-      element.getAttribute?.("data-usage") ||
-      element.getAttribute?.("data-usage-id") ||
-      element?.[0].getAttribute("data-usage-id");
-
-    if (!xblockUsageId) {
-      throw new Error(
-        "XBlock is missing a usage ID attribute on its root HTML node.",
-      );
-    }
-
-    // __USAGE_ID_PLACEHOLDER__ is the event data sent from the monaco iframe after loading
-    // we rely on the usage_id to limit the event to the Xblock scope
-    iframe.srcdoc = data.monaco_html.replace(
-      "__USAGE_ID_PLACEHOLDER__",
-      xblockUsageId,
-    );
-    runFuncAfterLoading(init);
+    let editor = null;
+    // Trace of the current submission, from the code submission to the AI feedback, and its span
+    let traceId = null;
+    let spanId = null;
+    init();
     function submitCode() {
-      const code = iframe.contentWindow.editor.getValue();
+      const code = editor.getValue();
       return $.ajax({
         url: runCodeHandlerURL,
         method: "POST",
-        data: JSON.stringify({ user_code: code }),
+        data: JSON.stringify({ user_code: code, trace_id: traceId, parent_span_id: spanId }),
       });
     }
     function delay(ms, data) {
@@ -69,7 +53,7 @@ function CodingAIEvalXBlock(runtime, element, data) {
         return $.ajax({
           url: submissionResultURL,
           method: "POST",
-          data: JSON.stringify({ submission_id: data.submission_id }),
+          data: JSON.stringify({ submission_id: data.submission_id, trace_id: traceId, parent_span_id: spanId }),
         })
           .then(function (result) {
             console.log("result", result, retries)
@@ -108,13 +92,15 @@ function CodingAIEvalXBlock(runtime, element, data) {
         url: llmResponseHandlerURL,
         method: "POST",
         data: JSON.stringify({
-          code: iframe.contentWindow.editor.getValue(),
+          code: editor.getValue(),
           stdout: data.stdout,
           stderr: data.stderr,
+          trace_id: traceId,
+          parent_span_id: spanId,
         }),
         success: function (data) {
           console.log(data);
-          AIFeeback.html(MarkdownToHTML(data.response));
+          AIFeeback.html(data.response_html);
           $("#ai-feedback-tab", element).click();
         },
       });
@@ -126,7 +112,7 @@ function CodingAIEvalXBlock(runtime, element, data) {
         method: "POST",
         data: JSON.stringify({}),
         success: function (data) {
-          iframe.contentWindow.editor.setValue("");
+          editor.setValue("");
           AIFeeback.html("");
           if (data.language !== HTML_CSS) {
             stdout.text("");
@@ -142,11 +128,13 @@ function CodingAIEvalXBlock(runtime, element, data) {
     });
 
     submitButton.click(() => {
-      const code = iframe.contentWindow.editor.getValue();
+      const code = editor.getValue();
       if (!code?.length) {
         return;
       }
       disableSubmitButton();
+      traceId = newTraceId();
+      spanId = newSpanId();
       var deferred = null;
       if (data.language === HTML_CSS) {
         // no need to submit HTML code, we directly get LLM feedback
@@ -172,38 +160,35 @@ function CodingAIEvalXBlock(runtime, element, data) {
     });
 
     function init() {
-      $("#question-text", element).html(MarkdownToHTML(data.question));
-      // Triggered when the Monaco editor loads.
-      // Since a Unit can have multiple instances of this Xblock,
-      // we use the XblockUsageId to differentiate between them.
-      window.addEventListener("message", function (event) {
-        if (event.data === xblockUsageId) {
-          if (data.code?.length) {
-            iframe.contentWindow.editor.setValue(data.code);
-          }
+      $("#question-text", element).html(data.question_html);
+      AIFeeback.html(data.ai_evaluation_html || "");
 
-          AIFeeback.html(MarkdownToHTML(data.ai_evaluation || ""));
-          if (data.language === HTML_CSS) {
-            // render HTML/CSS into iframe
-            if (data.code?.length) {
-              renderUserHTML(data.code);
-            } else {
-              iframe.contentWindow.editor.setValue(HTML_PLACEHOLER);
-              renderUserHTML(HTML_PLACEHOLER);
-            }
-            addMonacoHTMLRenderEventListener();
-          } else {
-            // load existing results for executable languages
-            stdout.text(data.code_exec_result?.stdout || "");
-            stderr.text(data.code_exec_result?.stderr || "");
-          }
-        }
-      });
-    }
-    function addMonacoHTMLRenderEventListener() {
-      iframe.contentWindow.editor.onDidChangeModelContent((event) => {
-        renderUserHTML(iframe.contentWindow.editor.getValue());
+      let code = data.code || "";
+      if (data.language === HTML_CSS && !code.length) {
+        code = HTML_PLACEHOLER;
+      }
+      editor = createLazyEditor(editorContainer, data.monaco, {
+        value: code,
+        language: data.monaco.language,
+        editorOptions: {
+          automaticLayout: true,
+          minimap: { enabled: false },
+          lineNumbersMinChars: 2,
+          folding: false,
+        },
       });
+
+      if (data.language === HTML_CSS) {
+        // render HTML/CSS into iframe
+        renderUserHTML(code);
+        editor.onDidChangeModelContent((event) => {
+          renderUserHTML(editor.getValue());
+        });
+      } else {
+        // load existing results for executable languages
+        stdout.text(data.code_exec_result?.stdout || "");
+        stderr.text(data.code_exec_result?.stderr || "");
+      }
     }
     function renderUserHTML(userHTML) {
       htmlRenderIframe.attr("srcdoc", stripScriptTags(userHTML));
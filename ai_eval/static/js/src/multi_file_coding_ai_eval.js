@@ -5,8 +5,10 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
   const createFileHandlerURL = runtime.handlerUrl(element, "create_file");
   const deleteFileHandlerURL = runtime.handlerUrl(element, "delete_file");
   const renameFileHandlerURL = runtime.handlerUrl(element, "rename_file");
-  const saveFileHandlerURL = runtime.handlerUrl(element, "save_file");
+  const batchFileOpsHandlerURL = runtime.handlerUrl(element, "batch_file_ops");
   const getProjectStructureHandlerURL = runtime.handlerUrl(element, "get_project_structure");
+  const getFileHandlerURL = runtime.handlerUrl(element, "get_file");
+  const getFileTemplatesHandlerURL = runtime.handlerUrl(element, "get_file_templates");
   const initializeProjectHandlerURL = runtime.handlerUrl(element, "initialize_project");
   const submitProjectHandlerURL = runtime.handlerUrl(element, "submit_project");
   const runTestsHandlerURL = runtime.handlerUrl(element, "run_test_cases");
@@ -20,13 +22,14 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
   const WAIT_TIME_MS = 1000;
 
   // DOM elements
-  const iframe = $("#monaco", element)[0];
+  const editorContainer = $("#monaco", element)[0];
   const fileExplorer = $("#file-explorer", element);
   const fileTree = $("#file-tree", element);
   const editorTabs = $("#editor-tabs", element);
   const submitButton = $("#submit-button", element);
   const resetButton = $("#reset-button", element);
   const runTestsButton = $("#run-tests-btn", element);
+  const submitTestsButton = $("#submit-tests-btn", element);
   const newFileButton = $("#new-file-btn", element);
   const initializeProjectButton = $("#initialize-project-btn", element);
   const AIFeedback = $("#ai-feedback", element);
@@ -41,8 +44,9 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
   const testFailedElement = $("#test-failed", element);
 
   // State management
+  // Files only carry their metadata until opened; `content` is fetched lazily.
   let currentProject = {
-    files: data.project_files || {},
+    files: data.project_manifest || {},
     structure: data.project_structure || {},
     currentFile: null,
     enableMultiFile: data.enable_multi_file || false
@@ -51,31 +55,26 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
   let testResults = [];
   let isSubmitting = false;
 
-  // Initialize
-  $(function () {
-    const xblockUsageId =
-      element.getAttribute?.("data-usage") ||
-      element.getAttribute?.("data-usage-id") ||
-      element?.[0].getAttribute("data-usage-id");
+  // Unsaved contents by filename, saved together in a single request.
+  // Only one save request is in flight at a time, so each one is based on the
+  // versions returned by the previous one.
+  let pendingSaves = {};
+  let autoSaveTimer = null;
+  let saveRequest = null;
 
-    if (!xblockUsageId) {
-      throw new Error("XBlock is missing a usage ID attribute on its root HTML node.");
-    }
+  let editor = null;
 
-    // Load marked for question rendering
-    loadMarkedInIframe(data.marked_html);
-    
-    // Initialize Monaco Editor
-    iframe.srcdoc = data.monaco_html.replace(
-      "__USAGE_ID_PLACEHOLDER__",
-      xblockUsageId,
-    );
-    
-    runFuncAfterLoading(init);
+  // Initialize
+  $(function () {
+    init();
   });
 
   // Initialize the interface
   function init() {
+    $("#question-text", element).html(data.question_html);
+
+    setupEditor();
+
     if (currentProject.enableMultiFile) {
       initializeMultiFileInterface();
     } else {
@@ -97,8 +96,8 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     // Initialize editor tabs
     renderEditorTabs();
     
-    // Set up Monaco editor communication
-    setupMonacoCommunication();
+    // Set up file tree and editor tab interactions
+    setupFileInteractions();
   }
 
   function initializeSingleFileInterface() {
@@ -111,7 +110,8 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     // Button event listeners
     submitButton.on("click", submitCode);
     resetButton.on("click", resetProject);
-    runTestsButton.on("click", runTestCases);
+    runTestsButton.on("click", () => runTestCases(false));
+    submitTestsButton.on("click", () => runTestCases(true));
     newFileButton.on("click", showCreateFileModal);
     initializeProjectButton.on("click", showInitializeProjectModal);
 
@@ -226,29 +226,38 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     `);
   }
 
-  // Monaco Editor Communication
+  // Monaco Editor
+
+  function setupEditor() {
+    // The editor shows one file at a time, it is created when the block is scrolled into view
+    editor = createLazyEditor(editorContainer, data.monaco, {
+      value: "",
+      language: data.monaco.language,
+      editorOptions: {
+        theme: 'vs-dark',
+        automaticLayout: true,
+        minimap: { enabled: true },
+        scrollBeyondLastLine: false,
+        fontSize: 14,
+        wordWrap: 'on'
+      }
+    });
 
-  function setupMonacoCommunication() {
-    // Listen for messages from Monaco editor
-    window.addEventListener('message', function(event) {
-      const message = event.data;
-      
-      switch (message.type) {
-        case 'editorReady':
-          loadProjectFilesToEditor();
-          break;
-        case 'contentChanged':
-          handleContentChange(message.file, message.content);
-          break;
-        case 'fileSwitched':
-          handleFileSwitch(message.filename);
-          break;
-        case 'fileSaved':
-          handleFileSave(message.filename, message.content);
-          break;
+    editor.onDidChangeModelContent(function(event) {
+      // Loading the content of a file flushes the model, it is not an edit
+      if (!event.isFlush && currentProject.currentFile) {
+        handleContentChange(currentProject.currentFile, editor.getValue());
       }
     });
 
+    editor.onReady(function(monacoEditor, monaco) {
+      monacoEditor.addCommand(monaco.KeyMod.CtrlCmd | monaco.KeyCode.KeyS, function() {
+        savePendingFiles();
+      });
+    });
+  }
+
+  function setupFileInteractions() {
     // Set up file tree interactions
     fileTree.on('click', '.file-item', function() {
       const filename = $(this).data('filename');
@@ -280,12 +289,38 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     });
   }
 
-  function loadProjectFilesToEditor() {
-    // Send all project files to Monaco editor
-    iframe.contentWindow.postMessage({
-      type: 'updateProject',
-      files: currentProject.files
-    }, '*');
+  function openDefaultFile() {
+    // Open the main file, or the first one, to show something in the editor
+    const filenames = Object.keys(currentProject.files);
+    const mainFile = filenames.find(name => /^(main\.(py|cpp)|Main\.java|index\.(js|html))$/.test(name));
+    if (!currentProject.currentFile && filenames.length > 0) {
+      switchToFile(mainFile || filenames[0]);
+    }
+  }
+
+  function loadFileContent(filename) {
+    // Fetch the content of a file the first time it is opened.
+    // The content hash is part of the URL, so the browser cache can answer repeated requests.
+    const fileData = currentProject.files[filename];
+    if (fileData.content !== undefined) {
+      return $.Deferred().resolve(fileData.content).promise();
+    }
+    return $.ajax({
+      url: getFileHandlerURL,
+      method: "GET",
+      data: { filename: filename, hash: fileData.hash },
+      dataType: "json",
+    })
+    .then(function(response) {
+      fileData.content = response.content;
+      fileData.hash = response.hash;
+      // The version is not part of the cached response, it comes from the manifest
+      return response.content;
+    });
+  }
+
+  function loadAllFileContents() {
+    return $.when(...Object.keys(currentProject.files).map(loadFileContent));
   }
 
   function switchToFile(filename) {
@@ -303,21 +338,29 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     editorTabs.find('.editor-tab').removeClass('active');
     editorTabs.find(`[data-filename="${filename}"]`).addClass('active');
 
-    // Switch file in Monaco editor
-    iframe.contentWindow.postMessage({
-      type: 'switchFile',
-      filename: filename
-    }, '*');
+    // Show the file in the editor, once its content is available
+    loadFileContent(filename)
+      .done(function(content) {
+        if (currentProject.currentFile !== filename) {
+          // Another file was opened in the meantime
+          return;
+        }
+        editor.setLanguage(getLanguageForFileType(currentProject.files[filename].type));
+        editor.setValue(content);
+        handleFileSwitch(filename);
+      })
+      .fail(function(error) {
+        console.error('Error loading file:', error);
+      });
   }
 
   function handleContentChange(filename, content) {
     if (currentProject.files[filename]) {
       currentProject.files[filename].content = content;
       // Auto-save after a delay
-      clearTimeout(window.autoSaveTimer);
-      window.autoSaveTimer = setTimeout(() => {
-        saveFile(filename, content);
-      }, 2000);
+      pendingSaves[filename] = content;
+      clearTimeout(autoSaveTimer);
+      scheduleAutoSave();
     }
   }
 
@@ -326,11 +369,6 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     updateUIForFileSwitch(filename);
   }
 
-  function handleFileSave(filename, content) {
-    currentProject.files[filename].content = content;
-    updateProjectStructure();
-  }
-
   // File Operations
 
   function showCreateFileModal() {
@@ -369,8 +407,10 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
         currentProject.files[filename] = {
           content: content,
           type: fileType,
-          created_at: new Date().toISOString(),
-          modified_at: new Date().toISOString(),
+          hash: response.hash,
+          size: response.size,
+          version: response.version,
+          modified_at: response.modified_at,
           language: data.language
         };
 
@@ -381,14 +421,6 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
         // Switch to new file
         switchToFile(filename);
 
-        // Send to Monaco editor
-        iframe.contentWindow.postMessage({
-          type: 'createFile',
-          filename: filename,
-          content: content,
-          language: getLanguageForFileType(fileType)
-        }, '*');
-
         $("#file-modal", element).hide();
       }
     })
@@ -425,14 +457,9 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
             switchToFile(remainingFiles[0]);
           } else {
             currentProject.currentFile = null;
+            editor.setValue("");
           }
         }
-
-        // Notify Monaco editor
-        iframe.contentWindow.postMessage({
-          type: 'deleteFile',
-          filename: filename
-        }, '*');
       }
     })
     .fail(function(error) {
@@ -441,48 +468,131 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     });
   }
 
-  function saveFile(filename, content) {
-    $.ajax({
-      url: saveFileHandlerURL,
+  function batchFileOps(operations) {
+    // Apply several file operations in one request, all of them or none
+    return $.ajax({
+      url: batchFileOpsHandlerURL,
       method: "POST",
-      data: JSON.stringify({
-        filename: filename,
-        content: content
-      }),
+      data: JSON.stringify({ operations: operations }),
       contentType: "application/json",
-    })
+    });
+  }
+
+  function scheduleAutoSave() {
+    autoSaveTimer = setTimeout(() => {
+      autoSaveTimer = null;
+      savePendingFiles();
+    }, 2000);
+  }
+
+  function savePendingFiles() {
+    // Save the pending contents now, resolved once they are saved and rejected when they are not
+    clearTimeout(autoSaveTimer);
+    autoSaveTimer = null;
+    if (saveRequest) {
+      // The contents edited since the request in flight are saved after it
+      return saveRequest.then(savePendingFiles, savePendingFiles);
+    }
+    const operations = Object.keys(pendingSaves)
+      .filter(filename => currentProject.files[filename])
+      .map(filename => ({
+        op: "save",
+        filename: filename,
+        content: pendingSaves[filename],
+        base_version: currentProject.files[filename].version
+      }));
+    pendingSaves = {};
+    if (!operations.length) {
+      return $.when();
+    }
+
+    saveRequest = batchFileOps(operations)
     .done(function(response) {
       if (response.success) {
-        currentProject.files[filename].content = content;
-        currentProject.files[filename].modified_at = new Date().toISOString();
+        response.results.forEach(result => {
+          const fileData = currentProject.files[result.filename];
+          if (fileData) {
+            fileData.hash = result.hash;
+            fileData.size = result.size;
+            fileData.version = result.version;
+            fileData.modified_at = result.modified_at;
+          }
+        });
         updateProjectStructure();
       }
     })
     .fail(function(error) {
-      console.error('Error saving file:', error);
+      // Nothing was saved, keep the contents for the next attempt unless newer ones are pending
+      operations.forEach(operation => {
+        if (!(operation.filename in pendingSaves)) {
+          pendingSaves[operation.filename] = operation.content;
+        }
+      });
+      if (error.status === 409) {
+        handleSaveConflict(error.responseJSON);
+      } else {
+        console.error('Error saving files:', error);
+      }
+    })
+    .always(function() {
+      saveRequest = null;
+      if (Object.keys(pendingSaves).length && !autoSaveTimer) {
+        scheduleAutoSave();
+      }
     });
+    return saveRequest;
+  }
+
+  function handleSaveConflict(conflict) {
+    // The file was saved from another window or tab since it was loaded here
+    const fileData = currentProject.files[conflict.filename];
+    if (!fileData) {
+      return;
+    }
+    if (confirm(`"${conflict.filename}" was modified in another window. Overwrite it with your changes?`)) {
+      fileData.version = conflict.current_version;
+    } else {
+      // Drop the local changes and load the saved content
+      delete pendingSaves[conflict.filename];
+      delete fileData.content;
+      fileData.hash = conflict.hash;
+      fileData.version = conflict.current_version;
+      if (currentProject.currentFile === conflict.filename) {
+        switchToFile(conflict.filename);
+      }
+    }
   }
 
   function showInitializeProjectModal() {
     const modal = $("#project-modal", element);
     const preview = $("#template-preview", element);
     
-    // Show template preview
-    const templates = data.file_templates[data.language] || {};
+    // Show template preview, templates are only fetched when needed
     preview.empty();
-    
-    Object.keys(templates).forEach(filename => {
-      const template = templates[filename];
-      const previewItem = $(`
-        <div class="template-file">
-          <div class="template-file-name">${filename}</div>
-          <div class="template-file-content">${template.content.substring(0, 100)}${template.content.length > 100 ? '...' : ''}</div>
-        </div>
-      `);
-      preview.append(previewItem);
-    });
-
     modal.show();
+
+    $.ajax({
+      url: getFileTemplatesHandlerURL,
+      method: "POST",
+      data: JSON.stringify({}),
+      contentType: "application/json",
+    })
+    .done(function(response) {
+      const templates = response.templates || {};
+      Object.keys(templates).forEach(filename => {
+        const template = templates[filename];
+        const previewItem = $(`
+          <div class="template-file">
+            <div class="template-file-name">${filename}</div>
+            <div class="template-file-content">${template.content.substring(0, 100)}${template.content.length > 100 ? '...' : ''}</div>
+          </div>
+        `);
+        preview.append(previewItem);
+      });
+    })
+    .fail(function(error) {
+      console.error('Error loading file templates:', error);
+    });
   }
 
   function initializeProject() {
@@ -513,18 +623,32 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
       contentType: "application/json",
     })
     .done(function(response) {
-      currentProject.files = response.project_files || {};
+      // Keep the contents already loaded for files that did not change
+      const files = response.project_manifest || {};
+      Object.keys(files).forEach(filename => {
+        const previous = currentProject.files[filename];
+        if (previous && previous.hash === files[filename].hash) {
+          files[filename].content = previous.content;
+        }
+      });
+      if (!files[currentProject.currentFile]) {
+        currentProject.currentFile = null;
+      }
+      currentProject.files = files;
       currentProject.structure = response.project_structure || {};
       currentProject.enableMultiFile = response.enable_multi_file || false;
 
+      // Load previous results
+      AIFeedback.html(response.ai_evaluation_html || "");
+      stdout.text(response.code_exec_result?.stdout || "");
+      stderr.text(response.code_exec_result?.stderr || "");
+
       // Update UI
       renderFileTree();
       renderEditorTabs();
 
-      // Load files into Monaco editor
-      if (iframe.contentWindow) {
-        loadProjectFilesToEditor();
-      }
+      // Show a file in the editor
+      openDefaultFile();
     })
     .fail(function(error) {
       console.error('Error loading project data:', error);
@@ -554,17 +678,19 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     }
   }
 
-  function submitMultiFileProject() {
-    // Get all file contents
-    const filesContent = {};
-    Object.keys(currentProject.files).forEach(filename => {
-      filesContent[filename] = currentProject.files[filename].content;
-    });
-
+  async function submitMultiFileProject() {
+    // The saved project files are read on the server, save the latest edits first
+    try {
+      await savePendingFiles();
+    } catch (error) {
+      enableSubmitButton();
+      isSubmitting = false;
+      return;
+    }
     $.ajax({
       url: submitProjectHandlerURL,
       method: "POST",
-      data: JSON.stringify({ files: filesContent }),
+      data: JSON.stringify({}),
       contentType: "application/json",
     })
     .done(function(response) {
@@ -580,7 +706,7 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
   }
 
   function submitSingleFile() {
-    const code = iframe.contentWindow.editor.getValue();
+    const code = editor.getValue();
     
     $.ajax({
       url: submitProjectHandlerURL,
@@ -654,11 +780,22 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
   }
 
   function getLLMFeedback(result) {
-    const code = currentProject.enableMultiFile ? 
-      Object.values(currentProject.files).map(f => f.content).join('\n\n') :
-      iframe.contentWindow.editor.getValue();
+    if (currentProject.enableMultiFile) {
+      // All file contents are needed for the evaluation
+      loadAllFileContents()
+        .done(function() {
+          requestLLMFeedback(result, Object.values(currentProject.files).map(f => f.content).join('\n\n'));
+        })
+        .fail(function(error) {
+          console.error("Error loading project files:", error);
+        });
+    } else {
+      requestLLMFeedback(result, editor.getValue());
+    }
+  }
 
-    const answer = `
+  function requestLLMFeedback(result, code) {
+    let answer = `
     student code :
 
     ${code}
@@ -710,7 +847,7 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     })
     .done(function(response) {
       if (response.response) {
-        AIFeedback.html(response.response);
+        AIFeedback.html(response.response_html);
         switchTab("ai-feedback");
       }
     })
@@ -719,15 +856,25 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     });
   }
 
-  function runTestCases() {
+  async function runTestCases(full) {
     if (isSubmitting) return;
     isSubmitting = true;
     runTestsButton.prop('disabled', true);
+    submitTestsButton.prop('disabled', true);
 
+    // The tests run on the saved project files, save the latest edits first
+    try {
+      await savePendingFiles();
+    } catch (error) {
+      isSubmitting = false;
+      runTestsButton.prop('disabled', false);
+      submitTestsButton.prop('disabled', false);
+      return;
+    }
     $.ajax({
       url: runTestsHandlerURL,
       method: "POST",
-      data: JSON.stringify({}),
+      data: JSON.stringify(full ? {full: true} : {}),
       contentType: "application/json",
     })
     .done(function(response) {
@@ -739,10 +886,14 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
     })
     .fail(function(error) {
       console.error('Error running test cases:', error);
+      if (error.status === 429) {
+        alert(error.responseJSON?.error || 'The full test suite was run too recently.');
+      }
     })
     .always(function() {
       isSubmitting = false;
       runTestsButton.prop('disabled', false);
+      submitTestsButton.prop('disabled', false);
     });
   }
 
@@ -776,6 +927,17 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
   function createTestResultItem(result, index) {
     const statusClass = result.passed ? 'passed' : 'failed';
     const statusText = result.passed ? 'PASSED' : 'FAILED';
+
+    if (result.hidden) {
+      return $(`
+        <div class="test-result-item ${statusClass}">
+          <div class="test-result-header">
+            <span class="test-result-name">Hidden Test ${result.test_number || index + 1}</span>
+            <span class="test-result-status ${statusClass}">${statusText}</span>
+          </div>
+        </div>
+      `);
+    }
     
     return $(`
       <div class="test-result-item ${statusClass}">
@@ -786,7 +948,8 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
         <div class="test-result-details">
           <div><strong>Input:</strong> ${result.test_case.input || 'None'}</div>
           <div><strong>Expected:</strong> ${result.test_case.expected_output}</div>
-          <div><strong>Actual:</strong> ${result.actual_output}</div>
+          ${result.actual_output !== undefined ? `<div><strong>Actual:</strong> ${result.actual_output}</div>` : ''}
+          ${result.mismatch ? `<div><strong>Difference:</strong> ${result.mismatch}</div>` : ''}
           ${result.execution_time ? `<div><strong>Time:</strong> ${result.execution_time}s</div>` : ''}
           ${result.memory_used ? `<div><strong>Memory:</strong> ${result.memory_used}KB</div>` : ''}
         </div>
@@ -878,13 +1041,4 @@ function MultiFileCodingAIEvalXBlock(runtime, element, data) {
       iframe.srcdoc = userHTML;
     }
   }
-
-  // Helper function to run after iframe loads
-  function runFuncAfterLoading(func) {
-    if (iframe.contentDocument && iframe.contentDocument.readyState === 'complete') {
-      func();
-    } else {
-      iframe.onload = func;
-    }
-  }
 } 
\ No newline at end of file
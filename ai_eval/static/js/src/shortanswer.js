@@ -3,8 +3,6 @@ function ShortAnswerAIEvalXBlock(runtime, element, data) {
   const handlerUrl = runtime.handlerUrl(element, "get_response");
   const resetHandlerURL = runtime.handlerUrl(element, "reset");
 
-  loadMarkedInIframe(data.marked_html);
-
   $(function () {
     const spinner = $(".message-spinner", element);
     const spinnnerContainer = $("#chat-spinner-container", element);
@@ -12,23 +10,24 @@ function ShortAnswerAIEvalXBlock(runtime, element, data) {
     const submitButton = $("#submit-button", element);
     const userInput = $(".user-input", element);
     const userInputElem = userInput[0];
-    let initDone = false;
 
-    runFuncAfterLoading(init);
+    init();
 
     function getResponse() {
       if (!userInput.val().length) return;
 
       disableInput();
       spinner.show();
-      insertUserMessage(userInput.val());
+      // shown as plain text until the server sends back its rendered version
+      insertUserMessage($("<div>").text(userInput.val()).html());
       $.ajax({
         url: handlerUrl,
         method: "POST",
         data: JSON.stringify({ user_input: userInput.val() }),
         success: function (response) {
           spinner.hide();
-          insertAIMessage(response.response);
+          $(".user-answer", element).last().html(response.user_input_html);
+          insertAIMessage(response.response_html);
           userInput.val("");
           if ($(".user-answer", element).length >= data.max_responses) {
             disableInput();
@@ -89,35 +88,33 @@ function ShortAnswerAIEvalXBlock(runtime, element, data) {
     });
 
     function init() {
-      if (initDone) return;
-      initDone = true;
-      $("#question-text", element).html(MarkdownToHTML(data.question));
-      for (let i = 0; i < data.messages.USER.length; i++) {
-        insertUserMessage(data.messages.USER[i]);
-        insertAIMessage(data.messages.LLM[i]);
+      $("#question-text", element).html(data.question_html);
+      for (let i = 0; i < data.messages_html.USER.length; i++) {
+        insertUserMessage(data.messages_html.USER[i]);
+        insertAIMessage(data.messages_html.LLM[i]);
         resetButton.removeClass("disabled-btn");
       }
       if (
-        data.messages.USER.length &&
-        data.messages.USER.length >= data.max_responses
+        data.messages_html.USER.length &&
+        data.messages_html.USER.length >= data.max_responses
       ) {
         disableInput();
       }
     }
 
-    function insertUserMessage(msg) {
-      if (msg?.length) {
+    function insertUserMessage(html) {
+      if (html?.length) {
         $(` <div class="chat-message-container">
-                <div class="chat-message user-answer">${MarkdownToHTML(msg)}</div>
+                <div class="chat-message user-answer">${html}</div>
       </div>`).insertBefore(spinnnerContainer);
         resetButton.removeClass("disabled-btn");
       }
     }
 
-    function insertAIMessage(msg) {
-      if (msg?.length) {
+    function insertAIMessage(html) {
+      if (html?.length) {
         $(` <div class="chat-message-container">
-                <div class="chat-message ai-eval">${MarkdownToHTML(msg)}</div>
+                <div class="chat-message ai-eval">${html}</div>
       </div>`).insertBefore(spinnnerContainer);
         resetButton.removeClass("disabled-btn");
       }
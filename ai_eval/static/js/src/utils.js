@@ -1,33 +1,3 @@
-// we load Marked in a Iframe to avoid RequireJS conflicts with the Xblock runtime
-function loadMarkedInIframe(html) {
-  if (!window.marked && !document.getElementById("marked-iframe")) {
-    const iframe = document.createElement("iframe");
-    iframe.style.display = "none";
-    iframe.setAttribute("id", "marked-iframe");
-    iframe.srcdoc = html;
-    document.body.appendChild(iframe);
-  }
-}
-function MarkdownToHTML(text) {
-  window.marked =
-    window.marked ??
-    document.getElementById("marked-iframe").contentWindow.marked;
-  if (typeof marked !== "undefined") text = marked.parse(text);
-  return text;
-}
-
-function runFuncAfterLoading(func) {
-  const markedIframe = document.getElementById("marked-iframe");
-  // loading is finished when Marked is available
-  if (markedIframe.contentWindow.marked) {
-    func();
-  } else {
-    markedIframe.addEventListener("load", (event) => {
-      func();
-    });
-  }
-}
-
 function stripScriptTags(html) {
   const div = document.createElement("div");
   div.innerHTML = html;
@@ -39,3 +9,125 @@ function stripScriptTags(html) {
 
   return div.innerHTML;
 }
+
+function randomHex(size) {
+  const bytes = new Uint8Array(size);
+  crypto.getRandomValues(bytes);
+  return Array.from(bytes, (byte) => byte.toString(16).padStart(2, "0")).join("");
+}
+
+// A random trace id of 32 hexadecimal digits, sent to the handlers of a submission
+// so the server can group their spans in one trace.
+function newTraceId() {
+  return randomHex(16);
+}
+
+// A random span id of 16 hexadecimal digits, the span of a submission in the browser,
+// which the spans of its handlers are children of, or linked to.
+function newSpanId() {
+  return randomHex(8);
+}
+
+// Monaco is imported once per page and shared by all the blocks.
+// It is loaded as an ES module, which does not conflict with the RequireJS of the runtime.
+function loadMonaco(config) {
+  if (!window.aiEvalMonaco) {
+    if (config.worker_urls && !window.MonacoEnvironment) {
+      window.MonacoEnvironment = {
+        getWorker: function (moduleId, label) {
+          // Languages with a language service run it in their own worker
+          const service = {
+            json: "json",
+            css: "css", scss: "css", less: "css",
+            html: "html", handlebars: "html", razor: "html",
+            typescript: "typescript", javascript: "typescript",
+          }[label] || "editor";
+          const workerUrl = new URL(config.worker_urls[service], document.baseURI).href;
+          // wrapped in a blob, as workers can not be created from another origin (e.g. a CDN)
+          const source = new Blob([`import "${workerUrl}";`], { type: "text/javascript" });
+          return new Worker(URL.createObjectURL(source), { type: "module" });
+        },
+      };
+    }
+    const link = document.createElement("link");
+    link.rel = "stylesheet";
+    link.href = config.css_url;
+    document.head.appendChild(link);
+    window.aiEvalMonaco = import(config.js_url);
+  }
+  return window.aiEvalMonaco;
+}
+
+// Show the code in a lightweight read-only view first, and only create the Monaco
+// editor when the container is scrolled into view, or when the view is clicked.
+// The returned object can be used as the editor before it is created; setting the
+// value of the read-only view does not notify the content change listeners.
+function createLazyEditor(container, config, options) {
+  let value = options.value || "";
+  let language = options.language;
+  let monaco = null;
+  let editor = null;
+  let loading = false;
+  let observer = null;
+  const changeListeners = [];
+  const readyListeners = [];
+  const preview = $('<pre class="ai-eval-code-preview"></pre>').text(value);
+  $(container).empty().append(preview);
+
+  function instantiate(focus) {
+    if (loading) return;
+    loading = true;
+    observer?.disconnect();
+    loadMonaco(config).then(function (module) {
+      monaco = module;
+      preview.remove();
+      editor = monaco.editor.create(container, {
+        ...options.editorOptions,
+        value: value,
+        language: language,
+      });
+      changeListeners.forEach((listener) => editor.onDidChangeModelContent(listener));
+      readyListeners.forEach((listener) => listener(editor, monaco));
+      if (focus) editor.focus();
+    });
+  }
+
+  preview.on("click", () => instantiate(true));
+  if ("IntersectionObserver" in window) {
+    observer = new IntersectionObserver(
+      (entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) instantiate(false);
+      },
+      { rootMargin: "200px" },
+    );
+    observer.observe(container);
+  } else {
+    instantiate(false);
+  }
+
+  return {
+    getValue: function () {
+      return editor ? editor.getValue() : value;
+    },
+    setValue: function (newValue) {
+      value = newValue;
+      if (editor) {
+        editor.setValue(newValue);
+      } else {
+        preview.text(newValue);
+      }
+    },
+    setLanguage: function (newLanguage) {
+      language = newLanguage;
+      if (editor) monaco.editor.setModelLanguage(editor.getModel(), newLanguage);
+    },
+    onDidChangeModelContent: function (listener) {
+      changeListeners.push(listener);
+      if (editor) editor.onDidChangeModelContent(listener);
+    },
+    onReady: function (listener) {
+      readyListeners.push(listener);
+      if (editor) listener(editor, monaco);
+    },
+  };
+}
@@ -3,16 +3,24 @@ Testing module.
 """
 # pylint: disable=redefined-outer-name,protected-access
 
+import json
 from unittest.mock import Mock, patch
 
 import pytest
+from django.core.cache import cache
+from webob import Request
 from xblock.exceptions import JsonHandlerError
 from xblock.field_data import DictFieldData
+from xblock.fields import Field
 from xblock.test.toy_runtime import ToyRuntime
+from xblock.validation import Validation, ValidationMessage
 
-from ai_eval import CodingAIEvalXBlock, ShortAnswerAIEvalXBlock
+from ai_eval import CodingAIEvalXBlock, MultiFileCodingAIEvalXBlock, ShortAnswerAIEvalXBlock
+from ai_eval.attachments import make_attachment_prompt
 from ai_eval.base import AIEvalXBlock
 from ai_eval.llm import SupportedModels
+from ai_eval.similarity import get_clustering_executor
+from ai_eval.utils import get_content_hash, render_markdown
 
 
 @pytest.fixture
@@ -24,16 +32,6 @@ def coding_block_data():
         "code": "",
         "ai_evaluation": "",
         "code_exec_result": {},
-        "marked_html": '<!doctype html>\n<html lang="en">\n<head></head>\n<body>\n    <script '
-        'type="text/javascript" src="https://cdnjs.cloudflare.com/ajax/libs/marked/13.0.2/marked'
-        '.min.js"></script>\n</body>\n</html>',
-        "monaco_html": '<!doctype html>\n<html lang="en">\n<head>\n  <meta charset="UTF-8" />\n'
-        '  <title>Monaco Editor</title>\n</head>\n<body style="margin: 0;">\n  <div class="monaco"'
-        ' style="width: 100vw; height: 100vh;"></div>\n  <script type="module">\n    import * as'
-        ' monaco from "https://cdn.jsdelivr.net/npm/monaco-editor@0.49.0/+esm";\n\n    window.editor '
-        '= monaco.editor.create(document.querySelector(".monaco"), {\n      language: "python",\n    '
-        "  minimap: { enabled: false },\n      lineNumbersMinChars: 2,\n      folding: false,\n    });\n\n"
-        "    window.parent.postMessage('__USAGE_ID_PLACEHOLDER__', '*');\n  </script>\n</body>\n</html>\n",
     }
 
 
@@ -44,16 +42,29 @@ def shortanswer_block_data():
         "question": "ca va?",
         "messages": {"USER": [], "LLM": []},
         "max_responses": 3,
-        "marked_html": (
-            '<!doctype html>\n<html lang="en">\n<head></head>\n<body>\n'
-            '    <script type="text/javascript" '
-            'src="https://cdnjs.cloudflare.com'
-            '/ajax/libs/marked/13.0.2/marked.min.js"></script>\n'
-            "</body>\n</html>"
-        ),
     }
 
 
+@pytest.fixture
+def multi_file_block():
+    """Fixture for a MultiFileCodingAIEvalXBlock with a small project."""
+    block = MultiFileCodingAIEvalXBlock(
+        ToyRuntime(),
+        DictFieldData(
+            {
+                "language": "Python",
+                "question": "ca va?",
+                "judge0_api_key": "judge0-key",
+                "file_templates": {"Python": {"main.py": {"content": "print('hi')", "type": "python"}}},
+            }
+        ),
+        None,
+    )
+    block.create_file.__wrapped__(block, data={"filename": "main.py", "content": "print(1)", "file_type": "python"})
+    block.create_file.__wrapped__(block, data={"filename": "utils.py", "content": "x = 1", "file_type": "python"})
+    return block
+
+
 @pytest.fixture
 def ai_eval_block():
     """Fixture for basic AIEvalXBlock."""
@@ -74,19 +85,85 @@ def ai_eval_block():
 def test_coding_block_student_view(coding_block_data):
     """Test the basic view loads for CodingAIEvalXBlock."""
     block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), None)
-    frag = block.student_view()
-    assert coding_block_data == frag.json_init_args
+    expected = {
+        **coding_block_data,
+        "question_html": "<p>ca va?</p>",
+        "ai_evaluation_html": "",
+        "monaco": {
+            "js_url": "https://cdn.jsdelivr.net/npm/monaco-editor@0.49.0/+esm",
+            "css_url": "https://cdn.jsdelivr.net/npm/monaco-editor@0.49.0/min/vs/editor/editor.main.css",
+            "worker_urls": None,
+            "language": "python",
+        },
+    }
+    del expected["question"], expected["ai_evaluation"]
+    with patch("ai_eval.coding_ai_eval.is_monaco_vendored", return_value=False):
+        frag = block.student_view()
+    assert frag.json_init_args == expected
     assert '<div class="eval-ai-container">' in frag.content
 
 
+def test_coding_block_vendored_monaco(coding_block_data):
+    """Test the vendored Monaco editor is loaded from the package when available."""
+    runtime = ToyRuntime()
+    runtime.local_resource_url = Mock(side_effect=lambda block, path: f"/resource/{path}")
+    block = CodingAIEvalXBlock(runtime, DictFieldData(coding_block_data), None)
+    with patch("ai_eval.coding_ai_eval.is_monaco_vendored", return_value=True):
+        assert block.get_monaco_config() == {
+            "js_url": "/resource/public/vendor/monaco/editor.main.js",
+            "css_url": "/resource/public/vendor/monaco/editor.main.css",
+            "worker_urls": {
+                "editor": "/resource/public/vendor/monaco/editor.worker.js",
+                "json": "/resource/public/vendor/monaco/json.worker.js",
+                "css": "/resource/public/vendor/monaco/css.worker.js",
+                "html": "/resource/public/vendor/monaco/html.worker.js",
+                "typescript": "/resource/public/vendor/monaco/ts.worker.js",
+            },
+            "language": "python",
+        }
+
+
 def test_shortanswer_block_student_view(shortanswer_block_data):
     """Test the basic view loads for ShortAnswerAIEvalXBlock."""
     block = ShortAnswerAIEvalXBlock(ToyRuntime(), DictFieldData(shortanswer_block_data), None)
     frag = block.student_view()
-    assert frag.json_init_args == shortanswer_block_data
+    assert frag.json_init_args == {
+        "question_html": "<p>ca va?</p>",
+        "messages_html": {"USER": [], "LLM": []},
+        "max_responses": 3,
+    }
     assert '<div class="shortanswer_block">' in frag.content
 
 
+def test_render_markdown_sanitizes_html():
+    """Test Markdown is rendered to HTML without unsafe markup."""
+    html = render_markdown("# Title\n\n`code` <script>alert(1)</script> <a href='javascript:x()' onclick='y()'>l</a>")
+    assert "<h1>Title</h1>" in html
+    assert "<code>code</code>" in html
+    assert "<script>" not in html
+    assert "onclick" not in html
+    assert "javascript:" not in html
+
+
+def test_shortanswer_get_response_stores_html(shortanswer_block_data):
+    """Test the rendered messages are stored with the chat messages."""
+    block = ShortAnswerAIEvalXBlock(ToyRuntime(), DictFieldData(shortanswer_block_data), None)
+    block.get_model_api_key = Mock(return_value="key")
+    block.get_model_api_url = Mock(return_value=None)
+    with patch("ai_eval.shortanswer.get_llm_response", return_value="**Good**"):
+        result = block.get_response.__wrapped__(block, data={"user_input": "*fine*"})
+    assert result["response_html"] == "<p><strong>Good</strong></p>"
+    assert result["user_input_html"] == "<p><em>fine</em></p>"
+    assert block.messages_html == {"USER": ["<p><em>fine</em></p>"], "LLM": ["<p><strong>Good</strong></p>"]}
+
+
+def test_shortanswer_legacy_messages_rendered(shortanswer_block_data):
+    """Test messages stored without their HTML are rendered for the view."""
+    data = {**shortanswer_block_data, "messages": {"USER": ["*a*"], "LLM": ["b"]}}
+    block = ShortAnswerAIEvalXBlock(ToyRuntime(), DictFieldData(data), None)
+    assert block.student_view().json_init_args["messages_html"] == {"USER": ["<p><em>a</em></p>"], "LLM": ["<p>b</p>"]}
+
+
 def test_shortanswer_reset_allowed(shortanswer_block_data):
     """Test the reset function when allowed."""
     data = {
@@ -132,15 +209,46 @@ def test_shortanswer_attachments(shortanswer_block_data):
         ],
     }
     block = ShortAnswerAIEvalXBlock(ToyRuntime(), DictFieldData(data), None)
-    block._download_attachment = Mock(return_value="file contents <&>")
-    block.get_llm_response = Mock(return_value=".")
-    block.get_response.__wrapped__(block, data={"user_input": "."})
-    messages = block.get_llm_response.call_args.args[0]
+    block._download_attachment_prompt = Mock(
+        side_effect=lambda url, timeout: make_attachment_prompt(url, "file contents <&>")
+    )
+    block.get_model_api_key = Mock(return_value="key")
+    block.get_model_api_url = Mock(return_value=None)
+    with patch("ai_eval.shortanswer.get_llm_response", return_value=".") as mock_llm:
+        block.get_response.__wrapped__(block, data={"user_input": "."})
+    messages = mock_llm.call_args.args[2]
     prompt = messages[0]["content"]
     assert "<filename>1.txt</filename>" in prompt
     assert "<contents>file contents &lt;&amp;&gt;</contents>" in prompt
 
 
+@patch("ai_eval.attachments.count_tokens", side_effect=lambda model, text: len(text.split()))
+def test_shortanswer_attachments_token_budget(
+    mock_count_tokens, shortanswer_block_data,  # pylint: disable=unused-argument
+):
+    """Test only the attachments relevant to the answer are sent, when over the token budget."""
+    contents = {
+        "http://example.com/1.txt": "all about recursion",
+        "http://example.com/2.txt": "all about loops",
+    }
+    data = {
+        **shortanswer_block_data,
+        "attachment_urls": list(contents),
+        "attachment_token_budget": 10,
+    }
+    block = ShortAnswerAIEvalXBlock(ToyRuntime(), DictFieldData(data), None)
+    block._download_attachment_prompt = Mock(
+        side_effect=lambda url, timeout: make_attachment_prompt(url, contents[url])
+    )
+    block.get_model_api_key = Mock(return_value="key")
+    block.get_model_api_url = Mock(return_value=None)
+    with patch("ai_eval.shortanswer.get_llm_response", return_value=".") as mock_llm:
+        block.get_response.__wrapped__(block, data={"user_input": "a loops answer"})
+    prompt = mock_llm.call_args.args[2][0]["content"]
+    assert "all about loops" in prompt
+    assert "all about recursion" not in prompt
+
+
 @pytest.mark.parametrize(
     "xblock_key, site_config_key, settings_dict, expected_result",
     [
@@ -191,3 +299,477 @@ def test_get_model_api_url_delegates(mock_get_config, ai_eval_block):
     """Test that get_model_api_url delegates to _get_model_config_value."""
     assert ai_eval_block.get_model_api_url() == "test-url"
     mock_get_config.assert_called_once_with("api_url", None)
+
+
+def test_multi_file_student_view_sends_manifest(multi_file_block):
+    """Test the multi-file view only embeds file metadata, not contents."""
+    frag = multi_file_block.student_view()
+    manifest = frag.json_init_args["project_manifest"]
+    assert set(manifest) == {"main.py", "utils.py"}
+    assert manifest["main.py"]["hash"] == get_content_hash("print(1)")
+    assert manifest["main.py"]["size"] == len("print(1)")
+    assert "content" not in manifest["main.py"]
+    for key in ("project_files", "file_templates", "test_cases", "ai_evaluation"):
+        assert key not in frag.json_init_args
+
+
+def test_multi_file_get_file(multi_file_block):
+    """Test fetching a single file with HTTP caching headers."""
+    file_hash = get_content_hash("print(1)")
+
+    response = multi_file_block.get_file(Request.blank("/?filename=main.py"))
+    assert response.status_code == 200
+    assert response.json_body == {"filename": "main.py", "content": "print(1)", "hash": file_hash}
+    assert response.etag == file_hash
+    assert response.cache_control.no_cache
+
+    response = multi_file_block.get_file(Request.blank(f"/?filename=main.py&hash={file_hash}"))
+    assert response.cache_control.max_age > 0
+
+    request = Request.blank("/?filename=main.py", headers={"If-None-Match": f'"{file_hash}"'})
+    assert multi_file_block.get_file(request).status_code == 304
+
+    assert multi_file_block.get_file(Request.blank("/?filename=missing.py")).status_code == 404
+
+
+def test_multi_file_save_file_updates_hash(multi_file_block):
+    """Test saving a file returns its new metadata."""
+    result = multi_file_block.save_file.__wrapped__(
+        multi_file_block, data={"filename": "main.py", "content": "print(2)"}
+    )
+    assert result["hash"] == get_content_hash("print(2)")
+    assert multi_file_block._get_project_manifest()["main.py"]["hash"] == result["hash"]
+
+
+def test_multi_file_batch_file_ops(multi_file_block):
+    """Test several file operations applied in one request."""
+    result = multi_file_block.batch_file_ops.__wrapped__(multi_file_block, data={"operations": [
+        {"op": "create", "filename": "pkg/a.py", "content": "a = 1", "file_type": "python"},
+        {"op": "save", "filename": "pkg/a.py", "content": "a = 2"},
+        {"op": "rename", "old_filename": "utils.py", "new_filename": "pkg/utils.py"},
+        {"op": "save", "filename": "main.py", "content": "import pkg"},
+    ]})
+    assert result["success"]
+    assert len(result["results"]) == 4
+    assert set(multi_file_block.project_files) == {"main.py", "pkg/a.py", "pkg/utils.py"}
+    assert multi_file_block.project_files["pkg/a.py"]["content"] == "a = 2"
+    assert multi_file_block.project_files["main.py"]["content"] == "import pkg"
+    assert multi_file_block.project_structure["total_files"] == 3
+
+
+def test_multi_file_batch_file_ops_is_atomic(multi_file_block):
+    """Test a failing operation leaves the project untouched."""
+    with pytest.raises(JsonHandlerError) as error:
+        multi_file_block.batch_file_ops.__wrapped__(multi_file_block, data={"operations": [
+            {"op": "save", "filename": "main.py", "content": "changed"},
+            {"op": "delete", "filename": "utils.py"},
+            {"op": "delete", "filename": "main.py"},
+        ]})
+    assert error.value.status_code == 403
+    assert "Operation 2" in error.value.message
+    assert set(multi_file_block.project_files) == {"main.py", "utils.py"}
+    assert multi_file_block.project_files["main.py"]["content"] == "print(1)"
+
+    with pytest.raises(JsonHandlerError) as error:
+        multi_file_block.batch_file_ops.__wrapped__(multi_file_block, data={"operations": [{"op": "chmod"}]})
+    assert error.value.status_code == 400
+
+
+def test_multi_file_batch_file_ops_unchanged(multi_file_block):
+    """Test a batch which changes no file does not assign, and so compare, the whole project."""
+    content = multi_file_block.project_files["main.py"]["content"]
+    with patch.object(Field, "__set__", autospec=True, side_effect=Field.__set__) as mock_set:
+        multi_file_block.batch_file_ops.__wrapped__(
+            multi_file_block, data={"operations": [{"op": "save", "filename": "main.py", "content": content}]}
+        )
+        mock_set.assert_not_called()
+        multi_file_block.batch_file_ops.__wrapped__(
+            multi_file_block, data={"operations": [{"op": "save", "filename": "main.py", "content": "pass"}]}
+        )
+        assert [call.args[0].name for call in mock_set.call_args_list] == ["project_files"]
+
+
+def test_multi_file_project_structure_counters(multi_file_block):
+    """Test the project structure is maintained from the changed files only."""
+    structure = multi_file_block.project_structure
+    assert structure["total_files"] == 2
+    assert structure["type_counts"] == {"python": 2}
+    assert structure["language_counts"] == {"Python": 2}
+
+    multi_file_block.create_file.__wrapped__(
+        multi_file_block, data={"filename": "README.txt", "content": "", "file_type": "text"}
+    )
+    multi_file_block.delete_file.__wrapped__(multi_file_block, data={"filename": "utils.py"})
+    structure = multi_file_block.project_structure
+    assert structure["total_files"] == 2
+    assert structure["type_counts"] == {"python": 1, "text": 1}
+    assert sorted(structure["file_types"]) == ["python", "text"]
+
+    # Saving or renaming files does not touch the structure
+    with patch.object(Field, "__set__", autospec=True, side_effect=Field.__set__) as mock_set:
+        multi_file_block.batch_file_ops.__wrapped__(multi_file_block, data={"operations": [
+            {"op": "save", "filename": "main.py", "content": "pass"},
+            {"op": "rename", "old_filename": "README.txt", "new_filename": "NOTES.txt"},
+        ]})
+    assert [call.args[0].name for call in mock_set.call_args_list] == ["project_files"]
+    assert multi_file_block.project_structure == structure
+
+
+def test_multi_file_project_structure_rebuilds_legacy_data(multi_file_block):
+    """Test a structure stored without counters is recomputed from all files."""
+    multi_file_block.project_structure = {"total_files": 2, "languages": ["Python"], "file_types": ["python"]}
+    multi_file_block.rename_file.__wrapped__(
+        multi_file_block, data={"old_filename": "utils.py", "new_filename": "helpers.py"}
+    )
+    assert multi_file_block.project_structure["type_counts"] == {"python": 2}
+
+
+def test_multi_file_save_file_versions(multi_file_block):
+    """Test saves increment the file version and stale saves are rejected."""
+    save = multi_file_block.save_file.__wrapped__
+    assert multi_file_block._get_project_manifest()["main.py"]["version"] == 1
+
+    result = save(multi_file_block, data={"filename": "main.py", "content": "print(2)", "base_version": 1})
+    assert result["version"] == 2
+
+    # Saving the same content again is a no-op
+    result = save(multi_file_block, data={"filename": "main.py", "content": "print(2)", "base_version": 2})
+    assert result["version"] == 2
+
+    with pytest.raises(JsonHandlerError) as error:
+        save(multi_file_block, data={"filename": "main.py", "content": "print(3)", "base_version": 1})
+    assert error.value.status_code == 409
+    assert error.value.get_response().json_body["current_version"] == 2
+    assert multi_file_block.project_files["main.py"]["content"] == "print(2)"
+
+
+def test_multi_file_save_file_conflict_response(multi_file_block):
+    """Test the conflict response of a stale save through the handler."""
+    request = Request.blank(
+        "/", method="POST", body=b'{"filename": "main.py", "content": "x", "base_version": 7}'
+    )
+    response = multi_file_block.save_file(request)
+    assert response.status_code == 409
+    assert response.json_body["filename"] == "main.py"
+    assert response.json_body["current_version"] == 1
+
+
+def test_multi_file_run_test_cases_publishes_grade(multi_file_block):
+    """Test running the tests publishes the sum of the weights of the passed tests."""
+    multi_file_block.test_cases = [
+        {"name": "a", "expected_output": "1", "weight": 2},
+        {"name": "b", "expected_output": "2"},
+        {"name": "c", "expected_output": "3", "weight": 0.5},
+    ]
+    multi_file_block._execute_test_case_enhanced = Mock(
+        side_effect=lambda test_case, number: {"test_number": number, "passed": test_case["name"] != "b"}
+    )
+    multi_file_block.runtime.publish = Mock()
+    result = multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+
+    assert result["score"] == {"earned": 2.5, "possible": 3.5}
+    assert result["summary"]["passed"] == 2
+    multi_file_block.runtime.publish.assert_called_once_with(
+        multi_file_block, "grade", {"value": 2.5, "max_value": 3.5, "only_if_higher": None}
+    )
+    assert multi_file_block.has_submitted_answer()
+    assert multi_file_block.get_score() == (2.5, 3.5)
+
+
+def test_multi_file_rescore_is_incremental(multi_file_block):
+    """Test rescoring only runs the tests again for changed projects and new tests."""
+    multi_file_block.test_cases = [{"name": "a", "expected_output": "1"}, {"name": "b", "expected_output": "2"}]
+    execute = multi_file_block._execute_test_case_enhanced = Mock(
+        side_effect=lambda test_case, number: {"passed": test_case["name"] == "a"}
+    )
+    multi_file_block.runtime.publish = Mock()
+    multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    assert execute.call_count == 2
+
+    # Unchanged project, reweighted tests
+    multi_file_block.test_cases = [{"name": "a", "expected_output": "1", "weight": 3}, multi_file_block.test_cases[1]]
+    assert multi_file_block.calculate_score() == (3, 4)
+    assert execute.call_count == 2
+
+    # A new test only runs that test
+    multi_file_block.test_cases = multi_file_block.test_cases + [{"name": "c", "expected_output": "3"}]
+    assert multi_file_block.calculate_score() == (3, 5)
+    assert execute.call_count == 3
+
+    # A changed project runs all the tests
+    multi_file_block.save_file.__wrapped__(multi_file_block, data={"filename": "main.py", "content": "print(2)"})
+    multi_file_block.calculate_score()
+    assert execute.call_count == 6
+
+
+@pytest.mark.parametrize("test_case, error", [
+    ({"name": "a", "weight": 0.5}, None),
+    ({"name": "a", "weight": -1}, "weight must be a positive number"),
+    ({"name": "a", "weight": "2"}, "weight must be a positive number"),
+    ({"type": "regex", "expected_output": r"^\d+$"}, None),
+    ({"type": "regex", "expected_output": "(a+)+$"}, "same text in many ways"),
+    ({"type": "fuzzy"}, "type must be one of"),
+])
+def test_multi_file_validate_test_cases(multi_file_block, test_case, error):
+    """Test test cases are validated when the block is saved."""
+    multi_file_block.model_api_key = "key"
+    multi_file_block.test_cases = [{"name": "valid"}, test_case]
+    validation = Validation(None)
+    multi_file_block.validate_field_data(validation, multi_file_block)
+    messages = [message.text for message in validation.messages if message.type == "error"]
+    if error:
+        assert len(messages) == 1
+        assert messages[0].startswith("Test case 2 is invalid:")
+        assert error in messages[0]
+    else:
+        assert not messages
+
+
+def test_coding_attempt_history(coding_block_data):
+    """Test attempts are stored as snapshots plus diffs and rebuilt in pages."""
+    block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), None)
+    block.ATTEMPT_SNAPSHOT_INTERVAL = 3
+    codes = ["\n".join(f"line {i}" for i in range(50)) + f"\nprint({n})\n" for n in range(7)]
+    for n, code in enumerate(codes):
+        block._record_attempt(code, f"evaluation {n}", {"stdout": str(n), "stderr": ""})
+
+    assert ["code" in attempt for attempt in block.attempt_history] == [True, False, False, True, False, False, True]
+
+    result = block.get_attempt_history.__wrapped__(block, data={"page": 1, "page_size": 2})
+    assert result["total"] == 7
+    assert result["num_pages"] == 4
+    assert [attempt["number"] for attempt in result["attempts"]] == [7, 6]
+    assert [attempt["code"] for attempt in result["attempts"]] == [codes[6], codes[5]]
+
+    result = block.get_attempt_history.__wrapped__(block, data={"page": 3, "page_size": 2})
+    assert [attempt["code"] for attempt in result["attempts"]] == [codes[2], codes[1]]
+    assert result["attempts"][0]["ai_evaluation"] == "evaluation 2"
+
+
+def test_coding_attempt_history_dedupes_results(coding_block_data):
+    """Test unchanged evaluations and outputs are not stored again, and long ones are truncated."""
+    block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), None)
+    long_output = "x" * (block.MAX_ATTEMPT_TEXT_LENGTH + 100)
+    for n in range(3):
+        block._record_attempt(f"print({n})\n" + "pass\n" * 20, "Same evaluation", {"stdout": long_output})
+
+    assert len(block.attempt_history[0]["code_exec_result"]["stdout"]) < len(long_output)
+    assert "ai_evaluation" not in block.attempt_history[1]
+    assert "code_exec_result" not in block.attempt_history[2]
+    result = block.get_attempt_history.__wrapped__(block, data={})
+    assert [attempt["ai_evaluation"] for attempt in result["attempts"]] == ["Same evaluation"] * 3
+    assert result["attempts"][0]["code_exec_result"] == block.attempt_history[0]["code_exec_result"]
+
+
+def test_coding_attempt_history_retention(coding_block_data):
+    """Test the oldest attempts are dropped and the first kept one holds its code."""
+    block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), None)
+    block.MAX_ATTEMPT_HISTORY = 4
+    codes = ["x = 0\n" * 20 + f"y = {n}\n" for n in range(6)]
+    for n, code in enumerate(codes):
+        block._record_attempt(code, "", {})
+
+    assert [attempt["number"] for attempt in block.attempt_history] == [3, 4, 5, 6]
+    assert block.attempt_history[0]["code"] == codes[2]
+    result = block.get_attempt_history.__wrapped__(block, data={})
+    assert [attempt["code"] for attempt in result["attempts"]] == codes[:1:-1]
+
+
+@patch("ai_eval.coding_ai_eval.get_llm_response", return_value="Good job")
+def test_coding_get_response_records_attempt(mock_llm, coding_block_data):
+    """Test an evaluated submission is added to the attempt history."""
+    block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), Mock(usage_id="block-1"))
+    block.get_model_api_key = Mock(return_value="key")
+    block.get_model_api_url = Mock(return_value=None)
+    result = block.get_response.__wrapped__(block, data={"code": "print(1)", "stdout": "1", "stderr": ""})
+    assert block.attempt_history[0]["code"] == "print(1)"
+    assert block.attempt_history[0]["ai_evaluation"] == "Good job"
+    assert result["response_html"] == "<p>Good job</p>"
+    assert block.student_view().json_init_args["ai_evaluation_html"] == "<p>Good job</p>"
+
+
+@patch("ai_eval.coding_ai_eval.get_llm_response", return_value="Good job")
+def test_coding_get_response_reuses_identical_evaluation(mock_llm, coding_block_data):
+    """Test similar submissions are clustered, and identical ones reuse their evaluation when enabled."""
+    cache.clear()
+    block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), Mock(usage_id="block-1"))
+    block.get_model_api_key = Mock(return_value="key")
+    block.get_model_api_url = Mock(return_value=None)
+    submission = {"code": "x = 1\nprint(min(x, 2))", "stdout": "1", "stderr": ""}
+    commented = {**submission, "code": "# answer\nx = 1\nprint(min(x,  2))\n"}
+    block.get_response.__wrapped__(block, data=submission)
+    block.get_response.__wrapped__(block, data=commented)
+    assert mock_llm.call_count == 2
+
+    block.reuse_similar_evaluations = True
+    block.get_response.__wrapped__(block, data=submission)
+    assert mock_llm.call_count == 3
+    assert block.get_response.__wrapped__(block, data=commented)["response"] == "Good job"
+    assert mock_llm.call_count == 3
+    # Renamed variables or builtins, or a different output, are evaluated again
+    block.get_response.__wrapped__(block, data={**submission, "code": "y = 1\nprint(min(y, 2))"})
+    block.get_response.__wrapped__(block, data={**submission, "code": "x = 1\nprint(max(x, 2))"})
+    block.get_response.__wrapped__(block, data={**commented, "stdout": "3"})
+    assert mock_llm.call_count == 6
+
+    with pytest.raises(JsonHandlerError):
+        block.get_submission_clusters.__wrapped__(block, data={})
+    block.runtime.user_is_staff = True
+    # Submissions are clustered in the background, in order
+    get_clustering_executor().submit(lambda: None).result()
+    clusters = block.get_submission_clusters.__wrapped__(block, data={})["clusters"]
+    assert len(clusters) == 1
+    assert clusters[0]["size"] == 7
+    assert clusters[0]["code"] == submission["code"]
+    assert len(clusters[0]["members"]) == 7
+
+
+def test_resources_are_cached(coding_block_data):
+    """Test package resources are read once per process."""
+    AIEvalXBlock._resource_cache.clear()
+    block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), None)
+    with patch("ai_eval.base.pkg_resources.resource_string", return_value=b"content") as mock_resource_string:
+        for _ in range(3):
+            assert block.resource_string("static/js/src/utils.js") == "content"
+
+    mock_resource_string.assert_called_once()
+    AIEvalXBlock._resource_cache.clear()
+
+
+def test_author_view_validation_is_cached(coding_block_data):
+    """Test Studio previews only validate the block again when its fields change."""
+    AIEvalXBlock._validation_cache.clear()
+    block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), Mock(usage_id="block"))
+    validation = Validation("block")
+    validation.add(ValidationMessage(ValidationMessage.ERROR, "Invalid"))
+    with patch.object(CodingAIEvalXBlock, "validate", return_value=validation) as mock_validate, \
+            patch("ai_eval.base.get_site_configuration_value", return_value=None) as mock_site_config:
+        for _ in range(3):
+            frag = block.author_view()
+        assert mock_validate.call_count == 1
+        assert "please fix the validation issues" in frag.content
+
+        block.judge0_api_key = "judge0-key"
+        block.author_view()
+        assert mock_validate.call_count == 2
+
+        # blocks with the same fields share the messages, in their own validation
+        other_block = CodingAIEvalXBlock(ToyRuntime(), DictFieldData(coding_block_data), Mock(usage_id="other"))
+        other_validation = other_block.get_cached_validation()
+        assert mock_validate.call_count == 2
+        assert other_validation.xblock_id == "other"
+        assert [message.text for message in other_validation.messages] == ["Invalid"]
+
+        # a change of the site configuration validates again
+        mock_site_config.return_value = "site-key"
+        other_block.get_cached_validation()
+        assert mock_validate.call_count == 3
+
+
+def test_multi_file_run_test_cases_hidden_tests(multi_file_block):
+    """Test quick runs skip the hidden tests, and full runs report them without their details."""
+    multi_file_block.test_cases = [
+        {"name": "sample", "expected_output": "1"},
+        {"name": "hidden", "expected_output": "secret", "hidden": True},
+    ]
+    execute = multi_file_block._execute_test_case_enhanced = Mock(
+        side_effect=lambda test_case, number: {
+            "test_case": test_case, "test_number": number, "passed": True, "actual_output": "secret",
+        }
+    )
+    multi_file_block.runtime.publish = Mock()
+
+    result = multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    assert execute.call_count == 1
+    assert [r["test_number"] for r in result["results"]] == [1]
+    assert result["score"] is None
+    multi_file_block.runtime.publish.assert_not_called()
+
+    result = multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={"full": True})
+    assert execute.call_count == 2
+    assert result["full"]
+    assert result["results"][1] == {
+        "test_case": {"hidden": True}, "test_number": 2, "test_name": "Hidden test", "hidden": True, "passed": True,
+    }
+    assert result["score"] == {"earned": 2, "possible": 2}
+    multi_file_block.runtime.publish.assert_called_once()
+
+
+def test_multi_file_full_test_runs_are_throttled(multi_file_block):
+    """Test students wait between two full test runs."""
+    multi_file_block.test_cases = [{"name": "a", "expected_output": "1", "hidden": True}]
+    multi_file_block.full_test_run_interval = 60
+    multi_file_block._execute_test_case_enhanced = Mock(return_value={"passed": True})
+    multi_file_block.runtime.publish = Mock()
+
+    with patch("ai_eval.multi_file_coding_ai_eval.time.time", return_value=1000):
+        multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={"full": True})
+    with patch("ai_eval.multi_file_coding_ai_eval.time.time", return_value=1030):
+        with pytest.raises(JsonHandlerError) as error:
+            multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={"full": True})
+        assert error.value.status_code == 429
+        assert "30 seconds" in error.value.message
+        # Quick runs are not throttled
+        multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    with patch("ai_eval.multi_file_coding_ai_eval.time.time", return_value=1060):
+        multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={"full": True})
+
+
+def test_multi_file_full_test_runs_without_execution_are_not_throttled(multi_file_block):
+    """Test full runs which only failed transiently or reused results can run again right away."""
+    multi_file_block.test_cases = [{"name": "a", "expected_output": "1", "hidden": True}]
+    multi_file_block.full_test_run_interval = 60
+    execute = multi_file_block._execute_test_case_enhanced = Mock(
+        return_value={"passed": False, "error": "Test execution timeout", "transient": True}
+    )
+    multi_file_block.runtime.publish = Mock()
+
+    multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={"full": True})
+    assert multi_file_block.last_full_test_run == 0
+    execute.return_value = {"passed": True}
+    multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={"full": True})
+    assert multi_file_block.last_full_test_run > 0
+
+    # The results are memoized, nothing runs again
+    multi_file_block.last_full_test_run = 0
+    multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={"full": True})
+    assert execute.call_count == 2
+    assert multi_file_block.last_full_test_run == 0
+
+
+def test_multi_file_run_test_cases_memoizes_results(multi_file_block):
+    """Test running the tests again only executes the tests changed since the project last ran."""
+    multi_file_block.test_cases = [{"name": "a", "expected_output": "1"}, {"name": "b", "expected_output": "2"}]
+    execute = multi_file_block._execute_test_case_enhanced = Mock(side_effect=[
+        {"test_number": 1, "passed": True, "actual_output": "1"},
+        {"test_number": 2, "passed": False, "mismatch": "line 1: expected '2', got '1'", "actual_output": "1" * 1000},
+        {"test_number": 2, "passed": False, "error": "Runtime error: " + "x" * 1000, "actual_output": ""},
+    ])
+    multi_file_block.runtime.publish = Mock()
+    multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    assert execute.call_count == 2
+
+    result = multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    assert execute.call_count == 2
+    assert result["summary"]["cached"] == 2
+    assert result["results"][1]["mismatch"] == "line 1: expected '2', got '1'"
+    assert result["results"][1]["test_case"] == multi_file_block.test_cases[1]
+    assert not result["results"][1]["passed"]
+    # Outputs are not stored
+    assert "1" * 1000 not in json.dumps(multi_file_block.test_results)
+
+    # Only the edited test runs again
+    multi_file_block.test_cases = [multi_file_block.test_cases[0], {"name": "b", "expected_output": "3"}]
+    result = multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    assert execute.call_count == 3
+    assert [r.get("cached", False) for r in result["results"]] == [True, False]
+    failures = multi_file_block.test_results["failures"]
+    assert len(failures[multi_file_block._get_test_case_hash(multi_file_block.test_cases[1])]["error"]) == 200
+
+    # Transient failures are not memoized
+    execute.side_effect = None
+    execute.return_value = {"passed": False, "error": "Test execution timeout", "transient": True}
+    multi_file_block.save_file.__wrapped__(multi_file_block, data={"filename": "main.py", "content": "print(2)"})
+    multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    multi_file_block.run_test_cases.__wrapped__(multi_file_block, data={})
+    assert execute.call_count == 7
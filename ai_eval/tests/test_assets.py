@@ -0,0 +1,63 @@
+"""Tests for static asset bundles."""
+# pylint: disable=redefined-outer-name
+
+from unittest.mock import Mock, patch
+
+import pytest
+from web_fragments.fragment import Fragment
+from xblock.field_data import DictFieldData
+from xblock.test.toy_runtime import ToyRuntime
+
+from ai_eval import assets
+from ai_eval.base import AIEvalXBlock
+
+
+@pytest.fixture
+def package_dir(tmp_path):
+    """Fixture for a package directory with the sources of a single bundle."""
+    (tmp_path / "static/js/src").mkdir(parents=True)
+    (tmp_path / "static/js/src/utils.js").write_text("function add(a, b) {\n  return a + b;\n}\n")
+    with patch.object(assets, "PACKAGE_DIR", str(tmp_path)), \
+            patch.dict(assets.BUNDLES, {"utils.js": ["static/js/src/utils.js"]}, clear=True):
+        assets.get_built_bundle_path.cache_clear()
+        yield tmp_path
+    assets.get_built_bundle_path.cache_clear()
+
+
+def test_build_bundles(package_dir):
+    """Test bundles are written under a content-hashed name."""
+    assert assets.get_built_bundle_path("utils.js") is None
+
+    manifest = assets.build_bundles()
+
+    path = manifest["utils.js"]["path"]
+    assert path.startswith("public/bundles/utils.") and path.endswith(".min.js")
+    assert (package_dir / path).exists()
+    assert assets.get_built_bundle_path("utils.js") == path
+
+
+def test_stale_bundle_is_ignored(package_dir):
+    """Test a bundle built from older sources is not used."""
+    assets.build_bundles()
+    (package_dir / "static/js/src/utils.js").write_text("function add() {}\n")
+    assets.get_built_bundle_path.cache_clear()
+    assert assets.get_built_bundle_path("utils.js") is None
+
+
+def test_add_bundle():
+    """Test built bundles are added by URL, others are inlined."""
+    runtime = ToyRuntime()
+    runtime.local_resource_url = Mock(return_value="/resource/utils.123.min.js")
+    block = AIEvalXBlock(runtime, DictFieldData({}), None)
+
+    with patch("ai_eval.base.get_built_bundle_path", return_value="public/bundles/utils.123.min.js"):
+        frag = Fragment()
+        block.add_bundle(frag, "utils.js")
+    assert frag.resources[0].kind == "url"
+    assert frag.resources[0].data == "/resource/utils.123.min.js"
+
+    with patch("ai_eval.base.get_built_bundle_path", return_value=None):
+        frag = Fragment()
+        block.add_bundle(frag, "utils.js")
+    assert frag.resources[0].kind == "text"
+    assert "function stripScriptTags" in frag.resources[0].data
@@ -0,0 +1,195 @@
+"""Tests for attachment downloads."""
+# pylint: disable=redefined-outer-name,protected-access
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import cache
+
+from ai_eval.attachments import (
+    ATTACHMENT_DEFAULT_MAX_AGE,
+    ATTACHMENT_MAX_SIZE,
+    AttachmentError,
+    _get_cache_key,
+    download_attachment,
+    download_attachment_prompt,
+    download_attachments,
+    get_attachments_prompt,
+    make_attachment_prompt,
+)
+from ai_eval.metrics import render_prometheus
+
+
+class AttachmentServer(ThreadingHTTPServer):
+    """HTTP server serving in-memory files, with ETags."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), AttachmentRequestHandler)
+        self.files = {}
+        self.requests = []
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class AttachmentRequestHandler(BaseHTTPRequestHandler):
+    """Serve the files of the server, answering conditional requests."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        content, headers = self.server.files[self.path]
+        etag = f'"{hash(content)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture
+def server():
+    """Run an attachment server for the test."""
+    cache.clear()
+    attachment_server = AttachmentServer()
+    thread = threading.Thread(target=attachment_server.serve_forever, daemon=True)
+    thread.start()
+    yield attachment_server
+    attachment_server.shutdown()
+    attachment_server.server_close()
+
+
+def test_download_attachment_is_cached(server):
+    """Test a fresh attachment is reused without any request."""
+    server.files["/a.txt"] = (b"content", {})
+    for _ in range(3):
+        assert download_attachment(server.url("/a.txt")) == "content"
+    assert len(server.requests) == 1
+
+
+def test_download_attachment_prompt(server):
+    """Test only the content is kept in the Django cache, and the prompt is built once per version."""
+    server.files["/b.txt"] = (b"a < b", {})
+    prompt = download_attachment_prompt(server.url("/b.txt"))
+    assert "a &lt; b" in prompt.text
+    assert download_attachment_prompt(server.url("/b.txt")) is prompt
+    assert set(cache.get(_get_cache_key(server.url("/b.txt")))) == {
+        "content", "version", "etag", "last_modified", "max_age", "fresh_until",
+    }
+
+
+@patch("ai_eval.attachments.time.time")
+def test_download_attachment_revalidated(mock_time, server):
+    """Test a stale attachment is revalidated, and only downloaded again when it changed."""
+    mock_time.return_value = 1000
+    server.files["/a.txt"] = (b"content", {})
+    download_attachment(server.url("/a.txt"))
+
+    mock_time.return_value = 1000 + ATTACHMENT_DEFAULT_MAX_AGE
+    assert download_attachment(server.url("/a.txt")) == "content"
+    assert len(server.requests) == 2
+    # sent with the ETag of the cached content, which was not modified
+    assert server.requests[1][1] is not None
+
+    mock_time.return_value = 2000 + 2 * ATTACHMENT_DEFAULT_MAX_AGE
+    server.files["/a.txt"] = (b"new content", {})
+    assert download_attachment(server.url("/a.txt")) == "new content"
+    assert len(server.requests) == 3
+
+
+def test_download_attachment_no_cache(server):
+    """Test an attachment served with no-cache is revalidated on every use."""
+    server.files["/a.txt"] = (b"content", {"Cache-Control": "no-cache"})
+    for _ in range(3):
+        assert download_attachment(server.url("/a.txt")) == "content"
+    assert len(server.requests) == 3
+
+
+def test_download_attachment_too_large(server):
+    """Test attachments over the maximum size are rejected."""
+    server.files["/big.txt"] = (b"x" * (ATTACHMENT_MAX_SIZE + 1), {})
+    with pytest.raises(AttachmentError):
+        download_attachment(server.url("/big.txt"))
+
+
+def test_download_attachments():
+    """Test attachments are downloaded in parallel, and returned in order."""
+    def download(url, timeout):
+        assert 0 < timeout <= 10
+        return url.upper()
+
+    assert download_attachments(["a", "b", "c"], download) == ["A", "B", "C"]
+    text = render_prometheus()
+    assert "# TYPE ai_eval_attachment_downloads_queued gauge\nai_eval_attachment_downloads_queued 0\n" in text
+    assert "ai_eval_attachment_downloads_running 0\n" in text
+
+
+def test_download_attachments_cancel_on_error():
+    """Test a failed download fails all of them, without waiting for the others."""
+    release = threading.Event()
+
+    def download(url, timeout):  # pylint: disable=unused-argument
+        if url == "bad":
+            raise AttachmentError("bad attachment")
+        release.wait(5)
+        return url
+
+    with pytest.raises(AttachmentError, match="bad attachment"):
+        download_attachments(["slow", "bad"], download)
+    release.set()
+
+
+def test_download_attachments_deadline():
+    """Test downloads not finished before the deadline fail."""
+    release = threading.Event()
+
+    def download(url, timeout):  # pylint: disable=unused-argument
+        release.wait(5)
+        return url
+
+    with pytest.raises(AttachmentError, match="within 0.1 seconds"):
+        download_attachments(["slow"], download, deadline=0.1)
+    release.set()
+
+
+def test_make_attachment_prompt():
+    """Test the prompt block of an attachment is escaped, and versioned by content without ETag."""
+    prompt = make_attachment_prompt("http://example.com/a<b>.txt", "x < y & z")
+    assert "<filename>a&lt;b&gt;.txt</filename>" in prompt.text
+    assert "<contents>x &lt; y &amp; z</contents>" in prompt.text
+    assert prompt.version == make_attachment_prompt("http://example.com/other.txt", "x < y & z").version
+    assert make_attachment_prompt("http://example.com/a.txt", "x", '"etag"').version == '"etag"'
+
+
+@patch("ai_eval.attachments.time.time")
+@patch("ai_eval.attachments.count_tokens", return_value=42)
+def test_get_attachments_prompt(mock_count_tokens, mock_time, server):
+    """Test the attachments prompt is only built again when an attachment changed."""
+    mock_time.return_value = 1000
+    server.files["/a.txt"] = (b"a <content>", {})
+    server.files["/b.txt"] = (b"b content", {})
+    urls = [server.url("/a.txt"), server.url("/b.txt")]
+
+    prompt = get_attachments_prompt(urls, "gpt-4o")
+    assert prompt.text.index("a &lt;content&gt;") < prompt.text.index("b content")
+    assert prompt.tokens == 42
+    mock_time.return_value = 1000 + ATTACHMENT_DEFAULT_MAX_AGE
+    assert prompt.chunk_tokens == (42, 42)
+    calls = mock_count_tokens.call_count
+    assert get_attachments_prompt(urls, "gpt-4o") is prompt
+    assert mock_count_tokens.call_count == calls
+
+    mock_time.return_value = 2000 + 2 * ATTACHMENT_DEFAULT_MAX_AGE
+    server.files["/b.txt"] = (b"new b content", {})
+    assert "new b content" in get_attachments_prompt(urls, "gpt-4o").text
+    assert mock_count_tokens.call_count > calls
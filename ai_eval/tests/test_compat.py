@@ -5,7 +5,17 @@ from unittest.mock import patch
 import pytest
 from django.test import override_settings
 
-from ai_eval.compat import get_site_configuration_value
+from ai_eval.compat import (
+    SITE_CONFIGURATION_CACHE_TTL,
+    clear_site_configuration_cache,
+    get_site_configuration_value,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Start every test with an empty site configuration cache."""
+    clear_site_configuration_cache()
 
 
 @pytest.mark.parametrize(
@@ -60,3 +70,27 @@ def test_get_site_configuration_value_in_cms(
     mock_get_current_site_configuration_value.assert_called_once_with("LMS_BASE", settings_lms_base)
     mock_get_site_configuration_value.assert_called_once_with(cms_site_configuration_value, block_settings_key, {})
     assert result == expected_key
+
+
+@patch("ai_eval.compat.time.monotonic")
+@patch("ai_eval.compat._get_site_configuration_value", return_value={"api_key": "test_key"})
+@patch("ai_eval.compat._get_current_site_configuration_value", return_value="site.example.com")
+def test_get_site_configuration_value_in_cms_is_cached(
+    mock_get_current_site_configuration_value,  # pylint: disable=unused-argument
+    mock_get_site_configuration_value,
+    mock_monotonic,
+):
+    """Test the LMS site configuration is only queried again when it expired or was saved."""
+    mock_monotonic.return_value = 1000
+    for _ in range(3):
+        assert get_site_configuration_value("block_settings", "api_key") == "test_key"
+    assert mock_get_site_configuration_value.call_count == 1
+
+    mock_monotonic.return_value = 1000 + SITE_CONFIGURATION_CACHE_TTL
+    assert get_site_configuration_value("block_settings", "api_key") == "test_key"
+    assert mock_get_site_configuration_value.call_count == 2
+
+    mock_get_site_configuration_value.return_value = {"api_key": "new_key"}
+    clear_site_configuration_cache(sender=None, instance=None)
+    assert get_site_configuration_value("block_settings", "api_key") == "new_key"
+    assert mock_get_site_configuration_value.call_count == 3
@@ -0,0 +1,95 @@
+"""Tests for the export of submissions."""
+
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from ai_eval.compat import StudentState
+from ai_eval.export import iter_submission_rows, write_csv
+from ai_eval.management.commands.ai_eval_export_submissions import Command
+
+MODIFIED = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+STATES = {
+    "coding_ai_eval": [
+        StudentState("block-1", "alice", MODIFIED, {
+            "messages": {
+                "USER_RESPONSE": "print('é')",
+                "AI_EVALUATION": "Good",
+                "CODE_EXEC_RESULT": {"stdout": "é", "stderr": ""},
+            },
+        }),
+        StudentState("block-1", "bob", MODIFIED, {"messages": {"USER_RESPONSE": "", "AI_EVALUATION": ""}}),
+    ],
+    "multi_file_coding_ai_eval": [
+        StudentState("block-2", "carol", None, {
+            "project_files": {"main.py": {"content": "import utils", "version": 2}, "utils.py": {"content": "x = 1"}},
+        }),
+    ],
+}
+
+
+def test_iter_submission_rows():
+    """Test the rows of the learners who submitted code, with their output and evaluation."""
+    rows = list(iter_submission_rows("coding_ai_eval", STATES["coding_ai_eval"]))
+    assert rows == [{
+        "block_id": "block-1",
+        "block_type": "coding_ai_eval",
+        "learner": "alice",
+        "modified": "2024-01-02T03:04:05+00:00",
+        "code": "print('é')",
+        "stdout": "é",
+        "stderr": "",
+        "ai_evaluation": "Good",
+        "project_files": {},
+    }]
+    rows = list(iter_submission_rows("multi_file_coding_ai_eval", STATES["multi_file_coding_ai_eval"]))
+    assert rows[0]["project_files"] == {"main.py": "import utils", "utils.py": "x = 1"}
+    assert rows[0]["modified"] is None
+
+
+def test_write_csv():
+    """Test the project files are written as JSON in CSV exports."""
+    output = io.StringIO()
+    rows = iter_submission_rows("multi_file_coding_ai_eval", STATES["multi_file_coding_ai_eval"])
+    assert write_csv(rows, output) == 1
+    row = next(csv.DictReader(io.StringIO(output.getvalue())))
+    assert row["learner"] == "carol"
+    assert json.loads(row["project_files"])["utils.py"] == "x = 1"
+
+
+@patch(
+    "ai_eval.management.commands.ai_eval_export_submissions.iter_student_states",
+    side_effect=lambda course_id, block_type, block_ids: iter(STATES[block_type]),
+)
+def test_export_command(mock_states, tmp_path):
+    """Test the command exports the coding blocks of a course, compressed."""
+    output = tmp_path / "export.jsonl.gz"
+    call_command(Command(), "course-v1:a+b+c", output=str(output), gzip=True)
+    with gzip.open(output, "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["learner"] for row in rows] == ["alice", "carol"]
+    assert mock_states.call_count == 2
+
+    stdout = io.StringIO()
+    call_command(
+        Command(), "course-v1:a+b+c", block_ids=["block-1"], block_type="coding_ai_eval",
+        export_format="csv", stdout=stdout,
+    )
+    mock_states.assert_called_with("course-v1:a+b+c", "coding_ai_eval", ["block-1"])
+    assert [row["learner"] for row in csv.DictReader(io.StringIO(stdout.getvalue()))] == ["alice"]
+
+
+def test_export_command_invalid_options():
+    """Test blocks are exported with their type, and only files are compressed."""
+    with pytest.raises(CommandError):
+        call_command(Command(), "course-v1:a+b+c", block_ids=["block-1"])
+    with pytest.raises(CommandError):
+        call_command(Command(), "course-v1:a+b+c", gzip=True)
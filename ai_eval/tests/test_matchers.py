@@ -0,0 +1,146 @@
+"""Tests for the test case output matchers."""
+# pylint: disable=protected-access
+
+import pytest
+
+from ai_eval.matchers import (
+    InvalidTestCase,
+    _compare_sequences,
+    compile_regex,
+    get_matcher,
+    iter_lines,
+    validate_test_case,
+)
+
+
+@pytest.mark.parametrize("test_type, expected, actual, matches", [
+    ("exact_match", "1\n2", "1\n2", True),
+    ("exact_match", "1\n2", "1\n2\n", False),
+    ("output_comparison", " 42\n", "42", True),
+    ("output_comparison", "42", "43", False),
+    ("contains", "world", "hello world!", True),
+    ("contains", "World", "hello world!", False),
+    ("regex", r"^\d+ items?$", "3 items", True),
+    ("regex", r"^\d+ items?$", "three items", False),
+    ("unknown", " 42 ", "42", True),
+])
+def test_get_matcher(test_type, expected, actual, matches):
+    """Test each test type compares outputs like before."""
+    assert (get_matcher(test_type, expected)(actual) is None) == matches
+
+
+@pytest.mark.parametrize("test_type, expected, actual, mismatch", [
+    ("exact_match", "1\n2\n3", "1\n5\n3", "line 2: expected '2', got '5'"),
+    ("exact_match", "1\n2", "1\n2\n", "output differs by its trailing newline"),
+    ("output_comparison", "1\n2", "1", "end of output: missing '2'"),
+    ("contains", "x", "abc", "output does not contain 'x'"),
+    ("normalized_whitespace", "a  b\n\nc", "  a b \nc\n\n", None),
+    ("normalized_whitespace", "a b\nc", "a b\nd", "line 2: expected 'c', got 'd'"),
+    ("tokens", "1 2 3\n4", "1\n2 3 4", None),
+    ("tokens", "1 2 3", "1 2 4 5", "line 1, token 3: expected '3', got '4'"),
+    ("tokens", "1 2", "1 2 3", "line 1, token 3: unexpected '3'"),
+    ("float_tolerance", "pi 3.14159265", "pi 3.141592651", None),
+    ("float_tolerance", "pi 3.14", "pi 3.15", "line 1, token 2: expected 3.14, got '3.15'"),
+    ("float_tolerance", "pi 3.14", "PI 3.14", "line 1, token 1: expected 'pi', got 'PI'"),
+    ("float_tolerance", "1", "one", "line 1, token 1: expected 1.0, got 'one'"),
+    ("unordered_lines", "a\nb\nb", "b\n a\nb", None),
+    ("unordered_lines", "a\nb", "b\nc", "line 2: unexpected 'c'"),
+    ("unordered_lines", "a\nb\nb", "b\na", "end of output: missing 'b'"),
+    ("json", '{"a": [1, 2], "b": true}', '{"b": true, "a": [1.0, 2]}', None),
+    ("json", '{"a": [1, 2]}', '{"a": [1, 3]}', "$.a[1]: expected 2, got 3"),
+    ("json", '{"a": 1}', '{"a": true}', "$.a: expected 1, got True"),
+    ("json", '{"a": 1}', '{"a": 1, "b": 2}', "$: unexpected key 'b'"),
+    ("json", '[1]', '[1, 2]', "$: expected 1 items, got 2"),
+])
+def test_get_matcher_mismatch(test_type, expected, actual, mismatch):
+    """Test matchers describe the location of the first difference."""
+    assert get_matcher(test_type, expected)(actual) == mismatch
+
+
+def test_get_matcher_float_tolerance():
+    """Test the tolerance of float comparisons is configurable."""
+    assert get_matcher("float_tolerance", "3.14", 0.01)("3.15") is None
+    assert get_matcher("float_tolerance", "3.14", 0.001)("3.15") is not None
+
+
+def test_get_matcher_json_invalid():
+    """Test invalid output and expected output of JSON tests."""
+    assert get_matcher("json", "{}")("nope").startswith("output is not valid JSON")
+    with pytest.raises(InvalidTestCase, match="not valid JSON"):
+        validate_test_case({"type": "json", "expected_output": "{nope"})
+
+
+def test_compare_stops_at_first_mismatch():
+    """Test outputs are not read past their first difference."""
+    consumed = []
+
+    def output():
+        for number in range(1, 1000):
+            consumed.append(number)
+            yield f"line {number}", "2" if number == 3 else "1"
+
+    assert _compare_sequences(["1"] * 1000, output()) == "line 3: expected '1', got '2'"
+    assert consumed == [1, 2, 3]
+    assert list(iter_lines("a\n\nb\n")) == ["a", "", "b"]
+
+
+def test_get_matcher_is_cached():
+    """Test matchers are compiled once."""
+    assert get_matcher("regex", "a.c") is get_matcher("regex", "a.c")
+
+
+@pytest.mark.parametrize("pattern", [
+    r"(a+)+$", r"(a*)*b", r"(\w+\s?)+$", r"(.*)*x", r"(x+x+)+y", r"a(?=(b+)+)",
+    r"(a|a)*", r"(a|aa)+$", r"(.*a){25}", r"(\d+|x)+", r"^\s*(-?\d+(\.\d+)?\s*)+$",
+    r"x*x*x*y", r"\w+\s*\d+\w*=", r"(a*)(b?a*)(a+)",
+])
+def test_compile_regex_rejects_catastrophic_backtracking(pattern):
+    """Test repeats which can match the same text in many ways are rejected."""
+    with pytest.raises(InvalidTestCase, match="same text in many ways"):
+        compile_regex(pattern)
+
+
+@pytest.mark.parametrize("pattern", [
+    r"(\d+,)*\d+", r"[a-z]+( [a-z]+)*", r"(a|b)+", r"(\d+)?", r"^Result: \d+\.\d{2}$",
+    r"(foo|bar)+", r"(ba|b)+", r"(.*\n)*", r"(?i)(hello|world)+", r".*Result: \d+.*", r"\d+ \d+ \d+ \d+",
+])
+def test_compile_regex_accepts_safe_repeats(pattern):
+    """Test repeats which must consume text between iterations are accepted."""
+    assert compile_regex(pattern).pattern == pattern
+
+
+def test_get_matcher_regex_output_length():
+    """Test regular expressions do not match outputs too long to match in a bounded time."""
+    assert get_matcher("regex", "a")("a" * 100_000) is None
+    assert get_matcher("regex", "a")("a" * 100_001).startswith("output longer than 100000 characters")
+
+
+def test_compile_regex_invalid():
+    """Test invalid and too long expressions are rejected."""
+    with pytest.raises(InvalidTestCase, match="invalid regular expression"):
+        compile_regex("(unclosed")
+    with pytest.raises(InvalidTestCase, match="longer than"):
+        compile_regex("a" * 1001)
+
+
+@pytest.mark.parametrize("test_case", [
+    "not an object",
+    {"expected_output": 42},
+    {"timeout": -1},
+    {"weight": True},
+    {"hidden": "yes"},
+    {"type": "regex", "expected_output": "["},
+])
+def test_validate_test_case_invalid(test_case):
+    """Test invalid test case definitions are rejected."""
+    with pytest.raises(InvalidTestCase):
+        validate_test_case(test_case)
+
+
+def test_validate_test_case_valid():
+    """Test complete test cases are valid."""
+    validate_test_case({
+        "name": "sum", "description": "", "input": "1 2", "expected_output": "3",
+        "type": "output_comparison", "timeout": 5, "weight": 2, "hidden": True,
+    })
+    validate_test_case({})
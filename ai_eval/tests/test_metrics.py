@@ -0,0 +1,117 @@
+"""Tests for the latency metrics."""
+# pylint: disable=protected-access
+
+import socket
+from unittest.mock import Mock, patch
+
+import pytest
+from xblock.exceptions import JsonHandlerError
+
+from ai_eval import metrics, tracing
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    """Start each test without histograms nor StatsD."""
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class Block:
+    """A block with instrumented handlers."""
+
+    def _get_settings(self):
+        return {}
+
+    @metrics.instrument_handler
+    def handler(self, data, suffix=""):  # pylint: disable=unused-argument
+        if data.get("fail"):
+            raise JsonHandlerError(429, "Too many requests")
+        return data
+
+
+def test_instrument_handler():
+    """Test the durations of the handlers are observed by status."""
+    block = Block()
+    assert block.handler({"a": 1}) == {"a": 1}
+    with pytest.raises(JsonHandlerError):
+        block.handler({"fail": True})
+
+    assert set(metrics._histograms) == {
+        ("handler_duration_seconds", (("block", "Block"), ("handler", "handler"), ("status", "200"))),
+        ("handler_duration_seconds", (("block", "Block"), ("handler", "handler"), ("status", "429"))),
+    }
+
+
+def test_render_prometheus():
+    """Test histograms are rendered with cumulative buckets."""
+    labels = (("service", "judge0"), ("call", "submit"))
+    metrics.observe("upstream_duration_seconds", labels, 0.02)
+    metrics.observe("upstream_duration_seconds", labels, 0.3)
+    metrics.observe("upstream_duration_seconds", labels, 100)
+
+    text = metrics.render_prometheus()
+    assert "# TYPE ai_eval_upstream_duration_seconds histogram\n" in text
+    prefix = 'ai_eval_upstream_duration_seconds_bucket{service="judge0",call="submit",le='
+    assert f'{prefix}"0.01"}} 0\n' in text
+    assert f'{prefix}"0.025"}} 1\n' in text
+    assert f'{prefix}"0.5"}} 2\n' in text
+    assert f'{prefix}"60"}} 2\n' in text
+    assert f'{prefix}"+Inf"}} 3\n' in text
+    assert 'ai_eval_upstream_duration_seconds_count{service="judge0",call="submit"} 3\n' in text
+    assert 'ai_eval_upstream_duration_seconds_sum{service="judge0",call="submit"} 100.32' in text
+
+
+def test_timed():
+    """Test the calls to upstream services are observed, including the failed ones."""
+    func = metrics.timed("llm", "completion")(Mock(side_effect=[1, ValueError]))
+    assert func() == 1
+    with pytest.raises(ValueError):
+        func()
+    histogram = metrics._histograms[("upstream_duration_seconds", (("service", "llm"), ("call", "completion")))]
+    assert sum(histogram.counts) == 2
+
+
+def test_statsd():
+    """Test durations are sent to the configured StatsD server."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    metrics.configure_statsd({"STATSD_HOST": "127.0.0.1", "STATSD_PORT": server.getsockname()[1]})
+
+    metrics.observe("upstream_duration_seconds", (("service", "llm"), ("call", "completion")), 0.25)
+    assert server.recv(1024) == b"ai_eval.upstream_duration_seconds.llm.completion:250.000|ms"
+    server.close()
+
+
+def test_gauges():
+    """Test gauges are rendered with their last value, and sent to StatsD."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    metrics.configure_statsd({"STATSD_HOST": "127.0.0.1", "STATSD_PORT": server.getsockname()[1]})
+
+    metrics.set_gauge("attachment_downloads_queued", (), 3)
+    metrics.set_gauge("attachment_downloads_queued", (), 2)
+    assert server.recv(1024) == b"ai_eval.attachment_downloads_queued:3|g"
+    assert server.recv(1024) == b"ai_eval.attachment_downloads_queued:2|g"
+    server.close()
+    assert metrics.render_prometheus().endswith(
+        "# TYPE ai_eval_attachment_downloads_queued gauge\nai_eval_attachment_downloads_queued 2\n"
+    )
+
+
+def test_instrument_handler_records_each_call():
+    """Test each call of an instrumented handler is one span and one observed duration."""
+    block = Block()
+    with patch("ai_eval.metrics.tracing.span", wraps=tracing.span) as mock_span:
+        for _ in range(3):
+            block.handler({"trace_id": "0123456789abcdef0123456789abcdef"})
+
+    assert mock_span.call_count == 3
+    mock_span.assert_called_with("Block.handler", "0123456789abcdef0123456789abcdef", None, handler="handler")
+    histogram = metrics._histograms[
+        ("handler_duration_seconds", (("block", "Block"), ("handler", "handler"), ("status", "200")))
+    ]
+    assert sum(histogram.counts) == 3
@@ -0,0 +1,137 @@
+"""Tests for the similarity report of coding submissions."""
+
+import csv
+import io
+import itertools
+from unittest.mock import Mock, patch
+
+from django.core.management import call_command
+
+from ai_eval.compat import StudentState
+from ai_eval.management.commands.ai_eval_similarity_report import Command
+from ai_eval.plagiarism import Submission, get_fingerprints, score_pairs, write_similarity_report
+
+CODE = """
+def fibonacci(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+for i in range(10):
+    print(fibonacci(i))
+"""
+
+COPIED_CODE = """
+# my own solution
+def fib(count):
+    x, y = 0, 1
+    for _ in range(count):
+        x, y = y, x + y
+    return x
+
+for k in range(10):
+    print(fib(k))
+"""
+
+OTHER_CODE = """
+import sys
+
+values = [int(line) for line in sys.stdin]
+print(sorted(values, reverse=True)[:3])
+"""
+
+
+def test_get_fingerprints():
+    """Test the fingerprints ignore comments and names, and differ for different code."""
+    fingerprints = get_fingerprints(CODE, "Python")
+    assert fingerprints
+    assert fingerprints == get_fingerprints(COPIED_CODE, "Python")
+    assert not fingerprints & get_fingerprints(OTHER_CODE, "Python")
+    assert get_fingerprints("x", "Python") == get_fingerprints("y", "Python")
+    assert not get_fingerprints("", "Python")
+
+
+def test_score_pairs():
+    """Test only similar pairs are scored, most similar first."""
+    partial_copy = CODE + "print(fibonacci(20) * 2 - fibonacci(3))\n"
+    fingerprints = [get_fingerprints(code, "Python") for code in (CODE, OTHER_CODE, COPIED_CODE, partial_copy)]
+    pairs = score_pairs(fingerprints, min_similarity=0.5)
+    assert [(index, other) for index, other, _, _ in pairs] == [(0, 2), (0, 3), (2, 3)]
+    assert pairs[0][2] == 1
+    assert pairs[0][3] == len(fingerprints[0])
+    assert 0.5 <= pairs[1][2] < 1
+
+
+def test_score_pairs_ignores_template_fingerprints():
+    """Test fingerprints shared by most submissions, like starter code, are ignored."""
+    fingerprints = [get_fingerprints(CODE, "Python")] * 20
+    assert not score_pairs(fingerprints)
+
+
+def test_score_pairs_reports_common_copies():
+    """Test a solution copied by many learners is reported, its fingerprints weighing less."""
+    others = [
+        f"x = {i}\nwhile x < {i * 7 + 3}:\n    x += {i % 5 + 1}\n    print(x * {i + 2})\n"
+        for i in range(28)
+    ]
+    copies = [CODE, COPIED_CODE] * 6
+    fingerprints = [get_fingerprints(code, "Python") for code in copies + others]
+    pairs = score_pairs(fingerprints)
+    assert [(index, other, similarity) for index, other, similarity, _ in pairs if other < 12] == [
+        (index, other, 1.0) for index, other in itertools.combinations(range(12), 2)
+    ]
+
+    # The code copied by many learners weighs less than the code only one of them wrote
+    shared = OTHER_CODE.replace("print", "x = ")
+    partial_copies = [get_fingerprints(code + shared, "Python") for code in (CODE, COPIED_CODE + "print(0)\n")]
+    pairs = score_pairs(fingerprints + partial_copies, min_similarity=0)
+    _, _, similarity, count = next(pair for pair in pairs if pair[:2] == (40, 41))
+    union = len(partial_copies[0] | partial_copies[1])
+    assert similarity < count / union
+
+
+def test_score_pairs_finds_variants_of_common_copies():
+    """Test edited copies of a common solution, sharing only common fingerprints, are paired."""
+    others = [get_fingerprints(f"y = {i}\nprint(y ** {i + 3} - {i * 11})\n", "Python") for i in range(28)]
+    variants = [get_fingerprints(CODE + f"print({i} * 3)\n", "Python") for i in range(12)]
+    pairs = score_pairs(variants + others)
+    assert {(index, other) for index, other, _, _ in pairs if other < 12} == set(itertools.combinations(range(12), 2))
+
+
+def test_write_similarity_report():
+    """Test the report lists the similar pairs of each block."""
+    submissions = [
+        Submission("block-1", "alice", CODE, "Python"),
+        Submission("block-1", "bob", COPIED_CODE, "Python"),
+        Submission("block-1", "carol", OTHER_CODE, "Python"),
+        Submission("block-2", "alice", OTHER_CODE, "Python"),
+        Submission("block-2", "dave", OTHER_CODE + "\n\n", "Python"),
+    ]
+    output = io.StringIO()
+    assert write_similarity_report(submissions, output) == 2
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    assert rows == [
+        ["block_id", "learner", "other_learner", "similarity", "shared_fingerprints"],
+        ["block-1", "alice", "bob", "1.000", str(len(get_fingerprints(CODE, "Python")))],
+        ["block-2", "alice", "dave", "1.000", str(len(get_fingerprints(OTHER_CODE, "Python")))],
+    ]
+
+
+def test_similarity_report_command(tmp_path):
+    """Test the command reports the submissions of the coding blocks of a course."""
+    states = [
+        StudentState("block-1", "alice", None, {"messages": {"USER_RESPONSE": CODE}}),
+        StudentState("block-1", "bob", None, {"messages": {"USER_RESPONSE": COPIED_CODE}}),
+        StudentState("block-1", "carol", None, {}),
+        StudentState("deleted-block", "alice", None, {"messages": {"USER_RESPONSE": CODE}}),
+    ]
+    output = tmp_path / "report.csv"
+    module = "ai_eval.management.commands.ai_eval_similarity_report"
+    with patch(f"{module}.get_course_blocks", return_value={"block-1": Mock(language="Python")}), \
+            patch(f"{module}.iter_student_states", return_value=iter(states)) as mock_states:
+        call_command(Command(), "course-v1:a+b+c", output=str(output), workers=2)
+
+    mock_states.assert_called_once_with("course-v1:a+b+c", "coding_ai_eval")
+    rows = list(csv.reader(output.open(encoding="utf-8")))
+    assert [row[:3] for row in rows[1:]] == [["block-1", "alice", "bob"]]
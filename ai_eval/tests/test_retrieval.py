@@ -0,0 +1,60 @@
+"""Tests for the retrieval of relevant attachment chunks."""
+
+from ai_eval.attachments import AttachmentsPrompt, _format_attachment
+from ai_eval.retrieval import BM25Index, chunk_text
+
+
+def test_chunk_text():
+    """Test texts are split in chunks of whole lines."""
+    text = "one two three\nfour five\nsix\n\n"
+    assert chunk_text(text, 4) == ["one two three\nfour five\n", "six\n\n"]
+    assert chunk_text(text, 100) == [text]
+    assert not chunk_text("\n\n")
+
+
+def test_bm25_search():
+    """Test documents are ranked by relevance, and unrelated ones left out."""
+    index = BM25Index([
+        "the recursion must stop on a base case",
+        "loops iterate over a list",
+        "a recursive function calls itself, recursion recursion",
+        "nothing relevant here",
+    ])
+    assert index.search("Recursion base case", 10) == [0, 2]
+    assert index.search("recursion", 1) == [2]
+    assert not index.search("unknown", 10)
+
+
+def test_attachments_prompt_select():
+    """Test only the relevant chunks are selected when over the token budget, in order."""
+    chunks = ("about loops", "about recursion", "about lists and loops")
+    prompt = AttachmentsPrompt(
+        text="\n".join(chunks),
+        tokens=30,
+        chunks=chunks,
+        chunk_tokens=(10, 10, 10),
+        index=BM25Index(list(chunks)),
+    )
+    assert prompt.select("loops", 0, 8) == prompt.text
+    assert prompt.select("loops", 30, 8) == prompt.text
+    assert prompt.select("lists loops", 20, 8) == "about loops\nabout lists and loops"
+    assert prompt.select("lists loops", 10, 8) == "about lists and loops"
+    assert prompt.select("lists loops", 20, 1) == "about lists and loops"
+
+
+def test_attachments_prompt_select_fallback():
+    """Test the leading chunks are selected when no chunk is relevant or fits the budget."""
+    chunks = (_format_attachment("a.txt", "about loops & lists"), _format_attachment("a.txt", "about recursion"))
+    prompt = AttachmentsPrompt(
+        text="\n".join(chunks),
+        tokens=30,
+        chunks=chunks,
+        chunk_tokens=(20, 10),
+        index=BM25Index(list(chunks)),
+    )
+    assert prompt.select("unknown", 25, 8) == chunks[0]
+    assert prompt.select("recursion", 5, 8) == _format_attachment("a.txt", "")
+    # The contents are truncated, without leaving half an entity or the closing tags out
+    truncated = prompt.select("unknown", 19, 8)
+    assert truncated == _format_attachment("a.txt", "about loops ")
+    assert truncated.strip().endswith("</contents>\n                </attachment>")
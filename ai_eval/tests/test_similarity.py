@@ -0,0 +1,144 @@
+"""Tests for the detection of near-duplicate submissions."""
+
+from unittest.mock import patch
+
+from django.core.cache import cache
+
+from ai_eval.similarity import (
+    MAX_CLUSTER_SAMPLE,
+    MAX_REPRESENTATIVE_LENGTH,
+    SubmissionClusters,
+    cluster_submission,
+    get_clustering_executor,
+    estimate_similarity,
+    get_minhash_signature,
+    get_normalized_hash,
+    normalize_code,
+)
+
+PYTHON_CODE = """
+def total(values):
+    # add all the values
+    result = 0
+    for value in values:
+        result += value
+    return result
+
+print(total([1, 2, 3]))
+"""
+
+PYTHON_CODE_RENAMED = """
+def add_up(numbers):
+    s = 0
+
+    for n in numbers:   # loop
+        s += n
+    return s
+print(add_up([1, 2, 3]))
+"""
+
+
+def test_normalize_python():
+    """Test Python code differing by comments, whitespace and names normalizes the same."""
+    tokens = normalize_code(PYTHON_CODE, "Python")
+    assert "#" not in " ".join(tokens)
+    assert "for" in tokens and "ID" in tokens and "values" not in tokens
+    assert tokens == normalize_code(PYTHON_CODE_RENAMED, "Python")
+
+
+def test_normalize_python_invalid():
+    """Test Python code which does not tokenize is normalized with the generic lexer."""
+    assert normalize_code("def f(:\n  '''unterminated", "Python")
+
+
+def test_normalize_javascript():
+    """Test the comments and identifiers of JavaScript code are normalized."""
+    code = "// sum\nfunction sum(a, b) { /* add */ return a + b; }"
+    other = "function add(x,y){\n  return x + y;\n}"
+    assert normalize_code(code, "JavaScript") == normalize_code(other, "JavaScript")
+    assert normalize_code(code, "JavaScript")[:2] == ["function", "ID"]
+
+
+def test_normalize_html_keeps_names():
+    """Test tag names are kept for HTML, as they are its content."""
+    assert normalize_code("<p>hi</p><!-- comment -->", "HTML/CSS") == ["<", "p", ">", "hi", "<", "/", "p", ">"]
+
+
+def test_minhash_similarity():
+    """Test the estimated similarity follows how much code two submissions share."""
+    tokens = normalize_code(PYTHON_CODE, "Python")
+    signature = get_minhash_signature(tokens)
+    assert estimate_similarity(signature, get_minhash_signature(list(tokens))) == 1
+    edited = normalize_code(PYTHON_CODE + "print(total([4]))\n", "Python")
+    assert 0.5 < estimate_similarity(signature, get_minhash_signature(edited)) < 1
+    unrelated = normalize_code("import os\nos.listdir('.')\nwhile True:\n    pass\n", "Python")
+    assert estimate_similarity(signature, get_minhash_signature(unrelated)) < 0.3
+    assert get_minhash_signature([]) is None
+
+
+def test_normalize_code_keeping_names():
+    """Test normalized code keeping its names differs by names and builtins only."""
+    tokens = normalize_code(PYTHON_CODE, "Python", keep_names=True)
+    assert tokens == normalize_code(PYTHON_CODE.replace("# add all the values", ""), "Python", keep_names=True)
+    assert tokens != normalize_code(PYTHON_CODE_RENAMED, "Python", keep_names=True)
+    assert normalize_code("print(min(a))", "Python", keep_names=True) != normalize_code(
+        "print(max(a))", "Python", keep_names=True
+    )
+    tokens = normalize_code("let a = min(b);", "JavaScript", keep_names=True)
+    assert tokens == ["let", "a", "=", "min", "(", "b", ")", ";"]
+
+
+def test_submission_clusters():
+    """Test similar submissions are counted in the same cluster, kept in the cache."""
+    cache.clear()
+    clusters = SubmissionClusters("block-v1:course+type@coding_ai_eval+block@1")
+    original = normalize_code(PYTHON_CODE, "Python")
+    assert clusters.find(original) is None
+    key = clusters.add(original, PYTHON_CODE, "1")
+
+    assert clusters.find(normalize_code(PYTHON_CODE_RENAMED, "Python")) == (key, 1.0)
+    edited_code = PYTHON_CODE.replace("print(total([1, 2, 3]))", "print(total([1, 2, 3]), 'done')")
+    edited = normalize_code(edited_code, "Python")
+    match = clusters.find(edited, threshold=0.5)
+    assert match[0] == key
+    assert 0.5 <= match[1] < 1
+    assert clusters.add(edited, edited_code, "2") == key
+    unrelated_code = "import os\nfor name in os.listdir('.'):\n    print(name.upper())\n"
+    unrelated = normalize_code(unrelated_code, "Python")
+    assert clusters.find(unrelated, threshold=0.5) is None
+    other = clusters.add(unrelated, unrelated_code, "3")
+
+    assert clusters.get_clusters() == [
+        {"key": key, "size": 2, "code": PYTHON_CODE, "members": ["1", "2"]},
+        {"key": other, "size": 1, "code": unrelated_code, "members": ["3"]},
+    ]
+    assert SubmissionClusters("another block").get_clusters() == []
+    assert clusters.add([], "", "4") is None
+
+
+def test_submission_clusters_sample():
+    """Test a cluster only keeps a sample of its members and the start of its code."""
+    cache.clear()
+    clusters = SubmissionClusters("block-1")
+    code = "x = 1\n" * MAX_REPRESENTATIVE_LENGTH
+    tokens = normalize_code(code, "Python")
+    for member in range(MAX_CLUSTER_SAMPLE + 5):
+        clusters.add(tokens, code, str(member))
+    [cluster] = clusters.get_clusters()
+    assert cluster["size"] == MAX_CLUSTER_SAMPLE + 5
+    assert cluster["members"] == [str(member) for member in range(MAX_CLUSTER_SAMPLE)]
+    assert cluster["code"] == code[:MAX_REPRESENTATIVE_LENGTH]
+
+
+def test_cluster_submission():
+    """Test submissions are clustered in the background, and their errors are logged."""
+    cache.clear()
+    get_clustering_executor().submit(cluster_submission, "block-1", PYTHON_CODE, "Python", "1").result()
+    get_clustering_executor().submit(cluster_submission, "block-1", PYTHON_CODE_RENAMED, "Python", "2").result()
+    [cluster] = SubmissionClusters("block-1").get_clusters()
+    assert cluster["size"] == 2
+    assert cluster["members"] == ["1", "2"]
+    with patch("ai_eval.similarity.normalize_code", side_effect=ValueError), \
+            patch("ai_eval.similarity.logger") as mock_logger:
+        assert cluster_submission("block-1", PYTHON_CODE, "Python", "3") is None
+    mock_logger.exception.assert_called_once()
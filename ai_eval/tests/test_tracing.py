@@ -0,0 +1,103 @@
+"""Tests for the tracing of the handlers and upstream calls."""
+
+import json
+
+import pytest
+
+from ai_eval import metrics, tracing
+
+TRACE_ID = "0123456789abcdef0123456789abcdef"
+SPAN_ID = "0123456789abcdef"
+
+
+@pytest.fixture(autouse=True)
+def reset_tracing():
+    """Start each test with tracing off."""
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@metrics.timed("judge0", "submit")
+def submit(fail=False):
+    if fail:
+        raise ValueError("Judge0 is down")
+    return "token"
+
+
+class Block:
+    """A block with an instrumented handler calling an upstream service."""
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def _get_settings(self):
+        return self.settings
+
+    @metrics.instrument_handler
+    def submit_code_handler(self, data, suffix=""):  # pylint: disable=unused-argument
+        return submit(data.get("fail"))
+
+
+def read_spans(path):
+    with open(path, encoding="utf-8") as spans:
+        return [json.loads(line) for line in spans]
+
+
+def test_tracing_is_off_by_default():
+    """Test no span is created without tracing settings."""
+    assert Block({}).submit_code_handler({"trace_id": TRACE_ID}) == "token"
+    assert tracing._tracer is None  # pylint: disable=protected-access
+
+
+def test_json_tracing(tmp_path):
+    """Test the spans of a handler and its upstream calls are written in the trace of the browser."""
+    path = tmp_path / "spans.jsonl"
+    block = Block({"TRACING_EXPORTER": "json", "TRACING_JSON_PATH": str(path)})
+    block.submit_code_handler({"trace_id": TRACE_ID})
+
+    upstream, handler = read_spans(path)
+    assert handler["name"] == "Block.submit_code_handler"
+    assert handler["trace_id"] == TRACE_ID
+    assert handler["parent_id"] is None
+    assert handler["attributes"] == {"handler": "submit_code_handler"}
+    assert upstream["name"] == "judge0.submit"
+    assert upstream["trace_id"] == TRACE_ID
+    assert upstream["parent_id"] == handler["span_id"]
+    assert upstream["duration"] <= handler["duration"]
+
+
+def test_json_tracing_parent_span(tmp_path):
+    """Test the spans of the handlers are children of the span of the submission in the browser."""
+    path = tmp_path / "spans.jsonl"
+    block = Block({"TRACING_EXPORTER": "json", "TRACING_JSON_PATH": str(path)})
+    block.submit_code_handler({"trace_id": TRACE_ID, "parent_span_id": SPAN_ID})
+    block.submit_code_handler({"trace_id": TRACE_ID, "parent_span_id": "not a span"})
+    block.submit_code_handler({"parent_span_id": SPAN_ID})
+
+    handlers = [span for span in read_spans(path) if span["name"] == "Block.submit_code_handler"]
+    assert [handler["parent_id"] for handler in handlers] == [SPAN_ID, None, None]
+
+
+def test_json_tracing_errors_and_invalid_trace_ids(tmp_path):
+    """Test errors are recorded on spans, and invalid trace ids are replaced."""
+    path = tmp_path / "spans.jsonl"
+    block = Block({"TRACING_EXPORTER": "json", "TRACING_JSON_PATH": str(path)})
+    with pytest.raises(ValueError):
+        block.submit_code_handler({"trace_id": "<script>", "fail": True})
+
+    upstream, handler = read_spans(path)
+    assert upstream["error"] == handler["error"] == "ValueError: Judge0 is down"
+    assert len(handler["trace_id"]) == 32
+    assert handler["trace_id"] != "<script>"
+    assert upstream["trace_id"] == handler["trace_id"]
+
+
+@pytest.mark.parametrize("settings", [
+    {"TRACING_EXPORTER": "json"},
+    {"TRACING_EXPORTER": "zipkin"},
+])
+def test_tracing_invalid_settings(settings):
+    """Test tracing stays off with invalid settings."""
+    tracing.configure_tracing(settings)
+    assert tracing._tracer is None  # pylint: disable=protected-access
@@ -0,0 +1,196 @@
+"""
+Tracing of the handlers of the blocks and of their calls to Judge0 and LLMs.
+
+A submission to a coding block goes through several handlers: the code is
+submitted, its result is polled, then it is evaluated by the LLM. The JS
+generates a trace id and a span id for each submission and sends them to these
+handlers as `trace_id` and `parent_span_id`, so their spans, and the spans of
+the upstream calls they make, are grouped by submission, showing where its time
+goes.
+
+Spans are exported through OpenTelemetry, when its API is installed and
+configured by the platform, or written as JSON lines to a local file. Tracing
+is off unless `TRACING_EXPORTER` is set in the XBlock settings. The JSON spans
+of the handlers are in the trace of the submission, children of its span in
+the browser. OpenTelemetry spans stay in the trace of the request, sampled by
+the sampler of the platform, and link to the span of the submission.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import re
+import secrets
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTERS = ("json", "opentelemetry")
+TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+SPAN_ID_RE = re.compile(r"^[0-9a-f]{16}$")
+
+
+@dataclass
+class Span:
+    """
+    A timed operation of a trace, as written by the JSON exporter.
+    """
+
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    name: str
+    start: float
+    duration: float = 0.0
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+
+
+def new_trace_id() -> str:
+    """
+    Generate a trace id, 32 hexadecimal digits like the W3C and OpenTelemetry ones.
+    """
+    return secrets.token_hex(16)
+
+
+def _new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+class JsonTracer:
+    """
+    Writes the spans to a file as JSON lines, as they end.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.current = contextvars.ContextVar("ai_eval_span", default=None)
+
+    @contextlib.contextmanager
+    def span(self, name: str, trace_id: str | None, parent_span_id: str | None, attributes: dict):
+        """
+        Time an operation, as a child of the current span or of the span `parent_span_id` of `trace_id`.
+        """
+        parent = self.current.get()
+        span = Span(
+            trace_id=parent.trace_id if parent else trace_id or new_trace_id(),
+            span_id=_new_span_id(),
+            parent_id=parent.span_id if parent else (parent_span_id if trace_id else None),
+            name=name,
+            start=time.time(),
+            attributes=attributes,
+        )
+        token = self.current.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            self.current.reset(token)
+            self.export(span)
+
+    def export(self, span: Span) -> None:
+        """
+        Append a span to the file, logging the errors rather than failing the traced operation.
+        """
+        line = json.dumps(asdict(span), default=str) + "\n"
+        try:
+            with self.lock, open(self.path, "a", encoding="utf-8") as output:
+                output.write(line)
+        except OSError as e:
+            logger.warning(f"Could not export the span {span.name}: {e}")
+
+
+class OpenTelemetryTracer:
+    """
+    Creates the spans with the OpenTelemetry API, exported by the SDK set up by the platform.
+    """
+
+    def __init__(self):
+        # pylint: disable=import-outside-toplevel
+        from opentelemetry import trace
+
+        self.trace = trace
+        self.tracer = trace.get_tracer(__name__)
+
+    @contextlib.contextmanager
+    def span(self, name: str, trace_id: str | None, parent_span_id: str | None, attributes: dict):
+        """
+        Time an operation, as a child of the current span, linked to the span `parent_span_id` of `trace_id`.
+
+        The span is sampled by the sampler of the platform, the browser does not decide it.
+        """
+        links = []
+        if trace_id:
+            attributes = {**attributes, "ai_eval.trace_id": trace_id}
+            if parent_span_id:
+                submission = self.trace.SpanContext(
+                    trace_id=int(trace_id, 16), span_id=int(parent_span_id, 16), is_remote=True
+                )
+                links.append(self.trace.Link(submission))
+        with self.tracer.start_as_current_span(name, links=links, attributes=attributes) as span:
+            yield span
+
+
+_tracer: JsonTracer | OpenTelemetryTracer | None = None
+_no_span = contextlib.nullcontext()
+
+
+def configure_tracing(settings: dict) -> None:
+    """
+    Set up the exporter of the spans from the XBlock settings.
+
+    The settings are `TRACING_EXPORTER`, "json" or "opentelemetry", and with the
+    JSON exporter `TRACING_JSON_PATH`, the file the spans are written to.
+    """
+    global _tracer  # pylint: disable=global-statement
+    _tracer = None
+    exporter = settings.get("TRACING_EXPORTER")
+    if exporter == "json":
+        if path := settings.get("TRACING_JSON_PATH"):
+            _tracer = JsonTracer(path)
+        else:
+            logger.warning("TRACING_JSON_PATH is required by the json tracing exporter, tracing is off.")
+    elif exporter == "opentelemetry":
+        try:
+            _tracer = OpenTelemetryTracer()
+        except ImportError:
+            logger.warning("opentelemetry-api is not installed, tracing is off.")
+    elif exporter:
+        logger.warning(f"Unknown tracing exporter {exporter}, expected one of {', '.join(TRACING_EXPORTERS)}.")
+
+
+def span(name: str, trace_id: str | None = None, parent_span_id: str | None = None, **attributes):
+    """
+    Get a context manager timing an operation as a span, when tracing is on.
+
+    Args:
+        name: The name of the operation.
+        trace_id: The trace of the operation, when it is not the child of another span.
+            Invalid ids are replaced by new ones.
+        parent_span_id: The span of the operation in the browser, in `trace_id`.
+            Invalid ids are ignored.
+        attributes: The attributes of the span.
+    """
+    if _tracer is None:
+        return _no_span
+    if trace_id is not None and not (isinstance(trace_id, str) and TRACE_ID_RE.match(trace_id)):
+        trace_id = None
+    if parent_span_id is not None and not (isinstance(parent_span_id, str) and SPAN_ID_RE.match(parent_span_id)):
+        parent_span_id = None
+    return _tracer.span(name, trace_id, parent_span_id, attributes)
+
+
+def reset() -> None:
+    """
+    Turn tracing off.
+    """
+    global _tracer  # pylint: disable=global-statement
+    _tracer = None
@@ -2,9 +2,17 @@
 Utilities
 """
 
+import difflib
+import functools
+import hashlib
 from dataclasses import dataclass
+
+import bleach
+import markdown
 import requests
 
+from .metrics import timed
+
 
 @dataclass
 class ProgrammimgLanguage:
@@ -48,7 +56,22 @@ SUPPORTED_LANGUAGE_MAP = {
 
 JUDGE0_BASE_CE_URL = "https://judge0-ce.p.rapidapi.com"
 
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables", "sane_lists"]
+ALLOWED_HTML_TAGS = bleach.sanitizer.ALLOWED_TAGS | {
+    "p", "pre", "br", "hr", "span", "div", "del", "img",
+    "h1", "h2", "h3", "h4", "h5", "h6",
+    "table", "thead", "tbody", "tr", "th", "td",
+}
+ALLOWED_HTML_ATTRIBUTES = {
+    **bleach.sanitizer.ALLOWED_ATTRIBUTES,
+    "img": ["src", "alt", "title"],
+    "code": ["class"],
+    "th": ["align"],
+    "td": ["align"],
+}
 
+
+@timed("judge0", "submit")
 def submit_code(api_key: str, code: str, language: str) -> str:
     """
     Submit code to the judge0 API.
@@ -69,6 +92,7 @@ def submit_code(api_key: str, code: str, language: str) -> str:
     return sub_id
 
 
+@timed("judge0", "get_result")
 def get_submission_result(api_key: str, submission_id: str):
     """
     Get result from Judge0 submission.
@@ -82,3 +106,60 @@ def get_submission_result(api_key: str, submission_id: str):
     result = response.json()
 
     return result
+
+
+def get_content_hash(content: str) -> str:
+    """
+    Get a short, stable hash of a text content.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def make_text_diff(old: str, new: str) -> list:
+    """
+    Get a compact line diff turning `old` into `new`.
+
+    The diff is a JSON serializable list of `[start, end, text]` edits, each one
+    replacing the lines `start:end` of `old` with `text`.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [
+        [i1, i2, "".join(new_lines[j1:j2])]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_text_diff(old: str, diff: list) -> str:
+    """
+    Apply a diff made by `make_text_diff` to `old`.
+    """
+    old_lines = old.splitlines(keepends=True)
+    result = []
+    position = 0
+    for start, end, text in diff:
+        result.extend(old_lines[position:start])
+        result.append(text)
+        position = end
+    result.extend(old_lines[position:])
+    return "".join(result)
+
+
+def render_markdown(text: str) -> str:
+    """
+    Render Markdown text to sanitized HTML.
+    """
+    html = markdown.markdown(text or "", extensions=MARKDOWN_EXTENSIONS)
+    return bleach.clean(html, tags=ALLOWED_HTML_TAGS, attributes=ALLOWED_HTML_ATTRIBUTES, strip=True)
+
+
+@functools.lru_cache(maxsize=512)
+def render_markdown_cached(text: str) -> str:
+    """
+    Render Markdown text to sanitized HTML, cached per text for the whole process.
+
+    Meant for author content like questions, which only changes with the block.
+    """
+    return render_markdown(text)
@@ -31,7 +31,9 @@ setup(
     ],
     install_requires=[
         "XBlock",
+        "bleach",
         "litellm>=1.42",
+        "markdown",
     ],
     entry_points={
         "xblock.v1": [